@@ -0,0 +1,117 @@
+import models.surface_feat_generator as surface_feat_generator
+import models.original_discriminator as discriminators
+import config
+
+import torch
+import torch.nn.functional as F
+
+import argparse
+from time import time
+
+# name, options of the activation checkpointing
+DEFAULT_CONFIGS = [
+    ('none', []),
+    ('D_down', ['--checkpoint_D_down', '0', '1', '2']),
+    ('D_all', ['--checkpoint_D_down', '0', '1', '2', '3', '4', '5', '--checkpoint_D_up', '0', '1', '2', '3', '4', '5']),
+    ('G_2', ['--checkpoint_G_layers', '2']),
+    ('G_2+D_all', ['--checkpoint_G_layers', '2',
+                   '--checkpoint_D_down', '0', '1', '2', '3', '4', '5', '--checkpoint_D_up', '0', '1', '2', '3', '4', '5']),
+]
+
+
+def get_opt(args, checkpoint_args):
+    parser = argparse.ArgumentParser()
+    parser = config.add_all_arguments(parser, train=True)
+    opt = parser.parse_args([
+        '--model', 'surface_feat',
+        '--label_nc', str(args.num_labels - 1), '--semantic_nc', str(args.num_labels),
+        '--z_mapping_type', 'mapping_net', '--z_mapping_dim', '256',
+        '--surface_feat_model_convblock_type', 'None',
+        '--mlp_hdim', str(args.mlp_hdim),
+    ] + checkpoint_args + args.extra)
+    opt.phase = 'train'
+    opt.crop_size = args.size
+    opt.aspect_ratio = 1.0
+    return opt
+
+
+def make_batch(args, device):
+    low = args.size // 16
+    coord = torch.rand(args.batch_size, 3, low, low) * 2 - 1
+    coord = F.interpolate(coord, size=(args.size, args.size), mode='bicubic', align_corners=False).clamp(-1, 1)
+    label = torch.randint(0, args.num_labels, (args.batch_size, 1, low, low))
+    label = F.interpolate(label.float(), size=(args.size, args.size), mode='nearest').long()
+    one_hot = torch.zeros(args.batch_size, args.num_labels, args.size, args.size).scatter_(1, label, 1.0)
+    real = torch.rand(args.batch_size, 3, args.size, args.size) * 2 - 1
+    return one_hot.to(device), coord.to(device), real.to(device)
+
+
+def sync(device):
+    if device == 'cuda':
+        torch.cuda.synchronize()
+
+
+def step(netG, netD, batch, z):
+    """G forward, D on the fake and the real image, one backward through both."""
+    label, coord, real = batch
+    fake, _ = netG(label, coord, z=z)
+    loss = netD(fake).mean() - netD(real).mean()
+    netG.zero_grad()
+    netD.zero_grad()
+    loss.backward()
+
+
+def run(args, name, opt, batch, device, reference_grads):
+    torch.manual_seed(0)
+    netG = surface_feat_generator.OASIS_Generator(opt).to(device)
+    netD = discriminators.OASIS_Discriminator(opt).to(device)
+    z = torch.randn(args.batch_size, opt.z_dim, device=device)
+
+    # gradients of the first step, from the same initialization as the reference
+    step(netG, netD, batch, z)
+    grads = [p.grad.detach().clone() for p in list(netG.parameters()) + list(netD.parameters()) if p.grad is not None]
+    if reference_grads is None:
+        reference_grads = grads
+    grad_diff = max((a - b).abs().max().item() for a, b in zip(grads, reference_grads))
+
+    if device == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+    elapsed = 0
+    for i in range(args.steps):
+        sync(device)
+        start = time()
+        step(netG, netD, batch, z)
+        sync(device)
+        if i >= args.warmup:
+            elapsed += time() - start
+    ips = args.batch_size * (args.steps - args.warmup) / elapsed
+    memory = '%8.0f MB' % (torch.cuda.max_memory_allocated() / 1024 ** 2) if device == 'cuda' else '     n/a'
+
+    print('{:>12} | {:8.2f} img/s | peak memory {} | max grad difference {:.2e}'.format(name, ips, memory, grad_diff))
+    return reference_grads
+
+
+def main():
+    parser = argparse.ArgumentParser(description='memory and throughput of the activation checkpointing options')
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--num_labels', type=int, default=16)
+    parser.add_argument('--mlp_hdim', type=int, default=740)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--gpu_ids', type=str, default='0')
+    parser.add_argument('extra', nargs=argparse.REMAINDER, help='options passed on to config.py')
+    args = parser.parse_args()
+    args.extra = [a for a in args.extra if a != '--']
+
+    device = 'cpu' if args.gpu_ids == '-1' else 'cuda'
+    torch.manual_seed(1)
+    batch = make_batch(args, device)
+    reference_grads = None
+    for name, checkpoint_args in DEFAULT_CONFIGS:
+        opt = get_opt(args, checkpoint_args)
+        reference_grads = run(args, name, opt, batch, device, reference_grads)
+
+
+if __name__ == '__main__':
+    main()
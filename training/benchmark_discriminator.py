@@ -0,0 +1,87 @@
+import models.original_discriminator as discriminators
+import config
+
+import torch
+
+import argparse
+from time import time
+
+
+def get_opt(args):
+    parser = argparse.ArgumentParser()
+    parser = config.add_all_arguments(parser, train=True)
+    opt = parser.parse_args(['--semantic_nc', str(args.semantic_nc), '--channels_D'] +
+                            [str(c) for c in args.channels_D] + args.extra)
+    opt.phase = 'train'
+    return opt
+
+
+def sync(device):
+    if device == 'cuda':
+        torch.cuda.synchronize()
+
+
+def run_separate(netD, inputs):
+    return [netD(x) for x in inputs]
+
+
+def run_batched(netD, inputs):
+    out = netD(torch.cat(inputs, dim=0))
+    return list(out.split([x.size(0) for x in inputs], dim=0))
+
+
+def benchmark(netD, run, inputs, args, device):
+    elapsed = 0
+    for step in range(args.steps):
+        sync(device)
+        start = time()
+        outputs = run(netD, inputs)
+        loss = sum(out.mean() for out in outputs)
+        netD.zero_grad()
+        loss.backward()
+        sync(device)
+        if step >= args.warmup:
+            elapsed += time() - start
+    return (args.steps - args.warmup) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='per-input vs batched discriminator forward/backward in the D step')
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--num_inputs', type=int, default=4, help='fake, pseudo, real and labelmix')
+    parser.add_argument('--semantic_nc', type=int, default=16)
+    parser.add_argument('--channels_D', nargs='+', type=int, default=[3, 64, 64, 128, 128, 256, 512])
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--gpu_ids', type=str, default='0')
+    parser.add_argument('extra', nargs=argparse.REMAINDER, help='options passed on to config.py')
+    args = parser.parse_args()
+    args.extra = [a for a in args.extra if a != '--']
+
+    device = 'cpu' if args.gpu_ids == '-1' else 'cuda'
+    opt = get_opt(args)
+    torch.manual_seed(0)
+    netD = discriminators.OASIS_Discriminator(opt).to(device)
+    inputs = [torch.randn(args.batch_size, 3, args.size, args.size, device=device) for _ in range(args.num_inputs)]
+
+    # both modes have to give the same outputs (eval mode freezes the spectral norm power iteration)
+    netD.eval()
+    with torch.no_grad():
+        diff = max((a - b).abs().max().item()
+                   for a, b in zip(run_separate(netD, inputs), run_batched(netD, inputs)))
+    netD.train()
+
+    separate = benchmark(netD, run_separate, inputs, args, device)
+    batched = benchmark(netD, run_batched, inputs, args, device)
+    print('max abs output difference: %.2e' % diff)
+    print('per-input: %.2f D steps/s | batched: %.2f D steps/s | speedup %.2fx' % (separate, batched, batched / separate))
+    if device == 'cuda':
+        for name, run in [('per-input', run_separate), ('batched', run_batched)]:
+            torch.cuda.reset_peak_memory_stats()
+            benchmark(netD, run, inputs, argparse.Namespace(steps=2, warmup=0), device)
+            print('%s peak memory: %.0f MB' % (name, torch.cuda.max_memory_allocated() / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import models.surface_feat_generator as surface_feat_generator
+import config
+
+import torch
+import torch.nn.functional as F
+
+import argparse
+import math
+from time import time
+
+# encoding, mlp_hdim, G_num_layers
+DEFAULT_CONFIGS = ['nerf,740,7', 'hashgrid,64,3', 'hashgrid,128,4']
+
+
+def get_opt(args, pos_encoding_model, mlp_hdim, num_layers):
+    parser = argparse.ArgumentParser()
+    parser = config.add_all_arguments(parser, train=False)
+    opt = parser.parse_args([
+        '--model', 'surface_feat',
+        '--label_nc', str(args.num_labels - 1), '--semantic_nc', str(args.num_labels),
+        '--z_mapping_type', 'mapping_net', '--z_mapping_dim', '256',
+        '--surface_feat_model_convblock_type', 'None',
+        '--pos_encoding_model', pos_encoding_model,
+        '--pos_encoding_num_freq', str(args.pos_encoding_num_freq),
+        '--mlp_hdim', str(mlp_hdim), '--G_num_layers', str(num_layers),
+    ] + args.extra)
+    opt.phase = 'test'
+    opt.crop_size = args.size
+    opt.aspect_ratio = 1.0
+    return opt
+
+
+def make_frames(args, num_frames, generator):
+    """Smooth random surfaces in [-1, 1]^3 as coordinate images and random region labels."""
+    low = args.size // 16
+    coord = torch.rand(num_frames, 3, low, low, generator=generator) * 2 - 1
+    coord = F.interpolate(coord, size=(args.size, args.size), mode='bicubic', align_corners=False).clamp(-1, 1)
+    label = torch.randint(0, args.num_labels, (num_frames, 1, low, low), generator=generator)
+    label = F.interpolate(label.float(), size=(args.size, args.size), mode='nearest').long()
+    return coord, label
+
+
+def texture(coord, label, args):
+    """High-frequency 3D texture the generator has to reproduce."""
+    freq = torch.tensor([[7., 13., 3.], [11., 2., 17.], [5., 19., 9.]]) * args.texture_freq / 10
+    phase = coord.permute(0, 2, 3, 1) @ freq.t()
+    rgb = torch.sin(math.pi * phase + label.permute(0, 2, 3, 1).float())
+    return rgb.permute(0, 3, 1, 2)
+
+
+def one_hot(label, num_labels):
+    out = torch.zeros(label.size(0), num_labels, label.size(2), label.size(3), device=label.device)
+    return out.scatter_(1, label, 1.0)
+
+
+def sync(device):
+    if device == 'cuda':
+        torch.cuda.synchronize()
+
+
+def run(args, name, opt, train_data, test_data, device):
+    torch.manual_seed(0)
+    netG = surface_feat_generator.OASIS_Generator(opt).to(device)
+    num_params = sum(p.numel() for p in netG.parameters())
+    optimizer = torch.optim.Adam(netG.parameters(), lr=args.lr, betas=(0.9, 0.99))
+    z = torch.zeros(args.batch_size, opt.z_dim, device=device)
+
+    train_coord, train_label, train_rgb = train_data
+    elapsed = 0
+    for step in range(args.steps):
+        idx = torch.randint(0, train_coord.size(0), (args.batch_size,))
+        coord, label, rgb = train_coord[idx].to(device), train_label[idx].to(device), train_rgb[idx].to(device)
+        sync(device)
+        start = time()
+        fake, _ = netG(one_hot(label, opt.semantic_nc), coord, z=z)
+        loss = F.mse_loss(fake, rgb)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        sync(device)
+        if step >= args.warmup:
+            elapsed += time() - start
+    train_ips = args.batch_size * (args.steps - args.warmup) / elapsed
+
+    test_coord, test_label, test_rgb = test_data
+    mse, elapsed = 0, 0
+    with torch.no_grad():
+        for start_idx in range(0, test_coord.size(0), args.batch_size):
+            coord = test_coord[start_idx:start_idx + args.batch_size].to(device)
+            label = test_label[start_idx:start_idx + args.batch_size].to(device)
+            rgb = test_rgb[start_idx:start_idx + args.batch_size].to(device)
+            sync(device)
+            start = time()
+            fake, _ = netG(one_hot(label, opt.semantic_nc), coord, z=z[:coord.size(0)])
+            sync(device)
+            elapsed += time() - start
+            mse += F.mse_loss(fake, rgb, reduction='sum').item()
+    mse /= test_rgb.numel()
+    psnr = 10 * math.log10(4 / mse)  # images are in [-1, 1]
+    test_ips = test_coord.size(0) / elapsed
+
+    print('{:>24} | params {:>10,d} | train {:8.1f} img/s | test {:8.1f} img/s | test PSNR {:6.2f} dB'.format(
+        name, num_params, train_ips, test_ips, psnr))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compare positional encodings of the surface feature generator')
+    parser.add_argument('--configs', nargs='+', default=DEFAULT_CONFIGS, help='encoding,mlp_hdim,G_num_layers')
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--num_frames', type=int, default=32)
+    parser.add_argument('--num_labels', type=int, default=16)
+    parser.add_argument('--pos_encoding_num_freq', type=int, default=4)
+    parser.add_argument('--texture_freq', type=float, default=10.)
+    parser.add_argument('--gpu_ids', type=str, default='0')
+    parser.add_argument('extra', nargs=argparse.REMAINDER, help='options passed on to config.py, e.g. -- --hashgrid_log2_size 17')
+    args = parser.parse_args()
+    args.extra = [a for a in args.extra if a != '--']
+
+    device = 'cpu' if args.gpu_ids == '-1' else 'cuda'
+    generator = torch.Generator().manual_seed(0)
+    train_coord, train_label = make_frames(args, args.num_frames, generator)
+    test_coord, test_label = make_frames(args, max(args.num_frames // 4, 1), generator)
+    train_data = (train_coord, train_label, texture(train_coord, train_label, args))
+    test_data = (test_coord, test_label, texture(test_coord, test_label, args))
+
+    for config_str in args.configs:
+        pos_encoding_model, mlp_hdim, num_layers = config_str.split(',')
+        opt = get_opt(args, pos_encoding_model, int(mlp_hdim), int(num_layers))
+        run(args, config_str, opt, train_data, test_data, device)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmarks of pre_process/, run by benchmarks.run in a process of its own:
+
+    $ python -m benchmarks.bench_preprocess --root /tmp/synthetic_scene --json preprocess.json
+"""
+import os
+import sys
+import glob
+import pickle
+import argparse
+import tempfile
+
+from benchmarks.timing import measure, print_result, write_results
+from benchmarks.synthetic_scene import scene_dirs
+
+TRAINING_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRE_PROCESS_DIR = os.path.join(os.path.dirname(TRAINING_DIR), 'pre_process')
+# the pre_process scripts import their utils/ directory, which the utils package of training/ would shadow
+sys.path = [PRE_PROCESS_DIR] + [p for p in sys.path if os.path.abspath(p or '.') != TRAINING_DIR]
+
+from make_coordinate_image import get_coordinate_image, get_path_lists  # noqa: E402
+from convert_ade20k_to_scenenet_label import convert_label  # noqa: E402
+from utils.utils import exr2numpy  # noqa: E402
+
+
+def bench_exr2numpy(args, dirs):
+    depth_paths = sorted(glob.glob(os.path.join(dirs['depths'], 'Depth*')))
+    return measure(lambda: [exr2numpy(p, maxvalue=15, normalize=False) for p in depth_paths],
+                   args.repeat, args.warmup)
+
+
+def bench_get_coordinate_image(args, dirs):
+    paths = list(zip(*get_path_lists(dirs['raw_root'])))
+
+    def run():
+        for depth_path, image_path, camera_path, intr_path in paths:
+            get_coordinate_image(image_path, depth_path, camera_path, intr_path, use_ret_image=True)
+    return measure(run, args.repeat, args.warmup)
+
+
+def bench_convert_label(args, dirs):
+    with open(os.path.join(dirs['scene_root'], 'ade_to_scenenet.pickle'), 'rb') as f:
+        ade_to_scenenet = pickle.load(f)
+    with tempfile.TemporaryDirectory() as target_dir:
+        return measure(lambda: convert_label(ade_to_scenenet, dirs['raw_labels'], target_dir),
+                       args.repeat, args.warmup)
+
+
+# name, benchmark; every one processes all frames of the scene
+BENCHMARKS = [
+    ('exr2numpy', bench_exr2numpy),
+    ('get_coordinate_image', bench_get_coordinate_image),
+    ('convert_label', bench_convert_label),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmarks of pre_process/ on a synthetic scene')
+    parser.add_argument('--root', type=str, required=True, help='written by benchmarks.synthetic_scene')
+    parser.add_argument('--json', type=str, required=True)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--only', type=str, nargs='*', default=None)
+    args = parser.parse_args()
+
+    dirs = scene_dirs(args.root)
+    results = {}
+    for name, bench in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        results[name] = bench(args, dirs)
+        print_result(name, results[name])
+    write_results(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Benchmarks of the data loading, the networks and the training utilities, run by benchmarks.run:
+
+    $ python -m benchmarks.bench_training --root /tmp/synthetic_scene --json training.json --gpu_ids -1
+"""
+import copy
+import argparse
+
+import torch
+from torch.utils.data.dataloader import default_collate
+
+import config
+import models.surface_feat_models as surface_feat_models
+import models.surface_feat_generator as surface_feat_generator
+import models.original_discriminator as discriminators
+import utils.utils as utils
+from utils.fid_scores import fid_pytorch, torch_cov
+from utils.fid_stats import activation_statistics, frechet_distance, SCIPY_TOLERANCE
+from dataloaders.BlenderDataset import BlenderDataset
+import export_surface_colors
+from benchmarks.timing import measure, cuda_sync, print_result, write_results
+from benchmarks.synthetic_scene import scene_dirs
+
+
+def get_opt(args, dirs):
+    parser = argparse.ArgumentParser()
+    parser = config.add_all_arguments(parser, train=True)
+    opt = parser.parse_args([
+        '--model', 'surface_feat', '--dataset_mode', 'blender',
+        '--label_nc', str(args.num_labels - 1), '--semantic_nc', str(args.num_labels),
+        '--label_dir', dirs['labels_scenenet'],
+        '--coordinate_image_dir', dirs['coordinate_images'],
+        '--pseudo_label_dir', dirs['labels_ade20k'],
+        '--pseudo_image_dir', dirs['labels_ade20k'],
+        '--real_image_dir', dirs['real_images'],
+        '--real_label_dir', dirs['real_labels'],
+        '--z_mapping_type', 'mapping_net', '--z_mapping_dim', '256',
+        '--surface_feat_model_convblock_type', 'None',
+        '--mlp_hdim', str(args.mlp_hdim),
+        '--gpu_ids', args.gpu_ids, '--batch_size', str(args.batch_size), '--num_workers', '0',
+    ] + args.extra)
+    opt.phase = 'train'
+    return opt
+
+
+def get_batch(opt, dataset, batch_size):
+    """The first batch_size frames, through preprocess_input like in train.py."""
+    data = default_collate([dataset[i % len(dataset)] for i in range(batch_size)])
+    return surface_feat_models.preprocess_input(opt, data)
+
+
+def bench_blender_getitem(args, opt, device):
+    dataset = BlenderDataset(opt, for_metrics=False)
+    return measure(lambda: [dataset[i] for i in range(len(dataset))], args.repeat, args.warmup)
+
+
+def bench_blender_coordinate_image(args, opt, device):
+    dataset = BlenderDataset(opt, for_metrics=False)
+    return measure(lambda: [dataset.get_coordinate_image(path) for path in dataset.coord_images],
+                   args.repeat, args.warmup)
+
+
+def bench_mlp_forward_backward(args, opt, device):
+    dataset = BlenderDataset(opt, for_metrics=False)
+    label, coord = get_batch(opt, dataset, args.batch_size)[:2]
+    torch.manual_seed(0)
+    netG = surface_feat_generator.OASIS_Generator(opt).to(device)
+    z = torch.randn(args.batch_size, opt.z_dim, device=device)
+
+    def step():
+        fake, _ = netG(label, coord, z=z)
+        netG.zero_grad()
+        fake.mean().backward()
+    return measure(step, args.repeat, args.warmup, cuda_sync(device))
+
+
+def bench_discriminator_forward_backward(args, opt, device):
+    dataset = BlenderDataset(opt, for_metrics=False)
+    real_image = get_batch(opt, dataset, args.batch_size)[2]
+    torch.manual_seed(0)
+    netD = discriminators.OASIS_Discriminator(opt).to(device)
+
+    def step():
+        netD.zero_grad()
+        netD(real_image).mean().backward()
+    return measure(step, args.repeat, args.warmup, cuda_sync(device))
+
+
+def bench_ema_update(args, opt, device):
+    torch.manual_seed(0)
+    model = torch.nn.Module()
+    model.netG = surface_feat_generator.OASIS_Generator(opt).to(device)
+    model.netEMA = copy.deepcopy(model.netG)
+    ema_updater = utils.ema_updater(opt, model)
+    # an iteration without the batchnorm statistics update
+    cur_iter = 1
+    return measure(lambda: ema_updater(model, cur_iter, None, None), args.repeat, args.warmup, cuda_sync(device))
+
+
+def bench_fid_statistics(args, opt, device):
+    activations = torch.randn(args.fid_samples, args.fid_dims, device=device)
+    return measure(lambda: (torch.mean(activations, 0), torch_cov(activations.clone(), rowvar=False)),
+                   args.repeat, args.warmup, cuda_sync(device))
+
+
+def bench_fid_statistics_streaming(args, opt, device):
+    # the same activations in batches of 50, as fid_pytorch feeds them to activation_statistics
+    batches = torch.randn(args.fid_samples, args.fid_dims, device=device).split(50)
+
+    def run():
+        stats = activation_statistics(args.fid_dims, device)
+        for batch in batches:
+            stats.update(batch)
+        return stats.mu(), stats.sigma()
+    return measure(run, args.repeat, args.warmup, cuda_sync(device))
+
+
+def bench_frechet_distance(args, opt, device):
+    generator = torch.Generator().manual_seed(0)
+    stats = []
+    for _ in range(2):
+        activations = torch.randn(args.fid_samples, args.fid_dims, generator=generator)
+        stats += [torch.mean(activations, 0), torch_cov(activations, rowvar=False)]
+    # the method does not use the state of fid_pytorch, which would load Inception
+    return measure(lambda: fid_pytorch.numpy_calculate_frechet_distance(None, *stats),
+                   max(args.repeat // 4, 1), min(args.warmup, 1))
+
+
+def bench_texture_aggregation(args, opt, device):
+    opt.export_quantize = 3
+    dataset = BlenderDataset(opt, for_metrics=False)
+    dataloader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=0)
+    return measure(lambda: export_surface_colors.collect_unique_points(opt, dataloader), args.repeat, args.warmup)
+
+
+def bench_frechet_distance_eigh(args, opt, device):
+    generator = torch.Generator().manual_seed(0)
+    stats = []
+    for _ in range(2):
+        activations = torch.randn(args.fid_samples, args.fid_dims, generator=generator).double()
+        stats += [torch.mean(activations, 0).to(device), torch_cov(activations, rowvar=False).to(device)]
+    engine = frechet_distance(stats[0], stats[1])
+    result = measure(lambda: engine(stats[2], stats[3]), args.repeat, args.warmup, cuda_sync(device))
+    # the agreement with the scipy path, stored next to the timings
+    scipy_fid = fid_pytorch.numpy_calculate_frechet_distance(None, *stats)
+    result['scipy_rel_diff'] = abs(engine(stats[2], stats[3]) - scipy_fid) / abs(scipy_fid)
+    if result['scipy_rel_diff'] > SCIPY_TOLERANCE:
+        raise ValueError('the eigh FID differs from the scipy FID by %.2e (relative), more than SCIPY_TOLERANCE %.0e'
+                         % (result['scipy_rel_diff'], SCIPY_TOLERANCE))
+    return result
+
+
+# name, benchmark
+BENCHMARKS = [
+    ('blender_getitem', bench_blender_getitem),
+    ('blender_coordinate_image', bench_blender_coordinate_image),
+    ('mlp_forward_backward', bench_mlp_forward_backward),
+    ('discriminator_forward_backward', bench_discriminator_forward_backward),
+    ('ema_update', bench_ema_update),
+    ('fid_statistics', bench_fid_statistics),
+    ('fid_statistics_streaming', bench_fid_statistics_streaming),
+    ('frechet_distance', bench_frechet_distance),
+    ('frechet_distance_eigh', bench_frechet_distance_eigh),
+    ('texture_aggregation', bench_texture_aggregation),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmarks of training/ on a synthetic scene')
+    parser.add_argument('--root', type=str, required=True, help='written by benchmarks.synthetic_scene')
+    parser.add_argument('--json', type=str, required=True)
+    parser.add_argument('--num_labels', type=int, default=16)
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--mlp_hdim', type=int, default=740)
+    parser.add_argument('--fid_samples', type=int, default=1000)
+    parser.add_argument('--fid_dims', type=int, default=2048)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--gpu_ids', type=str, default='-1')
+    parser.add_argument('--only', type=str, nargs='*', default=None)
+    parser.add_argument('extra', nargs=argparse.REMAINDER, help='options passed on to config.py')
+    args = parser.parse_args()
+    args.extra = [a for a in args.extra if a != '--']
+
+    device = 'cpu' if args.gpu_ids == '-1' else 'cuda'
+    dirs = scene_dirs(args.root)
+    results = {}
+    for name, bench in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        results[name] = bench(args, get_opt(args, dirs), device)
+        print_result(name, results[name])
+    write_results(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
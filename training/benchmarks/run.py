@@ -0,0 +1,109 @@
+"""Writes a synthetic scene, runs the benchmark groups and writes their results to one JSON file.
+
+    $ python -m benchmarks.run --out results.json --gpu_ids -1
+    $ python -m benchmarks.run --out new.json --baseline results.json --tolerance 0.1
+
+With --baseline every benchmark is compared by its median, and the exit code is 1 when one of them
+is more than --tolerance slower.
+"""
+import os
+import sys
+import json
+import platform
+import argparse
+import tempfile
+import subprocess
+
+from benchmarks.synthetic_scene import make_scene
+from benchmarks.timing import write_results
+
+TRAINING_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# group, module; every group runs in a process of its own
+GROUPS = [
+    ('preprocess', 'benchmarks.bench_preprocess'),
+    ('training', 'benchmarks.bench_training'),
+]
+
+
+def run_group(args, module, root, json_path):
+    command = [sys.executable, '-m', module, '--root', root, '--json', json_path,
+               '--repeat', str(args.repeat), '--warmup', str(args.warmup)]
+    if module == 'benchmarks.bench_training':
+        command += ['--gpu_ids', args.gpu_ids, '--num_labels', str(args.num_labels)]
+    if args.only:
+        command += ['--only'] + args.only
+    subprocess.run(command, cwd=TRAINING_DIR, check=True)
+    with open(json_path) as f:
+        return json.load(f)
+
+
+def get_environment(args):
+    import torch
+    return {
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'device': torch.cuda.get_device_name() if args.gpu_ids != '-1' else 'cpu',
+        'num_threads': torch.get_num_threads(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Prints the ratio of every benchmark to the baseline, returns the names of the regressions."""
+    regressions = []
+    print('{:>42} | {:>12} | {:>12} | {:>7}'.format('benchmark', 'baseline ms', 'new ms', 'ratio'))
+    for group, group_results in results['benchmarks'].items():
+        for name, result in group_results.items():
+            old = baseline['benchmarks'].get(group, {}).get(name)
+            key = '%s/%s' % (group, name)
+            if old is None:
+                print('{:>42} | {:>12} | {:12.3f} | {:>7}'.format(key, '-', result['median_ms'], 'new'))
+                continue
+            ratio = result['median_ms'] / old['median_ms']
+            flag = ' slower' if ratio > 1 + tolerance else (' faster' if ratio < 1 - tolerance else '')
+            print('{:>42} | {:12.3f} | {:12.3f} | {:7.3f}{}'.format(key, old['median_ms'], result['median_ms'],
+                                                                      ratio, flag))
+            if ratio > 1 + tolerance:
+                regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark suite on a synthetic scene')
+    parser.add_argument('--out', type=str, required=True, help='JSON file of the results')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative slowdown of the median')
+    parser.add_argument('--root', type=str, default=None, help='directory of the synthetic scene, temporary by default')
+    parser.add_argument('--num_frames', type=int, default=8)
+    parser.add_argument('--size', type=int, default=256, help='BlenderDataset loads 256 x 256 frames')
+    parser.add_argument('--num_labels', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--gpu_ids', type=str, default='-1')
+    parser.add_argument('--groups', type=str, nargs='+', default=[group for group, _ in GROUPS])
+    parser.add_argument('--only', type=str, nargs='*', default=None, help='names of the benchmarks to run')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = args.root if args.root is not None else os.path.join(tmp_dir, 'scene')
+        make_scene(root, num_frames=args.num_frames, size=args.size, num_labels=args.num_labels)
+        results = {'environment': get_environment(args), 'args': vars(args), 'benchmarks': {}}
+        for group, module in GROUPS:
+            if group in args.groups:
+                results['benchmarks'][group] = run_group(args, module, root, os.path.join(tmp_dir, group + '.json'))
+    write_results(args.out, results)
+    print('Wrote %s' % args.out)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('Slower than the baseline: %s' % ', '.join(regressions))
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
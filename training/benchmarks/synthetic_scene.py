@@ -0,0 +1,140 @@
+"""Writes a small synthetic scene in the layouts of the real data, for the benchmarks.
+
+    {root}/scene_raw_data/     Blender output read by pre_process/make_dataset.py
+        depths/Depth%04d.exr, labels/Segmentation%04d.png (ADE20k ids),
+        cameras/Camera_%04d.npz (rotation, translation), cameras/intrinsic_%04d.npz (fx, fy, cx, cy)
+    {root}/scene/              what make_dataset.py writes, read by BlenderDataset
+        coordinate_images/Segmentation%04d.png.exr, labels_scenenet/, labels_ade20k/,
+        stats.npz, ade_to_scenenet.pickle
+    {root}/ade20k/             real images, images/*.jpg and labels_blender/*.png
+"""
+import os
+import pickle
+import argparse
+
+import numpy as np
+from PIL import Image
+
+import OpenEXR
+import Imath
+
+
+def write_exr(path, channels):
+    """channels: name -> (H, W) float array, written as 32-bit float channels."""
+    height, width = next(iter(channels.values())).shape
+    header = OpenEXR.Header(width, height)
+    float_channel = Imath.Channel(Imath.PixelType(Imath.PixelType.FLOAT))
+    header['channels'] = {name: float_channel for name in channels}
+    exr = OpenEXR.OutputFile(path, header)
+    exr.writePixels({name: np.ascontiguousarray(c, dtype=np.float32).tobytes() for name, c in channels.items()})
+    exr.close()
+
+
+def blocky_labels(rng, values, size, block):
+    """(size, size) map of values in square blocks of block pixels."""
+    low = rng.choice(values, size=(size // block + 1, size // block + 1))
+    return np.kron(low, np.ones((block, block), dtype=low.dtype))[:size, :size]
+
+
+def random_rotation(rng):
+    yaw, pitch = rng.uniform(-np.pi, np.pi), rng.uniform(-0.3, 0.3)
+    rz = np.array([[np.cos(yaw), -np.sin(yaw), 0], [np.sin(yaw), np.cos(yaw), 0], [0, 0, 1]])
+    rx = np.array([[1, 0, 0], [0, np.cos(pitch), -np.sin(pitch)], [0, np.sin(pitch), np.cos(pitch)]])
+    return (rz @ rx).astype(np.float32)
+
+
+def world_points(depth, rot, translation, fx, cx, cy):
+    """The back-projection of make_coordinate_image.get_coordinate_image, (H, W, 3)."""
+    height, width = depth.shape
+    xs, ys = np.meshgrid(np.arange(width), np.arange(height))
+    xy = depth[:, :, None] * (np.stack([xs, ys], axis=2).astype(np.float32) - np.array([cx, cy])) / np.array([fx, fx])
+    points = np.concatenate([xy, depth[:, :, None]], axis=-1).reshape(-1, 3)
+    return (rot.T @ (points - translation).T).T.reshape(height, width, 3)
+
+
+def scene_dirs(root):
+    raw_dir = os.path.join(root, 'scene_raw_data')
+    scene_dir = os.path.join(root, 'scene')
+    return {
+        'raw_root': raw_dir,
+        'depths': os.path.join(raw_dir, 'depths'),
+        'raw_labels': os.path.join(raw_dir, 'labels'),
+        'cameras': os.path.join(raw_dir, 'cameras'),
+        'scene_root': scene_dir,
+        'coordinate_images': os.path.join(scene_dir, 'coordinate_images'),
+        'labels_scenenet': os.path.join(scene_dir, 'labels_scenenet'),
+        'labels_ade20k': os.path.join(scene_dir, 'labels_ade20k'),
+        'real_images': os.path.join(root, 'ade20k', 'images'),
+        'real_labels': os.path.join(root, 'ade20k', 'labels_blender'),
+    }
+
+
+def make_scene(root, num_frames=8, size=256, num_labels=16, num_real=16, seed=0):
+    """Writes the scene to root, returns scene_dirs(root)."""
+    rng = np.random.RandomState(seed)
+    dirs = scene_dirs(root)
+    scene_dir = dirs['scene_root']
+    for path in dirs.values():
+        os.makedirs(path, exist_ok=True)
+
+    # num_labels - 1 ADE20k ids, 0 is the dontcare label of the scenenet labels
+    ade_ids = np.sort(rng.choice(np.arange(1, 151), size=num_labels - 1, replace=False)).astype(np.uint8)
+    ade_to_scenenet = {int(ade_id): idx + 1 for idx, ade_id in enumerate(ade_ids)}
+    lookup = np.zeros(256, dtype=np.uint8)
+    for ade_id, scenenet_id in ade_to_scenenet.items():
+        lookup[ade_id] = scenenet_id
+
+    frames = []
+    for i in range(num_frames):
+        ys, xs = np.mgrid[0:size, 0:size] / size
+        depth = (2 + 3 * xs + 2 * ys + 0.1 * rng.rand(size, size)).astype(np.float32)
+        rot = random_rotation(rng)
+        translation = rng.uniform(-1, 1, 3).astype(np.float32)
+        fx, cx, cy = np.float32(size), np.float32(size / 2), np.float32(size / 2)
+        label = blocky_labels(rng, ade_ids, size, block=max(size // 16, 1))
+
+        write_exr(os.path.join(dirs['depths'], 'Depth%04d.exr' % i), {'R': depth, 'G': depth, 'B': depth})
+        Image.fromarray(label, mode='L').save(os.path.join(dirs['raw_labels'], 'Segmentation%04d.png' % i))
+        np.savez(os.path.join(dirs['cameras'], 'Camera_%04d.npz' % i), rotation=rot, translation=translation)
+        np.savez(os.path.join(dirs['cameras'], 'intrinsic_%04d.npz' % i), fx=fx, fy=fx, cx=cx, cy=cy)
+        frames.append((label, world_points(depth, rot, translation, fx, cx, cy)))
+
+    # the outputs of make_dataset.py
+    mean = np.mean([points.reshape(-1, 3).mean(0) for _, points in frames], axis=0)
+    max_value = max(np.abs(points - mean).max() for _, points in frames) + 1e-3
+    np.savez(os.path.join(scene_dir, 'stats.npz'), mean=mean, max_value=max_value)
+    with open(os.path.join(scene_dir, 'ade_to_scenenet.pickle'), 'wb') as f:
+        pickle.dump(ade_to_scenenet, f)
+    for i, (label, points) in enumerate(frames):
+        name = 'Segmentation%04d.png' % i
+        coord = ((points - mean) / max_value).astype(np.float32)
+        write_exr(os.path.join(dirs['coordinate_images'], name + '.exr'),
+                  {'R': coord[:, :, 0], 'G': coord[:, :, 1], 'B': coord[:, :, 2]})
+        Image.fromarray(lookup[label], mode='L').save(os.path.join(dirs['labels_scenenet'], name))
+        Image.fromarray(label, mode='L').save(os.path.join(dirs['labels_ade20k'], name))
+
+    # real images with scenenet labels
+    for i in range(num_real):
+        label = blocky_labels(rng, np.arange(num_labels, dtype=np.uint8), size, block=max(size // 8, 1))
+        image = np.kron(rng.randint(0, 256, (8, 8, 3)), np.ones((size // 8 + 1, size // 8 + 1, 1)))[:size, :size]
+        Image.fromarray(image.astype(np.uint8)).save(os.path.join(dirs['real_images'], 'ADE_%08d.jpg' % i))
+        Image.fromarray(label, mode='L').save(os.path.join(dirs['real_labels'], 'ADE_%08d.png' % i))
+    return dirs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='writes a synthetic scene in the layouts of the real data')
+    parser.add_argument('--root', type=str, required=True)
+    parser.add_argument('--num_frames', type=int, default=8)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--num_labels', type=int, default=16, help='semantic_nc, including the dontcare label')
+    parser.add_argument('--num_real', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    dirs = make_scene(args.root, args.num_frames, args.size, args.num_labels, args.num_real, args.seed)
+    for key, path in dirs.items():
+        print('%18s: %s' % (key, path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import json
+import statistics
+from time import perf_counter
+
+
+def measure(fn, repeat=10, warmup=2, sync=None):
+    """Times fn() repeat times after warmup calls, sync() is called before and after every timed call."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        if sync is not None:
+            sync()
+        start = perf_counter()
+        fn()
+        if sync is not None:
+            sync()
+        times.append(perf_counter() - start)
+    return {
+        'mean_ms': 1e3 * statistics.mean(times),
+        'median_ms': 1e3 * statistics.median(times),
+        'min_ms': 1e3 * min(times),
+        'std_ms': 1e3 * statistics.pstdev(times),
+        'repeat': repeat,
+    }
+
+
+def cuda_sync(device):
+    if device != 'cuda':
+        return None
+    import torch
+    return torch.cuda.synchronize
+
+
+def print_result(name, result):
+    print('{:>28} | mean {:10.3f} ms | median {:10.3f} ms | min {:10.3f} ms'.format(
+        name, result['mean_ms'], result['median_ms'], result['min_ms']))
+
+
+def write_results(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,24 @@
+import models.pretrained_oasis_models as pretrained_oasis_models
+import utils.pseudo_cache as pseudo_cache
+from utils.fid_eval_set import fid_eval_set
+import config
+
+
+def main(opt):
+    # --- frames in dataset order, without flip ---#
+    dataset = pseudo_cache.get_cache_dataset(opt)
+
+    # --- frozen pretrained OASIS model, the pseudo image cache is used without it ---#
+    pretrained_oasis_model = None
+    if not opt.use_pseudo_cache:
+        pretrained_oasis_model = pretrained_oasis_models.get_pretrained_oasis_model(opt)
+
+    eval_set = fid_eval_set(opt)
+    eval_set.build(dataset, pretrained_oasis_model)
+
+
+if __name__ == '__main__':
+    # --- read options (the same as for train.py) ---#
+    opt = config.read_arguments(train=True)
+
+    main(opt)
@@ -0,0 +1,35 @@
+import models.pretrained_oasis_models as pretrained_oasis_models
+import utils.pseudo_cache as pseudo_cache
+import config
+
+import torch
+import numpy as np
+
+
+def main(opt):
+    # --- frames in dataset order, without flip ---#
+    dataset = pseudo_cache.get_cache_dataset(opt)
+
+    # --- frozen pretrained OASIS model ---#
+    pretrained_oasis_model = pretrained_oasis_models.get_pretrained_oasis_model(opt)
+
+    sample = dataset[0]['pseudo_label']
+    cache = pseudo_cache.pseudo_image_cache(opt, mode='r+')
+    cache.create(dataset.labels, opt.pseudo_cache_num_z, opt.z_dim, sample.shape[-2], sample.shape[-1])
+    print(f'Rendering {opt.pseudo_cache_num_z} pseudo images for {len(dataset)} frames to {cache.path}')
+
+    frames_per_write = 16
+    for start in range(0, len(dataset), frames_per_write):
+        frame_ids = np.arange(start, min(start + frames_per_write, len(dataset)))
+        images, z = pseudo_cache.render_pseudo_images(opt, pretrained_oasis_model, dataset,
+                                                      frame_ids, opt.pseudo_cache_num_z)
+        cache.write(frame_ids, images, z)
+        print(f'[{frame_ids[-1] + 1} / {len(dataset)}]')
+
+
+if __name__ == '__main__':
+    # --- read options (the same as for train.py) ---#
+    opt = config.read_arguments(train=True)
+    torch.manual_seed(opt.seed)
+
+    main(opt)
@@ -0,0 +1,132 @@
+import models.surface_feat_models as surface_feat_models
+import models.losses as losses
+import models.util
+import config
+
+import torch
+import torch.nn.functional as F
+
+import argparse
+import math
+
+
+def get_opt(args, amp):
+    parser = argparse.ArgumentParser()
+    parser = config.add_all_arguments(parser, train=True)
+    opt = parser.parse_args([
+        '--model', 'surface_feat',
+        '--label_nc', str(args.num_labels - 1), '--semantic_nc', str(args.num_labels),
+        '--z_mapping_type', 'mapping_net', '--z_mapping_dim', '256',
+        '--surface_feat_model_convblock_type', 'None',
+        '--use_netD_output1', '--add_pseudo_adv_loss_output1', '--add_pseudo_recon_l1_loss',
+        '--no_EMA', '--gpu_ids', args.gpu_ids, '--batch_size', str(args.batch_size),
+        '--z_dim', str(args.z_dim), '--amp', amp,
+    ] + args.extra)
+    opt.phase = 'train'
+    opt.crop_size = args.size
+    opt.aspect_ratio = 1.0
+    return opt
+
+
+def make_scene(args, device):
+    """A small synthetic scene: smooth surfaces as coordinate images, region labels and a 3D texture."""
+    generator = torch.Generator().manual_seed(0)
+    low = args.size // 16
+    coord = torch.rand(args.num_frames, 3, low, low, generator=generator) * 2 - 1
+    coord = F.interpolate(coord, size=(args.size, args.size), mode='bicubic', align_corners=False).clamp(-1, 1)
+    label = torch.randint(0, args.num_labels, (args.num_frames, 1, low, low), generator=generator)
+    label = F.interpolate(label.float(), size=(args.size, args.size), mode='nearest').long()
+    one_hot = torch.zeros(args.num_frames, args.num_labels, args.size, args.size).scatter_(1, label, 1.0)
+    freq = torch.tensor([[7., 13., 3.], [11., 2., 17.], [5., 19., 9.]])
+    phase = coord.permute(0, 2, 3, 1) @ freq.t()
+    image = torch.sin(math.pi * phase + label.permute(0, 2, 3, 1).float()).permute(0, 3, 1, 2)
+    z = torch.randn(args.num_frames, args.z_dim, generator=generator)
+    return [t.to(device) for t in (one_hot, coord, image, z)]
+
+
+def train_curve(args, opt, scene):
+    """Losses of a short training run, the same data order and initialization for every precision."""
+    torch.manual_seed(0)
+    model = surface_feat_models.OASIS_model(opt)
+    model = models.util.put_on_multi_gpus(model, opt)
+    losses_computer = losses.losses_computer(opt)
+    optimizerG = torch.optim.Adam(model.module.netG.parameters(), lr=opt.lr_g, betas=(opt.beta1, opt.beta2))
+    optimizerD = torch.optim.Adam(model.module.netD_output1.parameters(), lr=opt.lr_d, betas=(opt.beta1, opt.beta2))
+    scaler_G = torch.cuda.amp.GradScaler(enabled=opt.amp == 'fp16')
+    scaler_D = torch.cuda.amp.GradScaler(enabled=opt.amp == 'fp16')
+
+    label, coord, image, z = scene
+    generator = torch.Generator().manual_seed(1)
+    curve_G, curve_D = [], []
+    for step in range(args.steps):
+        idx = torch.randint(0, label.size(0), (args.batch_size,), generator=generator)
+        batch = (image[idx], label[idx], coord[idx], image[idx], label[idx], None)
+
+        model.module.netG.zero_grad()
+        with models.util.get_autocast(opt):
+            loss_G, _ = model(*batch, "losses_G", losses_computer, z[idx])
+        loss_G = loss_G.float().mean()
+        scaler_G.scale(loss_G).backward()
+        scaler_G.step(optimizerG)
+        scaler_G.update()
+
+        model.module.netD_output1.zero_grad()
+        with models.util.get_autocast(opt):
+            loss_D, _ = model(*batch, "losses_D", losses_computer, z[idx])
+        loss_D = loss_D.float().mean()
+        scaler_D.scale(loss_D).backward()
+        scaler_D.step(optimizerD)
+        scaler_D.update()
+
+        curve_G.append(loss_G.item())
+        curve_D.append(loss_D.item())
+    return curve_G, curve_D
+
+
+def smooth(curve, window):
+    return [sum(curve[max(i - window + 1, 0):i + 1]) / len(curve[max(i - window + 1, 0):i + 1])
+            for i in range(len(curve))]
+
+
+def max_rel_diff(curve, reference, window):
+    curve, reference = smooth(curve, window), smooth(reference, window)
+    return max(abs(a - b) / max(abs(b), 1e-3) for a, b in zip(curve, reference))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='loss-curve parity of --amp against fp32 on a small synthetic scene')
+    parser.add_argument('--amp', nargs='+', default=['bf16'], choices=['fp16', 'bf16'])
+    parser.add_argument('--size', type=int, default=64)
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--num_frames', type=int, default=8)
+    parser.add_argument('--num_labels', type=int, default=8)
+    parser.add_argument('--z_dim', type=int, default=64)
+    parser.add_argument('--window', type=int, default=10, help='moving average window of the compared curves')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='max relative deviation of the smoothed curves')
+    parser.add_argument('--gpu_ids', type=str, default='-1')
+    parser.add_argument('extra', nargs=argparse.REMAINDER, help='options passed on to config.py')
+    args = parser.parse_args()
+    args.extra = [a for a in args.extra if a != '--']
+
+    device = 'cpu' if args.gpu_ids == '-1' else 'cuda'
+    scene = make_scene(args, device)
+    reference_G, reference_D = train_curve(args, get_opt(args, 'none'), scene)
+
+    passed = True
+    for amp in args.amp:
+        curve_G, curve_D = train_curve(args, get_opt(args, amp), scene)
+        diff_G = max_rel_diff(curve_G, reference_G, args.window)
+        diff_D = max_rel_diff(curve_D, reference_D, args.window)
+        ok = diff_G <= args.tolerance and diff_D <= args.tolerance
+        passed = passed and ok
+        print('{:>5} | final loss_G {:7.3f} (fp32 {:7.3f}) | final loss_D {:7.3f} (fp32 {:7.3f}) | '
+              'max rel diff G {:.3f} D {:.3f} | {}'.format(
+                  amp, curve_G[-1], reference_G[-1], curve_D[-1], reference_D[-1],
+                  diff_G, diff_D, 'ok' if ok else 'FAILED'))
+    if not passed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
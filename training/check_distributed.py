@@ -0,0 +1,129 @@
+import models.surface_feat_models as surface_feat_models
+import models.losses as losses
+import models.util
+import utils.distributed as utils_distributed
+from check_amp_parity import make_scene
+import config
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+import argparse
+import os
+import tempfile
+
+
+def get_opt(args, distributed):
+    parser = argparse.ArgumentParser()
+    parser = config.add_all_arguments(parser, train=True)
+    opt = parser.parse_args([
+        '--model', 'surface_feat',
+        '--label_nc', str(args.num_labels - 1), '--semantic_nc', str(args.num_labels),
+        '--z_mapping_type', 'mapping_net', '--z_mapping_dim', '256',
+        '--surface_feat_model_convblock_type', 'None',
+        '--use_netD_output1', '--add_pseudo_adv_loss_output1', '--add_pseudo_recon_l1_loss',
+        # per-batch class balancing and random labelmix masks differ between a shard and the full batch
+        '--no_balancing_inloss', '--no_labelmix',
+        '--no_EMA', '--gpu_ids', '-1', '--batch_size', str(args.batch_size), '--z_dim', str(args.z_dim),
+        '--dist_backend', 'gloo',
+    ] + (['--distributed'] if distributed else []) + args.extra)
+    opt.phase = 'train'
+    opt.crop_size = args.size
+    opt.aspect_ratio = 1.0
+    return opt
+
+
+def train(args, opt, scene):
+    """Trains a few steps on a fixed sequence of global batches, every rank on its contiguous share."""
+    torch.manual_seed(0)
+    model = surface_feat_models.OASIS_model(opt)
+    model = models.util.put_on_multi_gpus(model, opt)
+    losses_computer = losses.losses_computer(opt)
+    optimizerG = torch.optim.Adam(model.module.netG.parameters(), lr=opt.lr_g, betas=(opt.beta1, opt.beta2))
+    optimizerD = torch.optim.Adam(model.module.netD_output1.parameters(), lr=opt.lr_d, betas=(opt.beta1, opt.beta2))
+
+    label, coord, image, z = scene
+    generator = torch.Generator().manual_seed(1)
+    for step in range(args.steps):
+        idx = torch.randint(0, label.size(0), (args.batch_size,), generator=generator)
+        idx = idx.chunk(opt.world_size)[opt.rank]
+        batch = (image[idx], label[idx], coord[idx], image[idx], label[idx], None)
+
+        model.module.netG.zero_grad()
+        loss_G, _ = model(*batch, "losses_G", losses_computer, z[idx])
+        loss_G.mean().backward()
+        optimizerG.step()
+
+        model.module.netD_output1.zero_grad()
+        loss_D, _ = model(*batch, "losses_D", losses_computer, z[idx])
+        loss_D.mean().backward()
+        optimizerD.step()
+    return torch.cat([p.detach().flatten() for p in model.module.netG.parameters()])
+
+
+def worker(rank, args, path):
+    os.environ.update({'RANK': str(rank), 'LOCAL_RANK': str(rank), 'WORLD_SIZE': str(args.world_size),
+                       'MASTER_ADDR': '127.0.0.1', 'MASTER_PORT': str(args.port)})
+    opt = get_opt(args, distributed=True)
+    utils_distributed.init_distributed(opt)
+    params = train(args, opt, make_scene(args, 'cpu'))
+
+    gathered = [torch.zeros_like(params) for _ in range(opt.world_size)]
+    dist.all_gather(gathered, params)
+    if rank == 0:
+        rank_diff = max((p - params).abs().max().item() for p in gathered)
+        torch.save({'params': params, 'rank_diff': rank_diff}, path)
+    utils_distributed.cleanup(opt)
+
+
+def check_rejects_checkpointing(args):
+    """Activation checkpointing and DDP do not work together with torch 1.9, init_distributed refuses it."""
+    for flags in [['--checkpoint_D_down', '0'], ['--checkpoint_D_up', '0'], ['--checkpoint_G_layers', '1']]:
+        opt = get_opt(argparse.Namespace(**{**vars(args), 'extra': args.extra + flags}), distributed=True)
+        try:
+            utils_distributed.init_distributed(opt)
+        except ValueError:
+            continue
+        print('FAILED: --distributed %s was accepted' % ' '.join(flags))
+        raise SystemExit(1)
+    print('activation checkpointing is rejected with --distributed')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DDP (gloo, CPU processes) against single-process training on the full batch')
+    parser.add_argument('--world_size', type=int, default=2)
+    parser.add_argument('--port', type=int, default=29511)
+    parser.add_argument('--size', type=int, default=32)
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--num_frames', type=int, default=8)
+    parser.add_argument('--num_labels', type=int, default=8)
+    parser.add_argument('--z_dim', type=int, default=64)
+    parser.add_argument('--tolerance', type=float, default=1e-4, help='max abs difference of the generator weights')
+    parser.add_argument('extra', nargs=argparse.REMAINDER, help='options passed on to config.py')
+    args = parser.parse_args()
+    args.extra = [a for a in args.extra if a != '--']
+
+    check_rejects_checkpointing(args)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'ddp_params.pth')
+        mp.spawn(worker, args=(args, path), nprocs=args.world_size, join=True)
+        result = torch.load(path)
+
+    opt = get_opt(args, distributed=False)
+    utils_distributed.init_distributed(opt)
+    reference = train(args, opt, make_scene(args, 'cpu'))
+    diff = (result['params'] - reference).abs().max().item()
+
+    print('max weight difference between ranks: %.2e' % result['rank_diff'])
+    print('max weight difference to single-process training: %.2e' % diff)
+    if result['rank_diff'] > 0 or diff > args.tolerance:
+        print('FAILED')
+        raise SystemExit(1)
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
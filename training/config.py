@@ -2,6 +2,7 @@ import argparse
 import pickle
 import os
 import utils.utils as utils
+from utils.distributed import is_main_process
 
 
 def read_arguments(train=True, args=None):
@@ -20,9 +21,10 @@ def read_arguments(train=True, args=None):
     if train:
         opt.loaded_latest_iter = 0 if not opt.continue_train else load_iter(opt)
     utils.fix_seed(opt.seed)
-    print_options(opt, parser)
-    if train:
-        save_options(opt, parser)
+    if is_main_process():
+        print_options(opt, parser)
+        if train:
+            save_options(opt, parser)
     return opt
 
 
@@ -98,15 +100,29 @@ def add_all_arguments(parser, train):
 
     parser.add_argument('--channels_D', nargs='+',
                         type=int, default=[3, 128, 128, 256, 256, 512, 512])
+    parser.add_argument('--checkpoint_D_down', nargs='*', type=int, default=[],
+                        help='indices of the D encoder blocks (body_down) run with activation checkpointing')
+    parser.add_argument('--checkpoint_D_up', nargs='*', type=int, default=[],
+                        help='indices of the D decoder blocks (body_up) run with activation checkpointing')
+    parser.add_argument('--checkpoint_G_layers', type=int, default=0,
+                        help='checkpoint the MLP generator in groups of this many StyledConv layers, 0 disables it')
 
     # ablation
-    parser.add_argument('--pos_encoding_model', type=str, default='nerf', choices=['none', 'nerf', 'fourier'])
+    parser.add_argument('--pos_encoding_model', type=str, default='nerf', choices=['none', 'nerf', 'fourier', 'hashgrid'])
+    parser.add_argument('--hashgrid_num_levels', type=int, default=16)
+    parser.add_argument('--hashgrid_features_per_level', type=int, default=2)
+    parser.add_argument('--hashgrid_log2_size', type=int, default=19, help='log2 of the entries per hash table level')
+    parser.add_argument('--hashgrid_base_resolution', type=int, default=16)
+    parser.add_argument('--hashgrid_finest_resolution', type=int, default=2048)
     parser.add_argument('--fourier_dim', type=int)
     parser.add_argument('--fourier_scale', type=float)
 
     parser.add_argument('--fusion_model', type=str)
 
     parser.add_argument('--pretrained_oasis_checkpoints_dir', type=str, default='./checkpoints')
+    parser.add_argument('--fold_pretrained_oasis', action='store_true', help='run the frozen OASIS generator with spectral norm and batchnorm folded into its weights')
+    parser.add_argument('--pretrained_oasis_dtype', type=str, default='float32', choices=['float32', 'float16', 'bfloat16'])
+    parser.add_argument('--pretrained_oasis_script_path', type=str, default=None, help='also save the folded generator as TorchScript')
 
     parser.add_argument('--normalize_z_vec', action='store_true')
     parser.add_argument('--un_normalize_coord', action='store_true')
@@ -141,8 +157,19 @@ def add_all_arguments(parser, train):
     parser.add_argument('--point_embedding_dir', type=str)
     parser.add_argument('--point_embedding_dim', type=int, default=32)
     parser.add_argument('--point_embedding_num', type=int)
+    parser.add_argument('--sparse_point_embedding', action='store_true', help='sparse gradients for the point embedding, trained with its own LazyAdam')
     parser.add_argument('--use_label_embedding', action='store_true')
     parser.add_argument('--label_embedding_dim', type=int, default=32)
+    parser.add_argument('--use_label_index_input', action='store_true', help='feed label index maps instead of one-hot maps to the MLP and the pretrained OASIS generator')
+    parser.add_argument('--use_pseudo_cache', action='store_true', help='read pseudo images and their z from the cache of build_pseudo_cache.py')
+    parser.add_argument('--pseudo_cache_dir', type=str, default=None, help='default: checkpoints_dir/name/pseudo_cache')
+    parser.add_argument('--pseudo_cache_num_z', type=int, default=8, help='pseudo images rendered per frame')
+    parser.add_argument('--pseudo_cache_refresh_freq', type=int, default=0, help='re-render part of the cache every N iterations, 0 disables it')
+    parser.add_argument('--pseudo_cache_refresh_frames', type=int, default=64, help='frames re-rendered per refresh')
+    parser.add_argument('--fid_cache_dir', type=str, default=None, help='cache of the real-set Inception statistics, default: checkpoints_dir/fid_stats')
+    parser.add_argument('--no_fid_cache', action='store_true', help='always recompute the real-set Inception statistics')
+    parser.add_argument('--fid_backend', type=str, default='eigh', choices=['eigh', 'scipy'],
+                        help='eigh: float64 torch with the square root of the real covariance computed once, scipy: sqrtm at every evaluation')
     parser.add_argument('--use_3dfeat', action='store_true')
     parser.add_argument('--feat_dir', type=str, default='blender_set_008_3dfaet_maps_scale2')
     parser.add_argument('--feat_dim', type=int, default=16)
@@ -156,13 +183,33 @@ def add_all_arguments(parser, train):
 
     if train:
         parser.add_argument('--freq_print', type=int, default=1000, help='frequency of showing training results')
+        parser.add_argument('--no_vis_worker', action='store_true', help='write the training images in the training process')
+        parser.add_argument('--vis_queue_size', type=int, default=2,
+                            help='iterations of images waiting for the image writer, more are skipped')
+        parser.add_argument('--profile', action='store_true', help='time the phases of every iteration, synchronizes the GPU')
+        parser.add_argument('--profile_freq', type=int, default=100, help='frequency of the --profile summary')
+        parser.add_argument('--profile_window', type=int, default=100, help='iterations in the --profile summary and trace')
+        parser.add_argument('--profile_torch', type=int, nargs=2, default=None, metavar=('FIRST', 'N'),
+                            help='record the iterations FIRST ... FIRST + N - 1 with torch.profiler')
         parser.add_argument('--freq_save_ckpt', type=int, default=20000, help='frequency of saving the checkpoints')
         parser.add_argument('--freq_save_latest', type=int, default=10000, help='frequency of saving the latest model')
-        parser.add_argument('--freq_smooth_loss', type=int, default=250, help='smoothing window for loss visualization')
-        parser.add_argument('--freq_save_loss', type=int, default=2500, help='frequency of loss plot updates')
+        parser.add_argument('--freq_smooth_loss', type=int, default=250, help='window of the averaged losses written to losses/')
+        parser.add_argument('--freq_save_loss', type=int, default=2500, help='unused, the loss plots are made by plot_losses.py')
+        parser.add_argument('--metrics_format', type=str, default='jsonl', choices=['jsonl', 'csv'],
+                            help='file format of losses/losses.*')
+        parser.add_argument('--freq_EMA', type=int, default=1, help='frequency of the EMA update, the decay is raised to this power')
         parser.add_argument('--freq_fid', type=int, default=5000,
                             help='frequency of saving the fid score (in training iterations)')
+        parser.add_argument('--fid_async', action='store_true', help='compute the FID in a separate process on snapshots of the networks, training does not wait for it')
+        parser.add_argument('--fid_device', type=str, default=None, help='device of the --fid_async evaluator: cpu or a GPU index, default: the training GPU')
+        parser.add_argument('--use_fid_eval_set', action='store_true', help='compute the FID on the frozen frames, z and pseudo images of build_fid_eval_set.py')
+        parser.add_argument('--fid_eval_frames', type=int, default=0, help='frames of the FID evaluation set, spread evenly over the dataset, 0 takes all')
+        parser.add_argument('--fid_eval_seed', type=int, default=0, help='seed of the z vectors of the FID evaluation set')
+        parser.add_argument('--fid_eval_batch_size', type=int, default=0, help='batch size of the FID evaluation, 0 uses --batch_size')
+        parser.add_argument('--fid_eval_set_dir', type=str, default=None, help='default: checkpoints_dir/name/fid_eval_set')
+        parser.add_argument('--fid_eval_set_device', type=str, default='cpu', choices=['cpu', 'cuda'], help='keep the FID evaluation set in pinned host memory or on the GPU')
         parser.add_argument('--continue_train', action='store_true', help='resume previously interrupted training')
+        parser.add_argument('--keep_last_ckpt', type=int, default=0, help='keep only the newest N iteration checkpoints (and the best one), 0 keeps all')
         parser.add_argument('--which_iter', type=str, default='latest', help='which epoch to load when continue_train')
         parser.add_argument('--num_epochs', type=int, default=200, help='number of epochs to train')
         parser.add_argument('--beta1', type=float, default=0.0, help='momentum term of adam')
@@ -171,6 +218,17 @@ def add_all_arguments(parser, train):
         parser.add_argument('--lr_d', type=float, default=0.0004, help='D learning rate, default=0.0004')
 
         parser.add_argument('--optim', type=str, default='adam')
+        parser.add_argument('--batch_D_inputs', action='store_true', help='run each discriminator once on the concatenated fake, pseudo, real and labelmix images')
+        parser.add_argument('--reuse_fake_for_D', action='store_true', help='train D on the detached fake of the G step instead of running G again')
+        parser.add_argument('--input_cache_mb', type=int, default=0, help='memory budget of the per-frame MLP input cache, 0 disables it')
+        parser.add_argument('--input_cache_device', type=str, default='cuda', choices=['cuda', 'cpu'], help='keep the input cache on the GPU or in pinned host memory')
+        parser.add_argument('--lr_hashgrid', type=float, default=None, help='learning rate of the hash grid tables, default lr_g')
+        parser.add_argument('--lr_embedding', type=float, default=None, help='learning rate of the sparse point embedding, default lr_g')
+        parser.add_argument('--embedding_rowwise_adam', action='store_true', help='keep one second moment per embedding row')
+        parser.add_argument('--distributed', action='store_true', help='DistributedDataParallel, one process per GPU started by torchrun')
+        parser.add_argument('--dist_backend', type=str, default='nccl', choices=['nccl', 'gloo'], help='gloo also runs on the CPU (--gpu_ids -1)')
+        parser.add_argument('--accum_steps', type=int, default=1, help='split every batch into this many micro-batches, the gradients are accumulated for one optimizer step')
+        parser.add_argument('--amp', type=str, default='none', choices=['none', 'fp16', 'bf16'], help='mixed precision of the G and D phases, bf16 also runs on the CPU')
 
         ### --- Loss ---
         parser.add_argument('--no_balancing_inloss', action='store_true', default=False,
@@ -247,6 +305,23 @@ def add_all_arguments(parser, train):
         parser.add_argument('--results_dir', type=str, default='./results/', help='saves testing results here.')
         parser.add_argument('--ckpt_iter', type=str, default='best', help='which epoch to load to evaluate a model')
         parser.add_argument('--output_type', type=str)
+
+        # export_surface_colors.py
+        parser.add_argument('--export_mode', type=str, default='points', choices=['points', 'texels'],
+                            help='points: colors of the unique scene points, texels: texture maps from texel positions')
+        parser.add_argument('--export_quantize', type=int, default=3,
+                            help='number of decimals used to merge normalized coordinates into unique points')
+        parser.add_argument('--export_texel_dir', type=str,
+                            help='directory with per-texel world positions (*.npy, HxWx3) and labels (*.png)')
+        parser.add_argument('--export_stats_path', type=str,
+                            help='stats.npz of the train dataset used to normalize world positions')
+        parser.add_argument('--export_chunk_size', type=int, default=262144,
+                            help='number of points evaluated in one generator forward')
+
+        # FID of the generated images
+        parser.add_argument('--compute_fid', action='store_true',
+                            help='compute the FID of every generated_image directory against real_image_dir')
+        parser.add_argument('--fid_batch_size', type=int, default=50)
     return parser
 
 
@@ -12,6 +12,7 @@ import Imath
 import array
 
 from train_etc_util import class_specific_model_list
+from utils.pseudo_cache import pseudo_image_cache
 
 class BlenderDataset(torch.utils.data.Dataset):
     def __init__(self, opt, for_metrics):
@@ -56,6 +57,12 @@ class BlenderDataset(torch.utils.data.Dataset):
             self.feat_maps = sorted(glob.glob(
                 os.path.join(feat_dir, '*.npy')))
 
+        # pseudo images rendered offline by build_pseudo_cache.py
+        self.pseudo_cache = None
+        if self.opt.use_pseudo_cache and not for_metrics:
+            self.pseudo_cache = pseudo_image_cache(opt)
+            self.pseudo_cache.check(self.labels)
+
     def __len__(self,):
         #return len(self.labels)
         if self.for_metrics:
@@ -121,6 +128,13 @@ class BlenderDataset(torch.utils.data.Dataset):
 
         result = {} 
 
+        if self.pseudo_cache is not None:
+            pseudo_image, pseudo_z = self.pseudo_cache.sample(idx)
+            if do_flip:
+                pseudo_image = pseudo_image.flip(-1)
+            result["pseudo_image"] = pseudo_image
+            result["pseudo_z"] = pseudo_z
+
         # point embedding
         if self.opt.use_point_embedding:
             embed_idx_map_path = self.embed_idx_maps[idx]
@@ -156,6 +170,8 @@ class BlenderDataset(torch.utils.data.Dataset):
         result["real_label"] = real_label
         result["name"] = self.labels[idx]
         result["real_idx"] = real_random_idcs
+        result["idx"] = idx
+        result["flip"] = do_flip
 
         if self.opt.model in class_specific_model_list:
             cs_real_random_idcs = np.random.choice(len(self.class_specific_real_images), size=1)[0]
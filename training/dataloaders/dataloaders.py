@@ -4,6 +4,8 @@ import time
 import torch
 import numpy as np
 
+from utils.distributed import is_main_process
+
 
 def get_dataset_name(mode):
     if mode == "ade20k":
@@ -28,17 +30,32 @@ def worker_init_fn(worker_id):
     np.random.seed((np.random.get_state()[1][0] + worker_id + time.time_ns()) % 2 ** 32)
 
 
+def get_dataset(opt, for_metrics=False):
+    dataset_name = get_dataset_name(opt.dataset_mode)
+
+    file = __import__("dataloaders." + dataset_name)
+    return file.__dict__[dataset_name].__dict__[dataset_name](opt, for_metrics=for_metrics)
+
+
 def get_dataloaders(opt):
     dataset_name = get_dataset_name(opt.dataset_mode)
 
     file = __import__("dataloaders." + dataset_name)
     dataset_train = file.__dict__[dataset_name].__dict__[dataset_name](opt, for_metrics=False)
     dataset_val = file.__dict__[dataset_name].__dict__[dataset_name](opt, for_metrics=True)
-    print("Created %s, size train: %d, size val: %d" % (dataset_name, len(dataset_train), len(dataset_val)))
+    if is_main_process():
+        print("Created %s, size train: %d, size val: %d" % (dataset_name, len(dataset_train), len(dataset_val)))
 
-    dataloader_train = torch.utils.data.DataLoader(dataset_train, batch_size=opt.batch_size,
-                                                   num_workers=opt.num_workers, shuffle=True, drop_last=True,
-                                                   worker_init_fn=worker_init_fn)
+    if getattr(opt, 'distributed', False):
+        # every process loads its own batch_size / world_size share of the batch
+        sampler_train = torch.utils.data.distributed.DistributedSampler(dataset_train, shuffle=True, drop_last=True)
+        dataloader_train = torch.utils.data.DataLoader(dataset_train, batch_size=opt.batch_size // opt.world_size,
+                                                       num_workers=opt.num_workers, sampler=sampler_train,
+                                                       drop_last=True, worker_init_fn=worker_init_fn)
+    else:
+        dataloader_train = torch.utils.data.DataLoader(dataset_train, batch_size=opt.batch_size,
+                                                       num_workers=opt.num_workers, shuffle=True, drop_last=True,
+                                                       worker_init_fn=worker_init_fn)
     dataloader_val = torch.utils.data.DataLoader(dataset_val, batch_size=opt.val_batch_size, num_workers=8,
                                                  shuffle=False, drop_last=False)
     
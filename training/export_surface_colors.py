@@ -0,0 +1,208 @@
+import models
+import models.surface_feat_models as surface_feat_models
+import dataloaders.dataloaders as dataloaders
+import config
+
+import torch
+
+import os
+import glob
+import numpy as np
+from PIL import Image
+
+from train_etc_util import surface_feat_model_list
+
+# a quantized point (x, y, z) and its label are packed into one int64 key
+COORD_BITS = 18
+LABEL_BITS = 8
+
+
+def get_generator(opt):
+    model = surface_feat_models.OASIS_model(opt)
+    model = models.util.put_on_multi_gpus(model, opt)
+    model.eval()
+    return model.module.netG if opt.no_EMA else model.module.netEMA
+
+
+def pack_points(coord, label, opt):
+    scale = 10 ** opt.export_quantize
+    offset = 1 << (COORD_BITS - 1)
+    quantized = torch.round(coord.clamp(-1, 1) * scale).long() + offset
+    key = label.long()
+    for i in range(3):
+        key = key | (quantized[:, i] << (LABEL_BITS + i * COORD_BITS))
+    return key
+
+
+def unpack_points(key, opt):
+    scale = 10 ** opt.export_quantize
+    offset = 1 << (COORD_BITS - 1)
+    mask = (1 << COORD_BITS) - 1
+    label = key & ((1 << LABEL_BITS) - 1)
+    coord = torch.stack([((key >> (LABEL_BITS + i * COORD_BITS)) & mask) - offset for i in range(3)], dim=1)
+    return coord.float() / scale, label
+
+
+def collect_unique_points(opt, dataloader):
+    """Returns the unique inputs of the generator over all frames.
+
+    With point embeddings these are the point ids of embed_idx_map, otherwise
+    the normalized coordinates merged on a grid of 10^-export_quantize.
+    """
+    keys = torch.zeros(0, dtype=torch.long)
+    point_label = None
+    if opt.use_point_embedding:
+        point_label = torch.full((opt.point_embedding_num,), -1, dtype=torch.long)
+
+    for i, data_i in enumerate(dataloader):
+        label_map = data_i['label'].long()[:, 0]
+        if opt.contain_dontcare_label:
+            valid = label_map > 0
+        else:
+            valid = torch.ones_like(label_map, dtype=torch.bool)
+
+        if opt.use_point_embedding:
+            embed_idx_map = data_i['embed_idx_map'].long()
+            point_label[embed_idx_map[valid]] = label_map[valid]
+        else:
+            coord = data_i['coord_image'].permute(0, 2, 3, 1)[valid]
+            keys = torch.unique(torch.cat([keys, pack_points(coord, label_map[valid], opt)]))
+
+        if i % 100 == 0:
+            print(f'[{i} / {len(dataloader)}]')
+
+    if opt.use_point_embedding:
+        point_ids = torch.nonzero(point_label >= 0)[:, 0]
+        return point_ids, point_label[point_ids]
+    return unpack_points(keys, opt)
+
+
+def colorize_points(opt, netG, x, label, z_vec, device):
+    """Evaluates the pointwise generator on (N, 3) coordinates or (N,) point ids."""
+    colors = []
+    with torch.no_grad():
+        for start in range(0, label.shape[0], opt.export_chunk_size):
+            x_chunk = x[start:start + opt.export_chunk_size].to(device)
+            label_chunk = label[start:start + opt.export_chunk_size].to(device)
+            n = label_chunk.shape[0]
+
+            input_label = torch.zeros(1, opt.semantic_nc, 1, n, dtype=torch.float, device=device)
+            input_label.scatter_(1, label_chunk.view(1, 1, 1, n), 1.0)
+            if opt.use_point_embedding:
+                x_chunk = x_chunk.view(1, 1, n)
+            else:
+                x_chunk = x_chunk.t().reshape(1, 3, 1, n)
+
+            fake, _ = netG(input_label, x_chunk, z=z_vec)
+            colors.append(fake.view(3, n).t().cpu())
+    colors = torch.cat(colors, 0)
+    return ((colors + 1) / 2 * 255).clamp(0, 255).to(torch.uint8).numpy()
+
+
+def save_ply(path, points, colors):
+    vertex = np.empty(len(points), dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+                                          ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')])
+    vertex['x'], vertex['y'], vertex['z'] = points[:, 0], points[:, 1], points[:, 2]
+    vertex['red'], vertex['green'], vertex['blue'] = colors[:, 0], colors[:, 1], colors[:, 2]
+    header = ('ply\nformat binary_little_endian 1.0\nelement vertex %d\n'
+              'property float x\nproperty float y\nproperty float z\n'
+              'property uchar red\nproperty uchar green\nproperty uchar blue\nend_header\n') % len(points)
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        f.write(vertex.tobytes())
+
+
+def export_points(opt, netG, points, z_vec, device, save_dir):
+    x, label = points
+    colors = colorize_points(opt, netG, x, label, z_vec, device)
+    if opt.use_point_embedding:
+        point_colors = np.zeros((opt.point_embedding_num, 3), dtype=np.uint8)
+        point_colors[x.numpy()] = colors
+        valid = np.zeros(opt.point_embedding_num, dtype=bool)
+        valid[x.numpy()] = True
+        np.savez(os.path.join(save_dir, 'point_colors.npz'), colors=point_colors, valid=valid)
+    else:
+        coord = x.numpy()
+        if opt.export_stats_path is not None:
+            stats = np.load(opt.export_stats_path)
+            coord = coord * stats['max_value'] + stats['mean']
+        np.savez(os.path.join(save_dir, 'point_colors.npz'), points=coord, labels=label.numpy(), colors=colors)
+        save_ply(os.path.join(save_dir, 'point_colors.ply'), coord, colors)
+    print(f'Saved {len(colors)} points to {save_dir}')
+
+
+def export_texels(opt, netG, z_vec, device, save_dir):
+    stats = np.load(opt.export_stats_path)
+    for position_path in sorted(glob.glob(os.path.join(opt.export_texel_dir, '*.npy'))):
+        name = os.path.splitext(os.path.basename(position_path))[0]
+        position = np.load(position_path).astype(np.float32)
+        label = np.array(Image.open(os.path.join(opt.export_texel_dir, name + '.png')))
+        if label.ndim == 3:
+            label = label[:, :, 0]
+
+        valid = np.isfinite(position).all(-1)
+        coord = (position[valid] - stats['mean']) / stats['max_value']
+        coord = torch.from_numpy(coord.astype(np.float32))
+        texel_label = torch.from_numpy(label[valid].astype(np.int64))
+
+        texture = np.zeros(position.shape, dtype=np.uint8)
+        texture[valid] = colorize_points(opt, netG, coord, texel_label, z_vec, device)
+        Image.fromarray(texture).save(os.path.join(save_dir, name + '.png'))
+        print(f'Saved {os.path.join(save_dir, name + ".png")}')
+
+
+def main(opt):
+    if opt.model not in surface_feat_model_list:
+        raise ValueError('No model')
+    # colors can only be shared across views when the generator is applied per pixel
+    if opt.surface_feat_model_convblock_type != 'None':
+        raise ValueError('convblock type %s is not pointwise' % opt.surface_feat_model_convblock_type)
+    if opt.surface_feat_model_view_encoding or opt.use_3dfeat:
+        raise ValueError('view-dependent inputs can not be exported per point')
+    if opt.export_mode == 'texels':
+        assert not opt.use_point_embedding, 'texel export needs the coordinate input'
+        assert opt.export_texel_dir is not None and opt.export_stats_path is not None
+    assert opt.export_quantize <= 5 and opt.semantic_nc <= (1 << LABEL_BITS)
+
+    # --- create dataloader (also sets the dataset dependent options) ---#
+    _, dataloader_val = dataloaders.get_dataloaders(opt)
+
+    # --- create models ---#
+    netG = get_generator(opt)
+    device = 'cpu' if opt.gpu_ids == "-1" else 'cuda'
+
+    # ---  z_vec (same sequence as generate_images.py) ---
+    torch.manual_seed(0)
+    if opt.use_fixed_z_vec:
+        z_list = [torch.randn(opt.z_dim, dtype=torch.float32) for i in range(opt.num_z_vec)]
+        selected_z_list = list(range(opt.num_z_vec))
+        if not -1 in opt.z_list:
+            selected_z_list = opt.z_list
+    else:
+        z_list = [torch.randn(opt.z_dim, dtype=torch.float32)]
+        selected_z_list = [0]
+
+    points = None
+    if opt.export_mode == 'points':
+        points = collect_unique_points(opt, dataloader_val)
+        print(f'Found {len(points[1])} unique points')
+
+    base_path = os.path.join(opt.results_dir, opt.name, opt.ckpt_iter, 'export')
+    for z_idx in selected_z_list:
+        z_vec = z_list[z_idx].view(1, opt.z_dim).to(device)
+        if opt.normalize_z_vec:
+            z_vec = z_vec / 4
+        save_dir = os.path.join(base_path, str(z_idx))
+        os.makedirs(save_dir, exist_ok=True)
+
+        if opt.export_mode == 'points':
+            export_points(opt, netG, points, z_vec, device, save_dir)
+        else:
+            export_texels(opt, netG, z_vec, device, save_dir)
+
+
+if __name__ == '__main__':
+    # --- read options ---#
+    opt = config.read_arguments(train=False)
+
+    main(opt)
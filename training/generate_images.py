@@ -3,6 +3,7 @@ import models.surface_feat_models as surface_feat_models
 import models.pretrained_oasis_models as pretrained_oasis_models
 import dataloaders.dataloaders as dataloaders
 import utils.utils as utils
+from utils.fid_stats import get_fid_cache_dir
 import config
 
 import torch
@@ -39,9 +40,7 @@ def main(opt):
     # --- create pretrained OASIS model ---#
     pretrained_oasis_model = None
     if use_pretrained_oasis_model:
-        pretrained_oasis_model = pretrained_oasis_models.OASIS_model(opt)
-        pretrained_oasis_model = models.util.put_on_multi_gpus(pretrained_oasis_model, opt)
-        pretrained_oasis_model.eval()
+        pretrained_oasis_model = pretrained_oasis_models.get_pretrained_oasis_model(opt)
 
     # ---  z_vec ---
     if opt.use_fixed_z_vec:
@@ -64,6 +63,7 @@ def main(opt):
         print('Not using use_fixed_z_vec option !')
 
     base_path = os.path.join(opt.results_dir, opt.name, opt.ckpt_iter)
+    gen_save_dirs = []
 
     # --- iterate over validation set ---#
     if opt.use_fixed_z_vec:
@@ -74,6 +74,7 @@ def main(opt):
             os.makedirs(label_save_dir, exist_ok=True)
             gen_save_dir = os.path.join(base_path, str(z_idx), 'generated_image')
             os.makedirs(gen_save_dir, exist_ok=True)
+            gen_save_dirs.append(gen_save_dir)
             oasis_save_dir = os.path.join(base_path, str(z_idx), 'oasis_image')
             os.makedirs(oasis_save_dir, exist_ok=True)
             
@@ -180,6 +181,7 @@ def main(opt):
         os.makedirs(label_save_dir, exist_ok=True)
         gen_save_dir = os.path.join(base_path, str(z_idx), 'generated_image')
         os.makedirs(gen_save_dir, exist_ok=True)
+        gen_save_dirs.append(gen_save_dir)
         oasis_save_dir = os.path.join(base_path, str(z_idx), 'oasis_image')
         os.makedirs(oasis_save_dir, exist_ok=True)
 
@@ -234,6 +236,21 @@ def main(opt):
             if i % 100 == 0:
                 print(f'[{i} / {len(dataloader_val)}]')
 
+    if opt.compute_fid:
+        compute_fid(opt, gen_save_dirs)
+
+
+def compute_fid(opt, gen_save_dirs):
+    # the statistics of real_image_dir come from the cache shared with training and tests_with_FID.py
+    from utils.fid_folder.tests_with_FID import calculate_fid_given_paths
+    cuda = opt.gpu_ids != "-1"
+    with open(os.path.join(opt.results_dir, opt.name, opt.ckpt_iter, 'fid.txt'), 'w') as f:
+        for gen_save_dir in gen_save_dirs:
+            fid = calculate_fid_given_paths([opt.real_image_dir, gen_save_dir], opt.fid_batch_size, cuda,
+                                            2048, get_fid_cache_dir(opt), opt.num_workers)
+            print('FID of %s: %.2f' % (gen_save_dir, fid))
+            f.write('%s %f\n' % (gen_save_dir, fid))
+
 
 if __name__ == '__main__':
     # --- read options ---#
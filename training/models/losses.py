@@ -2,6 +2,7 @@ import torch
 import torch.nn.functional as F
 import torch.nn as nn
 from models.vggloss import VGG19
+from models.util import autocast_disabled
 
 
 class losses_computer():
@@ -16,6 +17,11 @@ class losses_computer():
         self.gamma = opt.gamma
 
     def omni_loss(self, pred, one_hot_label, loss_type):
+        # the -1e12 masks and the logsumexp need fp32
+        with autocast_disabled():
+            return self._omni_loss(pred.float(), one_hot_label.float(), loss_type)
+
+    def _omni_loss(self, pred, one_hot_label, loss_type):
         one_hot_label = F.interpolate(one_hot_label, scale_factor=0.5, mode='nearest') 
 
         b, nc_plus_2, h, w = pred.shape
@@ -59,6 +65,10 @@ class losses_computer():
         return loss
 
     def seg_loss(self, input, label):
+        with autocast_disabled():
+            return self._seg_loss(input.float(), label.float())
+
+    def _seg_loss(self, input, label):
         weight_map = get_class_balancing(input, label, False, False)
         label_idx_map = torch.argmax(label, dim=1)
         loss = F.cross_entropy(input, label_idx_map, reduction='none')
@@ -93,6 +103,11 @@ class losses_computer():
         
 
     def loss_multi(self, input, label, for_real, for_D=False):
+        # the cross-entropies are computed in fp32 under --amp
+        with autocast_disabled():
+            return self._loss_multi(input.float(), label.float(), for_real)
+
+    def _loss_multi(self, input, label, for_real):
         # --- balancing classes ---
         weight_map = get_class_balancing(input, label, self.opt.no_balancing_inloss, self.opt.contain_dontcare_label)
         # --- n+1 loss ---
@@ -108,7 +123,11 @@ class losses_computer():
         return loss
 
     def loss_binary(self, valid=None, fake=None, for_D=False):
+        with autocast_disabled():
+            return self._loss_binary(None if valid is None else valid.float(),
+                                     None if fake is None else fake.float(), for_D)
 
+    def _loss_binary(self, valid, fake, for_D):
         if for_D:
             loss = compute_d_loss(valid, fake, self.loss_type_binary)
         else:
@@ -1,6 +1,8 @@
 import torch
-import torch.nn.utils.spectral_norm as spectral_norm
+import torch.nn.utils.spectral_norm as torch_spectral_norm
+from torch.nn.utils.spectral_norm import SpectralNorm
 from models.sync_batchnorm import SynchronizedBatchNorm2d
+from models.util import autocast_disabled, is_recomputing
 import torch.nn as nn
 import torch.nn.functional as F
 
@@ -21,14 +23,46 @@ class SPADE(nn.Module):
 
     def forward(self, x, segmap):
         normalized = self.first_norm(x)
-        segmap = F.interpolate(segmap, size=x.size()[2:], mode='nearest')
-        actv = self.mlp_shared(segmap)
+        actv = spade_shared(self.mlp_shared, x, segmap)
         gamma = self.mlp_gamma(actv)
         beta = self.mlp_beta(actv)
         out = normalized * (1 + gamma) + beta
         return out
 
 
+def spade_shared(mlp_shared, x, segmap):
+    if isinstance(segmap, tuple):
+        # (label index map, z) instead of torch.cat((z, one_hot), 1)
+        label_idx, z = segmap
+        label_idx = F.interpolate(label_idx.float(), size=x.size()[2:], mode='nearest').long()
+        conv = mlp_shared[0]
+        return mlp_shared[1](label_index_conv2d(label_idx, conv.weight, conv.bias, z))
+    segmap = F.interpolate(segmap, size=x.size()[2:], mode='nearest')
+    return mlp_shared(segmap)
+
+
+class FoldedSPADE(nn.Module):
+    # inference-only SPADE, the running stats of the param-free batchnorm are folded into mlp_gamma:
+    # (x - mean) * rsqrt(var + eps) * (1 + gamma) + beta = (x - mean) * gamma' + beta
+    def __init__(self, spade):
+        super().__init__()
+        norm = spade.first_norm
+        assert isinstance(norm, nn.modules.batchnorm._BatchNorm) and not norm.affine
+        scale = torch.rsqrt(norm.running_var + norm.eps)
+        self.register_buffer('mean', norm.running_mean.view(1, -1, 1, 1).clone())
+        self.mlp_shared = spade.mlp_shared
+        self.mlp_beta = spade.mlp_beta
+        self.mlp_gamma = nn.Conv2d(spade.mlp_gamma.in_channels, spade.mlp_gamma.out_channels,
+                                   kernel_size=spade.mlp_gamma.kernel_size, padding=spade.mlp_gamma.padding)
+        with torch.no_grad():
+            self.mlp_gamma.weight.copy_(spade.mlp_gamma.weight * scale.view(-1, 1, 1, 1))
+            self.mlp_gamma.bias.copy_((spade.mlp_gamma.bias + 1) * scale)
+
+    def forward(self, x, segmap):
+        actv = spade_shared(self.mlp_shared, x, segmap)
+        return torch.addcmul(self.mlp_beta(actv), x - self.mean, self.mlp_gamma(actv))
+
+
 class SPADE_with_coord(nn.Module):
     def __init__(self, opt, norm_nc, label_nc):
         super().__init__()
@@ -55,6 +89,58 @@ class SPADE_with_coord(nn.Module):
         return out
 
 
+def label_index_conv2d(label_idx, weight, bias, z=None):
+    """Same as F.conv2d(torch.cat((z, one_hot(label_idx)), 1), weight, bias, padding=k // 2)
+    for a (B, 1, H, W) label index map and a spatially constant (B, z_dim) z.
+
+    Each kernel tap adds the weight column of the class under it, so the conv is a
+    sum of per-class lookups and the one-hot map is never built.
+    """
+    b, _, h, w = label_idx.shape
+    out_nc, in_nc, kh, kw = weight.shape
+    z_nc = 0 if z is None else z.shape[1]
+    num_classes = in_nc - z_nc
+
+    # lookup table (b, taps, num_classes + 1, out_nc), the last row is the zero padding
+    table = weight[:, z_nc:].permute(2, 3, 1, 0).reshape(1, kh * kw, num_classes, out_nc)
+    table = table.expand(b, -1, -1, -1)
+    if z is not None:
+        z_term = torch.einsum('ocij,bc->bijo', weight[:, :z_nc], z).reshape(b, kh * kw, 1, out_nc)
+        table = table + z_term
+    table = torch.cat([table, table.new_zeros(b, kh * kw, 1, out_nc)], dim=2)
+
+    label_idx = F.pad(label_idx[:, 0], (kw // 2, kw // 2, kh // 2, kh // 2), value=num_classes)
+    out = weight.new_zeros(b, h * w, out_nc)
+    for i in range(kh):
+        for j in range(kw):
+            tap_idx = label_idx[:, i:i + h, j:j + w].reshape(b, h * w, 1).expand(-1, -1, out_nc)
+            out += torch.gather(table[:, i * kw + j], 1, tap_idx)
+    if bias is not None:
+        out += bias
+    return out.transpose(1, 2).reshape(b, out_nc, h, w)
+
+
+class SpectralNormFP32(SpectralNorm):
+    # the power iteration and the weight normalization stay in fp32 under autocast,
+    # the normalized fp32 weight is then cast by autocast like any other weight
+    def __call__(self, module, inputs):
+        with autocast_disabled():
+            if is_recomputing():
+                # activation checkpointing runs the block again in backward, u and v were already
+                # updated by the first run, so the same weight is computed without another power iteration
+                setattr(module, self.name, self.compute_weight(module, do_power_iteration=False))
+            else:
+                super().__call__(module, inputs)
+
+
+def spectral_norm(module, *args, **kwargs):
+    module = torch_spectral_norm(module, *args, **kwargs)
+    for hook in module._forward_pre_hooks.values():
+        if type(hook) is SpectralNorm:
+            hook.__class__ = SpectralNormFP32
+    return module
+
+
 def get_spectral_norm(opt):
     if opt.no_spectral_norm:
         return torch.nn.Identity()
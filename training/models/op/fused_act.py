@@ -8,13 +8,17 @@ from torch.utils.cpp_extension import load
 
 
 module_path = os.path.dirname(__file__)
-fused = load(
-    "fused",
-    sources=[
-        os.path.join(module_path, "fused_bias_act.cpp"),
-        os.path.join(module_path, "fused_bias_act_kernel.cu"),
-    ],
-)
+try:
+    fused = load(
+        "fused",
+        sources=[
+            os.path.join(module_path, "fused_bias_act.cpp"),
+            os.path.join(module_path, "fused_bias_act_kernel.cu"),
+        ],
+    )
+except (OSError, RuntimeError):
+    # no CUDA toolkit to build the extension, fused_leaky_relu falls back to PyTorch ops
+    fused = None
 
 
 class FusedLeakyReLUFunctionBackward(Function):
@@ -108,9 +112,11 @@ class FusedLeakyReLU(nn.Module):
 
 
 def fused_leaky_relu(input, bias=None, negative_slope=0.2, scale=2 ** 0.5):
-    if input.device.type == "cpu":
+    # the extension only takes fp32, half precision inputs under autocast take the PyTorch path
+    if input.device.type == "cpu" or input.dtype != torch.float32 or fused is None:
         if bias is not None:
             rest_dim = [1] * (input.ndim - bias.ndim - 1)
+            bias = bias.to(input.dtype)
             return (
                 F.leaky_relu(
                     input + bias.view(1, bias.shape[0], *rest_dim), negative_slope=0.2
@@ -8,13 +8,17 @@ from torch.utils.cpp_extension import load
 
 
 module_path = os.path.dirname(__file__)
-upfirdn2d_op = load(
-    "upfirdn2d",
-    sources=[
-        os.path.join(module_path, "upfirdn2d.cpp"),
-        os.path.join(module_path, "upfirdn2d_kernel.cu"),
-    ],
-)
+try:
+    upfirdn2d_op = load(
+        "upfirdn2d",
+        sources=[
+            os.path.join(module_path, "upfirdn2d.cpp"),
+            os.path.join(module_path, "upfirdn2d_kernel.cu"),
+        ],
+    )
+except (OSError, RuntimeError):
+    # no CUDA toolkit to build the extension, upfirdn2d falls back to upfirdn2d_native
+    upfirdn2d_op = None
 
 
 class UpFirDn2dBackward(Function):
@@ -156,8 +160,9 @@ def upfirdn2d(input, kernel, up=1, down=1, pad=(0, 0)):
     if len(pad) == 2:
         pad = (pad[0], pad[1], pad[0], pad[1])
 
-    if input.device.type == "cpu":
-        out = upfirdn2d_native(input, kernel, *up, *down, *pad)
+    # the extension only takes fp32, half precision inputs under autocast take the native path
+    if input.device.type == "cpu" or input.dtype != torch.float32 or upfirdn2d_op is None:
+        out = upfirdn2d_native(input, kernel.to(input.dtype), *up, *down, *pad)
 
     else:
         out = UpFirDn2d.apply(input, kernel, up, down, pad)
@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import models.norms as norms
+from models.util import checkpoint_call
 
 
 class OASIS_Discriminator(nn.Module):
@@ -22,21 +23,31 @@ class OASIS_Discriminator(nn.Module):
             self.body_up.append(residual_block_D(2*self.channels[-1-i], self.channels[-2-i], opt, 1))
         self.body_up.append(residual_block_D(2*self.channels[1], 64, opt, 1))
         self.layer_up_last = nn.Conv2d(64, output_channel, 1, 1, 0)
+        # activation checkpointing per block, the blocks keep their parameter names
+        self.checkpoint_down = set(opt.checkpoint_D_down)
+        self.checkpoint_up = set(opt.checkpoint_D_up)
+        if any(i < 0 or i >= len(self.body_down) for i in self.checkpoint_down | self.checkpoint_up):
+            raise ValueError('--checkpoint_D_down/up indices have to be in [0, %d)' % len(self.body_down))
 
     def forward(self, input):
         x = input
         #encoder
         encoder_res = list()
         for i in range(len(self.body_down)):
-            x = self.body_down[i](x)
+            x = self.run_block(self.body_down[i], i in self.checkpoint_down, x)
             encoder_res.append(x)
         #decoder
-        x = self.body_up[0](x)
+        x = self.run_block(self.body_up[0], 0 in self.checkpoint_up, x)
         for i in range(1, len(self.body_down)):
-            x = self.body_up[i](torch.cat((encoder_res[-i-1], x), dim=1))
+            x = self.run_block(self.body_up[i], i in self.checkpoint_up, torch.cat((encoder_res[-i-1], x), dim=1))
         ans = self.layer_up_last(x)
         return ans
 
+    def run_block(self, block, checkpoint, x):
+        if checkpoint:
+            return checkpoint_call(block, x)
+        return block(x)
+
 
 class residual_block_D(nn.Module):
     def __init__(self, fin, fout, opt, up_or_down, first=False):
@@ -29,6 +29,8 @@ class OASIS_Generator(nn.Module):
         return h, w
 
     def forward(self, input, z=None):
+        if input.dtype == torch.long:
+            return self.forward_label_index(input, z)
         seg = input
 
         if not self.opt.no_3dnoise:
@@ -52,6 +54,25 @@ class OASIS_Generator(nn.Module):
         x = torch.tanh(x)
         return x
 
+    def forward_label_index(self, label_idx, z=None):
+        # same output as forward() on the one-hot of the (B, 1, H, W) label_idx
+        if not self.opt.no_3dnoise:
+            if z is None:
+                z = torch.randn(label_idx.size(0), self.opt.z_dim, dtype=torch.float32, device=label_idx.device)
+            z = z.reshape(-1, self.opt.z_dim).expand(label_idx.size(0), self.opt.z_dim)
+        else:
+            z = None
+        x = F.interpolate(label_idx.float(), size=(self.init_W, self.init_H)).long()
+        x = norms.label_index_conv2d(x, self.fc.weight, self.fc.bias, z)
+        seg = (label_idx, z)
+        for i in range(self.opt.num_res_blocks):
+            x = self.body[i](x, seg)
+            if i < self.opt.num_res_blocks-1:
+                x = self.up(x)
+        x = self.conv_img(F.leaky_relu(x, 2e-1))
+        x = torch.tanh(x)
+        return x
+
 
 class ResnetBlock_with_SPADE(nn.Module):
     def __init__(self, fin, fout, opt):
@@ -1,7 +1,8 @@
 from models.sync_batchnorm import DataParallelWithCallback
 import models.original_generator as generators
 import models.original_discriminator as discriminators
-from models.util import generate_labelmix
+from models.util import generate_labelmix, put_on_multi_gpus
+import models.norms as norms
 import os
 import copy
 import torch
@@ -144,6 +145,79 @@ class OASIS_model(nn.Module):
   
 
 
+def fold_for_inference(netG):
+    # removes the spectral norm hooks and folds the SPADE batchnorm running stats into the modulation
+    netG = copy.deepcopy(netG).eval()
+    for module in netG.modules():
+        if hasattr(module, 'weight_orig'):
+            nn.utils.remove_spectral_norm(module)
+    for block in netG.body:
+        for name in ['norm_0', 'norm_1', 'norm_s']:
+            if hasattr(block, name):
+                setattr(block, name, norms.FoldedSPADE(getattr(block, name)))
+    for p in netG.parameters():
+        p.requires_grad_(False)
+    return netG
+
+
+class pseudo_image_engine(nn.Module):
+    """Inference-only pretrained OASIS generator with the same "generate" call as OASIS_model.
+
+    The spectral norm and batchnorm are folded into plain weights, the generator
+    runs under torch.inference_mode and optionally in float16/bfloat16.
+    """
+    def __init__(self, train_opt):
+        super().__init__()
+        pretrained_model = OASIS_model(train_opt)
+        self.opt = pretrained_model.opt
+        netG = pretrained_model.netG if self.opt.no_EMA else pretrained_model.netEMA
+        self.dtype = {'float32': torch.float32, 'float16': torch.float16,
+                      'bfloat16': torch.bfloat16}[train_opt.pretrained_oasis_dtype]
+        self.netG = fold_for_inference(netG).to(self.dtype)
+        if train_opt.pretrained_oasis_script_path is not None:
+            self.export_script(train_opt.pretrained_oasis_script_path, train_opt)
+
+    def export_script(self, path, train_opt):
+        device = 'cpu' if self.opt.gpu_ids == "-1" else 'cuda'
+        netG = copy.deepcopy(self.netG).to(device)
+        label_map = torch.zeros(1, 1, self.opt.crop_size, self.opt.crop_size, dtype=torch.long, device=device)
+        if train_opt.use_label_index_input:
+            label = label_map
+        else:
+            label = torch.zeros(1, self.opt.semantic_nc, self.opt.crop_size, self.opt.crop_size,
+                                dtype=self.dtype, device=device).scatter_(1, label_map, 1.0)
+        z = torch.zeros(1, self.opt.z_dim, dtype=self.dtype, device=device)
+        with torch.no_grad():
+            torch.jit.trace(netG, (label, z)).save(path)
+        print('Saved the folded pretrained OASIS generator to %s' % path)
+
+    def forward(self, image, label, mode, losses_computer, z=None):
+        assert mode == "generate"
+        if z is None:
+            z = torch.randn(label.size(0), self.opt.z_dim, dtype=torch.float32, device=label.device)
+        if label.is_floating_point():
+            label = label.to(self.dtype)
+        with torch.inference_mode():
+            fake = self.netG(label, z=z.to(self.dtype))
+        # clone outside inference mode, the losses may save the pseudo image for backward
+        return fake.float().clone()
+
+
+def get_pretrained_oasis_model(opt):
+    if opt.fold_pretrained_oasis:
+        model = pseudo_image_engine(opt)
+    else:
+        model = OASIS_model(opt)
+    if getattr(opt, 'distributed', False):
+        # frozen and inference-only: every process keeps its own copy on its device, without DDP
+        if opt.gpu_ids != "-1":
+            model = model.cuda(torch.cuda.current_device())
+    else:
+        model = put_on_multi_gpus(model, opt)
+    model.eval()
+    return model
+
+
 def preprocess_input(opt, data):
     data['label'] = data['label'].long()
     if opt.gpu_ids != "-1":
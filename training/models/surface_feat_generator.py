@@ -9,6 +9,7 @@ import math
 from models.cnn_style_recon_generator import FourierFeature 
 
 from models.util import AdaptiveInstanceNorm2d 
+from models.util import checkpoint_call
 from models.original_stylegan_v2_model import ModulatedConv2d
 from models.op import FusedLeakyReLU, fused_leaky_relu, upfirdn2d, conv2d_gradfix
 from models.conv_encoder import ConvEncoder
@@ -88,7 +89,7 @@ class NeRFPosEmbLinear(nn.Module):
         self.cat_input = cat_input
 
     def forward(self, x):
-        img_size = x.shape[-1]
+        height, width = x.shape[-2:]
         x = x.reshape(x.shape[0], self.in_dim, -1)
         x = x.transpose(1,2)
 
@@ -108,7 +109,7 @@ class NeRFPosEmbLinear(nn.Module):
             x = torch.cat([x, inputs], -1)
             
         feat_dim = x.shape[-1]
-        x = x.transpose(1,2).reshape(x.shape[0], feat_dim, img_size, img_size)
+        x = x.transpose(1,2).reshape(x.shape[0], feat_dim, height, width)
         return x
 
     def extra_repr(self) -> str:
@@ -119,6 +120,83 @@ class NeRFPosEmbLinear(nn.Module):
         return outstr
 
 
+class HashGridEncoding(nn.Module):
+    """Multiresolution hash encoding (Instant-NGP) of coordinates in [-1, 1].
+
+    Levels whose dense grid fits in 2^log2_hashmap_size entries are indexed
+    directly, finer levels are hashed. The 8 corners of every point are gathered
+    at once and blended with trilinear weights.
+    """
+    primes = (1, 2654435761, 805459861)
+
+    def __init__(self, in_dim=3, num_levels=16, features_per_level=2, log2_hashmap_size=19,
+                 base_resolution=16, finest_resolution=512, cat_input=False):
+        super().__init__()
+        assert in_dim == 3
+        self.in_dim = in_dim
+        self.num_levels = num_levels
+        self.features_per_level = features_per_level
+        self.cat_input = cat_input
+        self.out_dim = num_levels * features_per_level + (in_dim if cat_input else 0)
+
+        if num_levels > 1:
+            growth = math.exp((math.log(finest_resolution) - math.log(base_resolution)) / (num_levels - 1))
+        else:
+            growth = 1.
+        self.resolutions, self.offsets, self.level_sizes, self.hashed = [], [], [], []
+        table_size = 2 ** log2_hashmap_size
+        offset = 0
+        for level in range(num_levels):
+            resolution = int(math.floor(base_resolution * growth ** level))
+            level_size = min((resolution + 1) ** 3, table_size)
+            self.resolutions.append(resolution)
+            self.offsets.append(offset)
+            self.level_sizes.append(level_size)
+            self.hashed.append((resolution + 1) ** 3 > table_size)
+            offset += level_size
+
+        self.embeddings = nn.Parameter(torch.empty(offset, features_per_level).uniform_(-1e-4, 1e-4))
+        corners = torch.tensor([[(i >> 2) & 1, (i >> 1) & 1, i & 1] for i in range(8)])
+        self.register_buffer('corners', corners, persistent=False)
+
+    def forward(self, x):
+        b, _, height, width = x.shape
+        inputs = x
+        x = x.reshape(b, self.in_dim, -1).transpose(1, 2).reshape(-1, self.in_dim)
+        x = (x.clamp(-1, 1) + 1) / 2
+
+        corners = self.corners.unsqueeze(0)
+        feats = []
+        for level in range(self.num_levels):
+            resolution = self.resolutions[level]
+            pos = x * resolution
+            pos_floor = torch.floor(pos)
+            frac = (pos - pos_floor).unsqueeze(1)
+            grid = pos_floor.long().unsqueeze(1) + corners  # (N, 8, 3)
+
+            if self.hashed[level]:
+                idx = (grid[..., 0] * self.primes[0]) ^ (grid[..., 1] * self.primes[1]) ^ (grid[..., 2] * self.primes[2])
+                idx = idx % self.level_sizes[level]
+            else:
+                grid = grid.clamp(max=resolution)
+                idx = grid[..., 0] + grid[..., 1] * (resolution + 1) + grid[..., 2] * (resolution + 1) ** 2
+
+            weights = torch.where(corners.bool(), frac, 1 - frac).prod(-1)  # (N, 8)
+            corner_feats = self.embeddings[idx + self.offsets[level]]  # (N, 8, F)
+            feats.append((corner_feats * weights.unsqueeze(-1)).sum(1))
+
+        x = torch.cat(feats, -1)
+        x = x.view(b, height * width, -1).transpose(1, 2).reshape(b, -1, height, width)
+        if self.cat_input:
+            x = torch.cat([x, inputs], 1)
+        return x
+
+    def extra_repr(self) -> str:
+        return 'levels={}, features={}, resolutions={}..{}, table={}'.format(
+            self.num_levels, self.features_per_level, self.resolutions[0], self.resolutions[-1],
+            self.embeddings.shape[0])
+
+
 class OASIS_Generator(nn.Module):
     def __init__(self, opt):
         super().__init__()
@@ -172,7 +250,28 @@ class OASIS_Generator(nn.Module):
         view_z = self.reparameterize(mu, logvar)
         return view_z, mu, logvar
 
-    def forward(self, input, embed_idx_map, z=None, feat=None, view_img=None, pseudo_image=None):
+    def get_mlp_seg(self, input, label_idx=None):
+        # label_idx: the (B, 1, H, W) index map of the one-hot input, when the caller has it
+        label_idx_map = label_idx
+        if input.dtype == torch.long:
+            label_idx_map = input
+        elif label_idx_map is None and (self.opt.use_label_embedding or self.opt.use_label_index_input):
+            label_idx_map = torch.argmax(input, dim=1, keepdim=True)
+
+        if self.opt.use_label_embedding:
+            seg = self.label_embedding(label_idx_map[:, 0])
+            seg = seg.transpose(2,3).transpose(1,2).contiguous()
+        elif self.opt.use_label_index_input:
+            seg = label_idx_map
+        else:
+            seg = input
+        return seg
+
+    def encode_input(self, input, embed_idx_map, feat=None, label_idx=None):
+        return self.coord_mlp.encode_input(embed_idx_map, self.get_mlp_seg(input, label_idx), feat)
+
+    def forward(self, input, embed_idx_map, z=None, feat=None, view_img=None, pseudo_image=None, input_block=None,
+                label_idx=None):
 
         seg = input
         if not self.opt.no_3dnoise:
@@ -187,22 +286,19 @@ class OASIS_Generator(nn.Module):
             elif self.opt.z_mapping_type == 'clamp':
                 style = torch.clamp(z, -1, 1)
 
-        if self.opt.use_label_embedding:
-            label_idx_map = torch.argmax(input, dim=1)
-            seg = self.label_embedding(label_idx_map)
-            seg = seg.transpose(2,3).transpose(1,2).contiguous()
+        seg = self.get_mlp_seg(input, label_idx)
 
         view_z = None
         if self.opt.surface_feat_model_view_encoding:
             if view_img is None:
                 if self.opt.view_encoding_input_type == 'label':
-                    view_img = seg
+                    view_img = input
                 elif self.opt.view_encoding_input_type == 'pseudo_image':
                     view_img = pseudo_image
             view_z, mu, logvar = self.encode_view_z(view_img)
             view_z = self.view_z_mapping_net(view_z)
 
-        output1 = self.coord_mlp(embed_idx_map, seg, style, feat, view_z, z)
+        output1 = self.coord_mlp(embed_idx_map, seg, style, feat, view_z, z, input_block=input_block)
         
         output1 = self.conv_img_output1(F.leaky_relu(output1, 2e-1))
         output1 = torch.tanh(output1)
@@ -274,6 +370,31 @@ class StyledConv(nn.Module):
 
         return out
 
+    def forward_label_index(self, input, label_idx, label_start, style):
+        # same as forward() on input with the one-hot of label_idx inserted at channel label_start,
+        # the label columns of the 1x1 modulated weight are gathered instead of multiplied
+        conv = self.conv
+        assert conv.kernel_size == 1
+        batch, _, height, width = input.shape
+
+        style = conv.modulation(style).view(batch, 1, conv.in_channel, 1, 1)
+        weight = conv.scale * conv.weight * style
+        if conv.demodulate:
+            demod = torch.rsqrt(weight.pow(2).sum([2, 3, 4]) + 1e-8)
+            weight = weight * demod.view(batch, conv.out_channel, 1, 1, 1)
+        weight = weight.view(batch, conv.out_channel, conv.in_channel)
+
+        num_classes = conv.in_channel - input.shape[1]
+        label_weight = weight[:, :, label_start:label_start + num_classes]
+        rest_weight = torch.cat([weight[:, :, :label_start], weight[:, :, label_start + num_classes:]], dim=2)
+
+        out = torch.bmm(rest_weight, input.reshape(batch, -1, height * width))
+        label_idx = label_idx.reshape(batch, 1, height * width).expand(-1, conv.out_channel, -1)
+        out = out + torch.gather(label_weight, 2, label_idx)
+        out = self.activate(out.view(batch, conv.out_channel, height, width))
+
+        return out
+
 class MLPNet(nn.Module):
     def __init__(self, opt):
         super().__init__()
@@ -281,7 +402,8 @@ class MLPNet(nn.Module):
         
         if self.opt.use_point_embedding:
             self.embedding = nn.Embedding(self.opt.point_embedding_num, 
-                                          self.opt.point_embedding_dim)
+                                          self.opt.point_embedding_dim,
+                                          sparse=self.opt.sparse_point_embedding)
 
         if opt.pos_encoding_model == 'none':
             self.pos_encoding = None
@@ -297,14 +419,24 @@ class MLPNet(nn.Module):
                         angular=False, no_linear=True, cat_input=True)
                 pos_encoding_dim = 3*2*opt.pos_encoding_num_freq + 3
 
+        elif opt.pos_encoding_model == 'hashgrid':
+            if self.opt.use_point_embedding:
+                raise ValueError('hashgrid encodes coordinates, not point embeddings')
+            self.pos_encoding = HashGridEncoding(3, opt.hashgrid_num_levels, opt.hashgrid_features_per_level,
+                                                 opt.hashgrid_log2_size, opt.hashgrid_base_resolution,
+                                                 opt.hashgrid_finest_resolution, cat_input=True)
+            pos_encoding_dim = self.pos_encoding.out_dim
+
 #        elif opt.pos_encoding_model == 'fourier':
 #            self.pos_encoding = FourierFeature(embedding_size=opt.fourier_dim, embedding_scale=12.)
 #            pos_encoding_dim = self.pos_encoding.out_dim
         else:
             raise ValueError('no pos_encoding_model')
 
+        self.pos_encoding_dim = pos_encoding_dim
+
         hdim = opt.mlp_hdim 
-        self.num_layers = 7 
+        self.num_layers = opt.G_num_layers
 
         if self.opt.z_mapping_type == 'none' or self.opt.z_mapping_type == 'clamp':
             style_features = opt.z_dim
@@ -373,43 +505,74 @@ class MLPNet(nn.Module):
             raise ValueError('')
 
 
-    def forward(self, x, seg, style, feat=None, view_z=None, raw_z=None):
-        
+    def run_layers(self, x, seg, style, start, end, use_label_index, label_start):
+        for i in range(start, end):
+            if i == 0 and use_label_index:
+                x = self.models[i].forward_label_index(x, seg, label_start, style)
+            else:
+                x = self.models[i](x, style)
+        return x
+
+    def encode_input(self, x, seg, feat=None):
+        # the part of the input that only depends on the frame: encoded position, label and 3d feature
         if self.opt.use_point_embedding:
-            x = self.embedding(x)
+            # gather each visible point once, the gradient is then one row per unique id
+            point_ids, inverse = torch.unique(x, return_inverse=True)
+            x = self.embedding(point_ids)[inverse]
             x = x.transpose(2,3).transpose(1,2).contiguous()
 
         if self.pos_encoding is not None:
             x = self.pos_encoding(x)
         
-        if self.opt.use_3dfeat:
-            x = torch.cat([x, seg, feat], dim=1)
+        if seg.dtype == torch.long:
+            x = [x]
         else:
-            x = torch.cat([x, seg], dim=1)
+            x = [x, seg]
+        if self.opt.use_3dfeat:
+            x.append(feat)
+        return torch.cat(x, dim=1)
+
+    def forward(self, x, seg, style, feat=None, view_z=None, raw_z=None, input_block=None):
+        # seg is a label map with semantic_nc (or label_embedding_dim) channels,
+        # or a (B, 1, H, W) index map that is gathered in the first layer.
+        # input_block is the output of encode_input(), e.g. from utils.input_cache
+        use_label_index = seg.dtype == torch.long
+        
+        if input_block is None:
+            input_block = self.encode_input(x, seg, feat)
+        label_start = self.pos_encoding_dim
+        x = [input_block.float()]
 
         if self.opt.surface_feat_model_3dnoise == 'map_z':
             z_dim = style.shape[1]
             z = style.view(seg.size(0), z_dim, 1, 1)
             z = z.expand(seg.size(0), z_dim, seg.size(2), seg.size(3))
-            x = torch.cat([x, z], dim=1)
+            x.append(z)
         elif self.opt.surface_feat_model_3dnoise == 'raw_z':
             z_dim = raw_z.shape[1]
             z = raw_z.view(seg.size(0), z_dim, 1, 1)
             z = z.expand(seg.size(0), z_dim, seg.size(2), seg.size(3))
-            x = torch.cat([x, z], dim=1)
+            x.append(z)
 
         if self.opt.surface_feat_model_view_encoding:
             if self.opt.view_encoding_use_type == 'input_cat':
                 view_z = view_z.view(seg.size(0), 64, 1, 1)
                 view_z = view_z.expand(seg.size(0), 64, seg.size(2), seg.size(3))
-                x = torch.cat([x, view_z], dim=1)
+                x.append(view_z)
             elif self.opt.view_encoding_use_type == 'style_cat':
                 style = torch.cat([style, view_z], dim=1)
             else:
                 raise ValueError()
-
-        for i in range(self.num_layers):
-            x = self.models[i](x, style)
+        x = torch.cat(x, dim=1)
+
+        group = self.opt.checkpoint_G_layers
+        if group > 0:
+            # only the input of every group of StyledConv layers is kept, the rest is recomputed in backward
+            for start in range(0, self.num_layers, group):
+                end = min(start + group, self.num_layers)
+                x = checkpoint_call(self.run_layers, x, seg, style, start, end, use_label_index, label_start)
+        else:
+            x = self.run_layers(x, seg, style, 0, self.num_layers, use_label_index, label_start)
         
         if self.opt.surface_feat_model_convblock_type == 'None':
             x = self.conv1(x)
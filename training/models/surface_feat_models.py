@@ -11,6 +11,29 @@ from torch.nn import init
 import models.losses as losses
 
 
+class discriminator_memo():
+    """Evaluates every (discriminator, input) pair once per phase, the output is shared by all the losses."""
+    def __init__(self, model):
+        self.model = model
+        self.outputs = {}
+        self.labelmix = None
+
+    def __call__(self, net_name, input_name, x):
+        key = (net_name, input_name)
+        if key not in self.outputs:
+            self.outputs[key] = getattr(self.model, net_name)(x)
+        return self.outputs[key]
+
+    def prefetch(self, net_name, inputs):
+        # one forward over the batch concatenation of inputs, split back per input
+        inputs = [(name, x) for name, x in inputs.items() if (net_name, name) not in self.outputs]
+        if len(inputs) == 0:
+            return
+        out = getattr(self.model, net_name)(torch.cat([x for _, x in inputs], dim=0))
+        for (name, x), out_x in zip(inputs, out.split([x.size(0) for _, x in inputs], dim=0)):
+            self.outputs[(net_name, name)] = out_x
+
+
 class OASIS_model(nn.Module):
     def __init__(self, opt):
         super(OASIS_model, self).__init__()
@@ -27,6 +50,11 @@ class OASIS_model(nn.Module):
             if opt.use_output2:
                 self.netD_output2 = discriminators.OASIS_Discriminator(opt)
 
+        if opt.phase == "train" and opt.batch_D_inputs:
+            # batch statistics would mix the fake, pseudo and real images of the single forward
+            for net in [getattr(self, name, None) for name in ['netD_output1', 'netD_output2']]:
+                if net is not None and any(isinstance(m, nn.modules.batchnorm._BatchNorm) for m in net.modules()):
+                    raise ValueError('--batch_D_inputs needs a discriminator without batch normalization')
         self.print_parameter_count()
         self.init_networks()
         #--- EMA of generator weights ---
@@ -40,17 +68,23 @@ class OASIS_model(nn.Module):
                 self.VGG_loss = losses.VGGLoss()
 
     def forward(self, pseudo_image, label, coord, real_image, real_label, embed_idx_map,
-                mode, losses_computer, z=None, feat_map=None, view=None):
+                mode, losses_computer, z=None, feat_map=None, view=None, input_block=None, fake=None,
+                label_idx=None):
+        # label_idx: the integer label map of --use_label_index_input for the generator,
+        # the discriminators and losses use the one-hot label
         # Branching is applied to be compatible with DataParallel
         if mode == "losses_G":
             loss_G = 0
+            memo_D = discriminator_memo(self)
             if self.opt.use_point_embedding:
-                fake1, fake2 = self.netG(label, embed_idx_map, z=z, feat=feat_map)
+                fake1, fake2 = self.netG(label, embed_idx_map, z=z, feat=feat_map, label_idx=label_idx)
             else:
                 if self.opt.surface_feat_model_view_encoding:
-                    fake1, fake2, mu, logvar = self.netG(label, coord, z=z, feat=feat_map, pseudo_image=pseudo_image)
+                    fake1, fake2, mu, logvar = self.netG(label, coord, z=z, feat=feat_map, pseudo_image=pseudo_image,
+                                                         input_block=input_block, label_idx=label_idx)
                 else:
-                    fake1, fake2 = self.netG(label, coord, z=z, feat=feat_map)
+                    fake1, fake2 = self.netG(label, coord, z=z, feat=feat_map, input_block=input_block,
+                                             label_idx=label_idx)
 
             loss_KLD = None
             if self.opt.surface_feat_model_view_encoding:
@@ -59,14 +93,14 @@ class OASIS_model(nn.Module):
 
             loss_G_real_adv_output2 = None
             if self.opt.add_real_adv_loss_output2 or self.opt.add_pseudo_adv_loss_output2: 
-                output_D = self.netD_output2(fake2)
+                output_D = memo_D('netD_output2', 'fake2', fake2)
                 loss_G_real_adv_output2 = losses_computer.loss_multi(output_D, label, for_real=True)
                 loss_G += loss_G_real_adv_output2
 
             # binary gan loss
             loss_G_binary_output2 = None
             if self.opt.add_real_binary_gan_loss_output2:
-                output_D = self.netD_output2(fake2)
+                output_D = memo_D('netD_output2', 'fake2', fake2)
                 loss_G_binary_output2 = losses_computer.loss_binary(fake=output_D[:,0,:,:], for_D=False)
                 loss_G += loss_G_binary_output2
 
@@ -74,7 +108,7 @@ class OASIS_model(nn.Module):
             if self.opt.add_pseudo_adv_loss_output1 or self.opt.add_real_adv_loss_output1: 
                 assert self.opt.use_netD_output1
                 
-                output_D_output1 = self.netD_output1(fake1)
+                output_D_output1 = memo_D('netD_output1', 'fake1', fake1)
                 if self.opt.discriminator == 'oasis':
                     loss_G_adv_output1 = (self.opt.lambda_G_real_output1
                              * losses_computer.loss_multi(output_D_output1, label, for_real=True))
@@ -88,7 +122,7 @@ class OASIS_model(nn.Module):
             loss_G_binary_output1_for_pseudo = None
             if self.opt.add_pseudo_binary_gan_loss_output1:
                 assert self.opt.use_netD_output1
-                output_D = self.netD_output1(fake1)
+                output_D = memo_D('netD_output1', 'fake1', fake1)
                 loss_G_binary_output1_for_pseudo = losses_computer.loss_binary(fake=output_D[:,0,:,:], for_D=False)
                 loss_G += loss_G_binary_output1_for_pseudo
 
@@ -96,7 +130,7 @@ class OASIS_model(nn.Module):
             loss_G_binary_output1_for_real = None
             if self.opt.add_real_binary_gan_loss_output1:
                 assert self.opt.use_netD_output1
-                output_D = self.netD_output1(fake1)
+                output_D = memo_D('netD_output1', 'fake1', fake1)
                 loss_G_binary_output1_for_real = losses_computer.loss_binary(fake=output_D[:,0,:,:], for_D=False)
                 loss_G += loss_G_binary_output1_for_real
 
@@ -164,7 +198,7 @@ class OASIS_model(nn.Module):
                         f'fake2 max: {fake2.max():.3f} | '
                     )
 
-            return loss_G, {"Generator": loss_G_real_adv_output2, "Vgg": loss_G_vgg,
+            losses_G_dict = {"Generator": loss_G_real_adv_output2, "Vgg": loss_G_vgg,
                             "Pseudo_recon_l1": loss_G_pseudo_recon_l1, "Pseudo_recon_l2": loss_G_pseudo_recon_l2,
                             "Output12_recon_l1": loss_G_output12_recon_l1,
                             "Generator_output1": loss_G_adv_output1,
@@ -172,26 +206,38 @@ class OASIS_model(nn.Module):
                             "G_binary_output1_for_pseudo": loss_G_binary_output1_for_pseudo,
                             "G_binary_output1_for_real": loss_G_binary_output1_for_real,
                             "KLD": loss_KLD, }
+            if self.opt.reuse_fake_for_D:
+                return loss_G, losses_G_dict, (fake1.detach(), fake2.detach())
+            return loss_G, losses_G_dict
 
 
         if mode == "losses_D":
             loss_D = 0
-            with torch.no_grad():
-                if self.opt.use_point_embedding:
-                    fake1, fake2 = self.netG(label, embed_idx_map, z=z, feat=feat_map)
-                else:
-                    if self.opt.surface_feat_model_view_encoding:
-                        fake1, fake2, mu, logvar = self.netG(label, coord, z=z, feat=feat_map, pseudo_image=pseudo_image)
+            memo_D = discriminator_memo(self)
+            if fake is not None:
+                # detached output of the preceding losses_G call (--reuse_fake_for_D)
+                fake1, fake2 = fake
+            else:
+                with torch.no_grad():
+                    if self.opt.use_point_embedding:
+                        fake1, fake2 = self.netG(label, embed_idx_map, z=z, feat=feat_map, label_idx=label_idx)
                     else:
-                        fake1, fake2 = self.netG(label, coord, z=z, feat=feat_map)
+                        if self.opt.surface_feat_model_view_encoding:
+                            fake1, fake2, mu, logvar = self.netG(label, coord, z=z, feat=feat_map, pseudo_image=pseudo_image,
+                                                                 input_block=input_block, label_idx=label_idx)
+                        else:
+                            fake1, fake2 = self.netG(label, coord, z=z, feat=feat_map, input_block=input_block,
+                                                     label_idx=label_idx)
+            if self.opt.batch_D_inputs:
+                self.prefetch_D_inputs(memo_D, label, fake1, fake2, real_image, pseudo_image)
 
             loss_D_fake_output2 = None
             loss_D_real_output2 = None
             if self.opt.add_real_adv_loss_output2:
                 # auxiliary gan loss
                 assert self.opt.use_output2
-                output_D_fake = self.netD_output2(fake2)
-                output_D_real = self.netD_output2(real_image)
+                output_D_fake = memo_D('netD_output2', 'fake2', fake2)
+                output_D_real = memo_D('netD_output2', 'real_image', real_image)
 
                 loss_D_fake_output2 = losses_computer.loss_multi(output_D_fake, label, for_real=False)
                 loss_D += loss_D_fake_output2
@@ -203,15 +249,15 @@ class OASIS_model(nn.Module):
             loss_D_binary_output2 = None
             if self.opt.add_real_binary_gan_loss_output2:
                 assert self.opt.use_output2
-                output_D_fake = self.netD_output2(fake2)
-                output_D_real = self.netD_output2(real_image)
+                output_D_fake = memo_D('netD_output2', 'fake2', fake2)
+                output_D_real = memo_D('netD_output2', 'real_image', real_image)
 
                 loss_D_binary_output2 = losses_computer.loss_binary(output_D_real[:,0,:,:], output_D_fake[:,0,:,:], for_D=True)
                 loss_D += loss_D_binary_output2
 
             loss_D_pseudo = None
             if self.opt.add_pseudo_adv_loss_output2: 
-                output_D_pseudo = self.netD_output2(pseudo_image)
+                output_D_pseudo = memo_D('netD_output2', 'pseudo_image', pseudo_image)
                 loss_D_pseudo = losses_computer.loss_multi(output_D_pseudo, label, for_real=True)
                 loss_D += loss_D_pseudo
 
@@ -221,7 +267,7 @@ class OASIS_model(nn.Module):
             if self.opt.add_pseudo_adv_loss_output1 or self.opt.add_real_adv_loss_output1: 
                 assert self.opt.use_netD_output1
 
-                output_D_fake_output1 = self.netD_output1(fake1)
+                output_D_fake_output1 = memo_D('netD_output1', 'fake1', fake1)
                 if self.opt.discriminator == 'oasis':
                     loss_D_fake_output1 = (self.opt.lambda_D_fake_output1
                             * losses_computer.loss_multi(
@@ -233,7 +279,7 @@ class OASIS_model(nn.Module):
 
 
                 if self.opt.add_pseudo_adv_loss_output1:
-                    output_D_pseudo_output1 = self.netD_output1(pseudo_image)
+                    output_D_pseudo_output1 = memo_D('netD_output1', 'pseudo_image', pseudo_image)
                     if self.opt.discriminator == 'oasis':
                         loss_D_pseudo_output1 = (self.opt.lambda_D_pseudo_output1
                             * losses_computer.loss_multi(
@@ -244,7 +290,7 @@ class OASIS_model(nn.Module):
                     loss_D += loss_D_pseudo_output1
 
                 if self.opt.add_real_adv_loss_output1:
-                    output_D_real_output1 = self.netD_output1(real_image)
+                    output_D_real_output1 = memo_D('netD_output1', 'real_image', real_image)
                     if self.opt.discriminator == 'oasis':
                         loss_D_real_output1 = (self.opt.lambda_D_real_output1
                             * losses_computer.loss_multi(
@@ -257,8 +303,8 @@ class OASIS_model(nn.Module):
             loss_D_binary_output1_for_pseudo = None
             if self.opt.add_pseudo_binary_gan_loss_output1:
                 assert self.opt.use_netD_output1
-                output_D_fake_output1 = self.netD_output1(fake1)
-                output_D_real_output1 = self.netD_output1(pseudo_image)
+                output_D_fake_output1 = memo_D('netD_output1', 'fake1', fake1)
+                output_D_real_output1 = memo_D('netD_output1', 'pseudo_image', pseudo_image)
 
                 loss_D_binary_output1_for_pseudo = losses_computer.loss_binary(output_D_real_output1[:,0,:,:], 
                                                             output_D_fake_output1[:,0,:,:], for_D=True)
@@ -267,8 +313,8 @@ class OASIS_model(nn.Module):
             loss_D_binary_output1_for_real = None
             if self.opt.add_real_binary_gan_loss_output1:
                 assert self.opt.use_netD_output1
-                output_D_fake_output1 = self.netD_output1(fake1)
-                output_D_real_output1 = self.netD_output1(real_image)
+                output_D_fake_output1 = memo_D('netD_output1', 'fake1', fake1)
+                output_D_real_output1 = memo_D('netD_output1', 'real_image', real_image)
 
                 loss_D_binary_output1_for_real = losses_computer.loss_binary(output_D_real_output1[:,0,:,:], 
                                                             output_D_fake_output1[:,0,:,:], for_D=True)
@@ -277,8 +323,11 @@ class OASIS_model(nn.Module):
 
             loss_D_lm = None
             if not self.opt.no_labelmix:
-                mixed_inp, mask = generate_labelmix(label, fake1, pseudo_image)
-                output_D_mixed = self.netD_output1(mixed_inp)
+                if memo_D.labelmix is not None:
+                    mixed_inp, mask = memo_D.labelmix
+                else:
+                    mixed_inp, mask = generate_labelmix(label, fake1, pseudo_image)
+                output_D_mixed = memo_D('netD_output1', 'mixed', mixed_inp)
                 loss_D_lm = self.opt.lambda_labelmix * \
                     losses_computer.loss_labelmix(mask, output_D_mixed, 
                                                   output_D_fake_output1, output_D_pseudo_output1)
@@ -297,16 +346,44 @@ class OASIS_model(nn.Module):
             with torch.no_grad():
                 if self.opt.no_EMA:
                     if self.opt.use_point_embedding:
-                        fake1, fake2 = self.netG(label, embed_idx_map, z=z, feat=feat_map, view_img=view)
+                        fake1, fake2 = self.netG(label, embed_idx_map, z=z, feat=feat_map, view_img=view, label_idx=label_idx)
                     else:
                         if self.opt.surface_feat_model_view_encoding:
-                            fake1, fake2, mu, logvar = self.netG(label, coord, z=z, feat=feat_map, view_img=view, pseudo_image=pseudo_image)
+                            fake1, fake2, mu, logvar = self.netG(label, coord, z=z, feat=feat_map, view_img=view, pseudo_image=pseudo_image,
+                                                                 label_idx=label_idx)
                         else:
-                            fake1, fake2 = self.netG(label, coord, z=z, feat=feat_map)
+                            fake1, fake2 = self.netG(label, coord, z=z, feat=feat_map, label_idx=label_idx)
                 else:
-                    fake1, fake2 = self.netEMA(label, coord, z=z)
+                    fake1, fake2 = self.netEMA(label, coord, z=z, label_idx=label_idx)
             return fake1, fake2
 
+    def prefetch_D_inputs(self, memo_D, label, fake1, fake2, real_image, pseudo_image):
+        # everything a discriminator sees in losses_D, concatenated into one forward per discriminator
+        opt = self.opt
+        if opt.use_output2:
+            inputs = {}
+            if opt.add_real_adv_loss_output2 or opt.add_real_binary_gan_loss_output2:
+                inputs.update(fake2=fake2, real_image=real_image)
+            if opt.add_pseudo_adv_loss_output2:
+                inputs.update(pseudo_image=pseudo_image)
+            memo_D.prefetch('netD_output2', inputs)
+        if opt.use_netD_output1:
+            inputs = {}
+            if opt.add_pseudo_adv_loss_output1 or opt.add_real_adv_loss_output1:
+                inputs.update(fake1=fake1)
+                if opt.add_pseudo_adv_loss_output1:
+                    inputs.update(pseudo_image=pseudo_image)
+                if opt.add_real_adv_loss_output1:
+                    inputs.update(real_image=real_image)
+            if opt.add_pseudo_binary_gan_loss_output1:
+                inputs.update(fake1=fake1, pseudo_image=pseudo_image)
+            if opt.add_real_binary_gan_loss_output1:
+                inputs.update(fake1=fake1, real_image=real_image)
+            if not opt.no_labelmix:
+                memo_D.labelmix = generate_labelmix(label, fake1, pseudo_image)
+                inputs.update(mixed=memo_D.labelmix[0])
+            memo_D.prefetch('netD_output1', inputs)
+
     def load_checkpoints(self):
         if self.opt.phase == "test":
             which_iter = self.opt.ckpt_iter
@@ -455,13 +532,17 @@ def preprocess_input(opt, data):
     real_semantics = real_label.scatter_(1, real_label_map, 1.0)
 
     pseudo_label_map = data['pseudo_label']
-    bs, _, h, w = pseudo_label_map.size()
-    nc = 151
-    if opt.gpu_ids != "-1":
-        pseudo_label = torch.zeros(bs, nc, h, w, dtype=torch.float).cuda()
+    if opt.use_label_index_input:
+        # the pretrained generator gathers its first SPADE conv from the index map
+        pseudo_semantics = pseudo_label_map
     else:
-        pseudo_label = torch.zeros(bs, nc, h, w, dtype=torch.float)
-    pseudo_semantics = pseudo_label.scatter_(1, pseudo_label_map, 1.0)
+        bs, _, h, w = pseudo_label_map.size()
+        nc = 151
+        if opt.gpu_ids != "-1":
+            pseudo_label = torch.zeros(bs, nc, h, w, dtype=torch.float).cuda()
+        else:
+            pseudo_label = torch.zeros(bs, nc, h, w, dtype=torch.float)
+        pseudo_semantics = pseudo_label.scatter_(1, pseudo_label_map, 1.0)
 
     if not opt.use_point_embedding:
         data['embed_idx_map'] = None
@@ -1,19 +1,120 @@
+import contextlib
+import threading
+
 import torch
 import torch.nn as nn
 
+from torch.nn.parallel import DistributedDataParallel
+
 from models.sync_batchnorm import DataParallelWithCallback
 
 
 def put_on_multi_gpus(model, opt):
+    if getattr(opt, 'distributed', False):
+        return put_on_distributed(model, opt)
     if opt.gpu_ids != "-1":
         gpus = list(map(int, opt.gpu_ids.split(",")))
         model = DataParallelWithCallback(model, device_ids=gpus).cuda()
     else:
         model.module = model
-    assert len(opt.gpu_ids.split(",")) == 0 or opt.batch_size % len(opt.gpu_ids.split(",")) == 0
+    # DataParallel splits every micro-batch over the GPUs, also unevenly
+    assert opt.batch_size // getattr(opt, 'accum_steps', 1) >= len(opt.gpu_ids.split(","))
     return model
 
 
+def put_on_distributed(model, opt):
+    # one process per device, batchnorm statistics are synchronized by the native SyncBatchNorm on GPUs;
+    # buffers are not broadcast in forward, so rank 0 alone can run the model for images and FID
+    if opt.gpu_ids != "-1":
+        device = torch.cuda.current_device()
+        model = nn.SyncBatchNorm.convert_sync_batchnorm(model).cuda(device)
+        return DistributedDataParallel(model, device_ids=[device], output_device=device,
+                                       find_unused_parameters=True, broadcast_buffers=False)
+    return DistributedDataParallel(model, find_unused_parameters=True, broadcast_buffers=False)
+
+
+def get_autocast(opt):
+    """Autocast context of the G and D phases for --amp."""
+    amp = getattr(opt, 'amp', 'none')
+    if amp == 'none':
+        return contextlib.nullcontext()
+    device_type = 'cpu' if opt.gpu_ids == "-1" else 'cuda'
+    if device_type == 'cpu' and amp == 'fp16':
+        raise ValueError('--amp fp16 needs a GPU, use --amp bf16 on the CPU')
+    dtype = torch.float16 if amp == 'fp16' else torch.bfloat16
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(device_type=device_type, dtype=dtype)
+    if device_type == 'cuda' and amp == 'fp16':
+        return torch.cuda.amp.autocast()
+    raise ValueError('--amp %s on %s needs a newer torch with torch.autocast' % (amp, device_type))
+
+
+@contextlib.contextmanager
+def autocast_disabled():
+    """Runs the block in fp32 inside an autocast region (the inputs still have to be cast with .float())."""
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(torch.cuda.amp.autocast(enabled=False))
+        if hasattr(torch, 'cpu') and hasattr(torch.cpu, 'amp'):
+            stack.enter_context(torch.cpu.amp.autocast(enabled=False))
+        yield
+
+
+# per thread, DataParallel runs the backward (and so the recomputation) of every device in its own thread
+_recompute_state = threading.local()
+
+
+def is_recomputing():
+    """True while checkpoint_call recomputes a block in backward, in the current thread."""
+    return getattr(_recompute_state, 'active', False)
+
+
+def checkpoint_call(module, *inputs):
+    """Runs module(*inputs) with activation checkpointing, the activations are recomputed in backward.
+
+    The reentrant checkpoint only backpropagates into the parameters if an input requires grad,
+    which real images do not, so a dummy input that requires grad is passed along. The autocast
+    state of the forward is restored for the recomputation (torch < 1.10 does not do it).
+    """
+    if not torch.is_grad_enabled():
+        return module(*inputs)
+    autocast_state = _get_autocast_state()
+
+    def run(dummy, *args):
+        if not torch.is_grad_enabled():
+            return module(*args)
+        _recompute_state.active = True
+        try:
+            with _restore_autocast(autocast_state):
+                return module(*args)
+        finally:
+            _recompute_state.active = False
+
+    dummy = torch.ones(1, requires_grad=True)
+    return torch.utils.checkpoint.checkpoint(run, dummy, *inputs)
+
+
+def _get_autocast_state():
+    cuda = torch.is_autocast_enabled()
+    cuda_dtype = torch.get_autocast_gpu_dtype() if hasattr(torch, 'get_autocast_gpu_dtype') else torch.float16
+    cpu = hasattr(torch, 'is_autocast_cpu_enabled') and torch.is_autocast_cpu_enabled()
+    cpu_dtype = torch.get_autocast_cpu_dtype() if cpu else None
+    return cuda, cuda_dtype, cpu, cpu_dtype
+
+
+@contextlib.contextmanager
+def _restore_autocast(state):
+    cuda, cuda_dtype, cpu, cpu_dtype = state
+    with contextlib.ExitStack() as stack:
+        if cuda:
+            if hasattr(torch, 'autocast'):
+                stack.enter_context(torch.autocast(device_type='cuda', dtype=cuda_dtype))
+            else:
+                stack.enter_context(torch.cuda.amp.autocast())
+        if cpu:
+            stack.enter_context(torch.autocast(device_type='cpu', dtype=cpu_dtype))
+        yield
+
+
 def generate_labelmix(label, fake_image, real_image):
     target_map = torch.argmax(label, dim=1, keepdim=True)
     all_classes = torch.unique(target_map)
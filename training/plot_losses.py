@@ -0,0 +1,61 @@
+import utils.metrics as utils_metrics
+
+import argparse
+import os
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+
+def plot(x, y, name, path, dpi):
+    fig, ax = plt.subplots(1)
+    plt.plot(x, y)
+    plt.ylabel('loss')
+    plt.xlabel('iterations')
+    plt.title(name)
+    plt.savefig(os.path.join(path, '%s.png' % name), dpi=dpi)
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='plots the losses/losses.jsonl (or .csv) written during training')
+    parser.add_argument('--name', type=str, required=True, help='name of the experiment')
+    parser.add_argument('--checkpoints_dir', type=str, default='./checkpoints')
+    parser.add_argument('--losses', type=str, nargs='*', default=None, help='losses to plot, all by default')
+    parser.add_argument('--dpi', type=int, default=150)
+    args = parser.parse_args()
+
+    path = os.path.join(args.checkpoints_dir, args.name, "losses")
+    file_name = os.path.join(path, "losses.jsonl")
+    if not os.path.exists(file_name):
+        file_name = os.path.join(path, "losses.csv")
+    columns = utils_metrics.read_metrics(file_name)
+    x = np.array(columns.pop('iter'))
+
+    # plot each loss, missing values break the line
+    curves = {}
+    for name, values in columns.items():
+        if args.losses is not None and name not in args.losses:
+            continue
+        y = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        if np.isnan(y).all():
+            continue
+        curves[name] = y
+        plot(x, y, name, path, args.dpi)
+
+    # plot combined loss
+    fig, ax = plt.subplots(1)
+    for name, y in curves.items():
+        plt.plot(x, y, label=name)
+    plt.ylabel('loss')
+    plt.xlabel('iterations')
+    plt.legend(loc="upper right")
+    plt.savefig(os.path.join(path, 'combined.png'), dpi=args.dpi)
+    plt.close(fig)
+    print('plotted %d losses of %d iterations to %s' % (len(curves), len(x), path))
+
+
+if __name__ == '__main__':
+    main()
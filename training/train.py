@@ -6,9 +6,11 @@ import models.pretrained_oasis_models as pretrained_oasis_models
 import dataloaders.dataloaders as dataloaders
 import utils.utils as utils
 from utils.fid_scores import fid_pytorch
+from utils.fid_evaluator import fid_evaluator
 import config
 
 from time import time
+import functools
 import random
 import numpy as np
 
@@ -16,59 +18,82 @@ from train_etc_util import (style_recon_model_list, oasis_3dcoord_model_list,
                             surface_feat_model_list, usis_model_list, omni_model_list,
                             class_specific_model_list)
 from models.util import ortho
+from utils.sparse_optim import LazyAdam
+from utils.input_cache import input_feature_cache
+import utils.pseudo_cache as utils_pseudo_cache
+import utils.distributed as utils_distributed
+import utils.checkpoints as utils_checkpoints
+import utils.metrics as utils_metrics
+import utils.profiler as utils_profiler
 
 
 def main(opt):
     global model, loss
+    # --- join the torchrun process group, only rank 0 logs, saves and computes FID ---#
+    utils_distributed.init_distributed(opt)
+    is_main = opt.rank == 0
     # --- create utils ---#
     timer = utils.timer(opt)
     if opt.model in ['recon', 'style_recon', 'cnn_style_recon', 'fusion']:
-        visualizer_losses = utils.losses_saver(opt, ["Generator", "Recon", "D_fake", "D_real", "LabelMix"])
+        visualizer_losses = utils_metrics.metrics_logger(opt, ["Generator", "Recon", "D_fake", "D_real", "LabelMix"])
     elif opt.model in oasis_3dcoord_model_list or opt.model in surface_feat_model_list:
-        visualizer_losses = utils.losses_saver(opt,
-                                               ["Generator", "Vgg", "Pseudo_recon_l1", "Pseudo_recon_l2",
-                                                "Output12_recon_l1", "Generator_output1",
-                                                "G_binary_output2",
-                                                "G_binary_output1_for_pseudo", "G_binary_output1_for_real",
-                                                "D_fake", "D_real", "D_pseudo", "LabelMix",
-                                                "D_fake_output1", "D_pseudo_output1",
-                                                "D_real_output1",
-                                                "D_binary",
-                                                "D_binary_output1_for_pseudo", "D_binary_output1_for_real",
-                                                "KLD",
-                                                ])
+        visualizer_losses = utils_metrics.metrics_logger(opt,
+                                                      ["Generator", "Vgg", "Pseudo_recon_l1", "Pseudo_recon_l2",
+                                                       "Output12_recon_l1", "Generator_output1",
+                                                       "G_binary_output2",
+                                                       "G_binary_output1_for_pseudo", "G_binary_output1_for_real",
+                                                       "D_fake", "D_real", "D_pseudo", "LabelMix",
+                                                       "D_fake_output1", "D_pseudo_output1",
+                                                       "D_real_output1",
+                                                       "D_binary",
+                                                       "D_binary_output1_for_pseudo", "D_binary_output1_for_real",
+                                                       "KLD",
+                                                       ])
     elif opt.model in usis_model_list:
-        visualizer_losses = utils.losses_saver(opt, ["G_adv", "Seg", "D_fake", "D_real", "R1"])
+        visualizer_losses = utils_metrics.metrics_logger(opt, ["G_adv", "Seg", "D_fake", "D_real", "R1"])
     elif opt.model in omni_model_list:
-        visualizer_losses = utils.losses_saver(opt, ["G_adv", "Pseudo_recon_l1", "Pseudo_recon_l2", "Vgg",
-                                                     "D_fake", "D_pseudo", "D_real", "LabelMix"])
+        visualizer_losses = utils_metrics.metrics_logger(opt, ["G_adv", "Pseudo_recon_l1", "Pseudo_recon_l2", "Vgg",
+                                                            "D_fake", "D_pseudo", "D_real", "LabelMix"])
     elif opt.model in class_specific_model_list:
-        visualizer_losses = utils.losses_saver(opt, ["G_adv", "D_fake", "D_real", "LabelMix"])
+        visualizer_losses = utils_metrics.metrics_logger(opt, ["G_adv", "D_fake", "D_real", "LabelMix"])
     else:
-        visualizer_losses = utils.losses_saver(opt, ["Generator", "Vgg", "D_fake", "D_real", "LabelMix"])
+        visualizer_losses = utils_metrics.metrics_logger(opt, ["Generator", "Vgg", "D_fake", "D_real", "LabelMix"])
     losses_computer = losses.losses_computer(opt)
     dataloader, dataloader_val = dataloaders.get_dataloaders(opt)
     im_saver = utils.image_saver(opt)
-    fid_computer = fid_pytorch(opt, dataloader_val, dataloader)
+    # with --fid_async the evaluator process computes the real-set statistics
+    fid_computer = fid_pytorch(opt, dataloader_val, dataloader) if is_main and not opt.fid_async else None
     # --- create models ---#
 
     use_pretrained_oasis_model = False
     if opt.model == 'surface_feat':
         model = surface_feat_models.OASIS_model(opt)
         preprocess_input_func = surface_feat_models.preprocess_input
-        use_pretrained_oasis_model = True
+        # with a pseudo image cache OASIS is only needed to refresh it
+        use_pretrained_oasis_model = not opt.use_pseudo_cache or opt.pseudo_cache_refresh_freq > 0
     else:
         raise ValueError('No model')
     model = models.util.put_on_multi_gpus(model, opt)
+    if opt.distributed:
+        # same initialization on every rank (DDP broadcasts it anyway), different z and labelmix masks
+        utils.fix_seed(opt.seed + opt.rank)
 
     # --- create pretrained OASIS model ---#
     pretrained_oasis_model = None
     if use_pretrained_oasis_model:
-        pretrained_oasis_model = pretrained_oasis_models.OASIS_model(opt)
-        pretrained_oasis_model = models.util.put_on_multi_gpus(pretrained_oasis_model, opt)
-        pretrained_oasis_model.eval()
+        pretrained_oasis_model = pretrained_oasis_models.get_pretrained_oasis_model(opt)
+
+    fid_async = None
+    if opt.fid_async and is_main and opt.model not in class_specific_model_list:
+        fid_async = fid_evaluator(opt, model, preprocess_input_func,
+                                  use_pretrained_oasis_model=not opt.use_pseudo_cache)
+
+    pseudo_cache_refresher = None
+    if opt.use_pseudo_cache and opt.pseudo_cache_refresh_freq > 0 and is_main:
+        pseudo_cache_refresher = utils_pseudo_cache.pseudo_cache_refresher(opt, pretrained_oasis_model)
 
     # --- create optimizers ---#
+    optimizer_embedding = None
     if opt.model in class_specific_model_list:
         netG_params = []
         netD_params = []
@@ -91,8 +116,23 @@ def main(opt):
         if opt.use_output2:
             netD_params += list(model.module.netD_output2.parameters())
 
+        netG_params = list(model.module.netG.parameters())
+        if opt.sparse_point_embedding:
+            # the point embedding gets sparse gradients, so it is updated lazily by its own optimizer
+            assert opt.model in surface_feat_model_list and opt.use_point_embedding
+            embedding_weight = model.module.netG.coord_mlp.embedding.weight
+            netG_params = [p for p in netG_params if p is not embedding_weight]
+            lr_embedding = opt.lr_g if opt.lr_embedding is None else opt.lr_embedding
+            optimizer_embedding = LazyAdam([embedding_weight], lr=lr_embedding, betas=(opt.beta1, opt.beta2),
+                                           rowwise=opt.embedding_rowwise_adam)
+
+        if opt.pos_encoding_model == 'hashgrid' and opt.lr_hashgrid is not None:
+            hashgrid_weight = model.module.netG.coord_mlp.pos_encoding.embeddings
+            netG_params = [{'params': [p for p in netG_params if p is not hashgrid_weight]},
+                           {'params': [hashgrid_weight], 'lr': opt.lr_hashgrid, 'weight_decay': 0.0}]
+
         if opt.optim == 'adam':
-            optimizerG = torch.optim.Adam(model.module.netG.parameters(), 
+            optimizerG = torch.optim.Adam(netG_params, 
                                           lr=opt.lr_g, betas=(opt.beta1, opt.beta2),
                                           weight_decay=opt.g_weight_decay)
             optimizerD = torch.optim.Adam(netD_params, 
@@ -117,26 +157,69 @@ def main(opt):
         for i in range(num_z_list):
             print(z_list[i][0])
 
+    input_cache = None
+    if opt.input_cache_mb > 0:
+        assert opt.model in surface_feat_model_list
+        input_cache = input_feature_cache(opt)
+
+    ema_updater = None
+    if not opt.no_EMA:
+        ema_updater = utils.ema_updater(opt, model)
+
+    # --- mixed precision, the weights, optimizer states and EMA stay in fp32 ---#
+    scaler_G = torch.cuda.amp.GradScaler(enabled=opt.amp == 'fp16')
+    scaler_D = torch.cuda.amp.GradScaler(enabled=opt.amp == 'fp16')
+
+    # --- forward and backward in opt.accum_steps micro-batches, one optimizer step per batch ---#
+    accumulate_G = functools.partial(utils.accumulate_gradients, opt, model, scaler_G)
+    accumulate_D = functools.partial(utils.accumulate_gradients, opt, model, scaler_D)
+
+    # --- optimizer states of --continue_train, checkpoints are written by a background thread ---#
+    optimizers = {'optimizerG': optimizerG, 'optimizerD': optimizerD}
+    if optimizer_embedding is not None:
+        optimizers['optimizer_embedding'] = optimizer_embedding
+    if opt.model in usis_model_list:
+        optimizers['optimizer_seg'] = optimizer_seg
+    scalers = {'scaler_G': scaler_G, 'scaler_D': scaler_D}
+    training_state = utils_checkpoints.load_training_state(opt, optimizers, scalers)
+    ckpt_writer = utils_checkpoints.checkpoint_writer(opt, optimizers, scalers) if is_main else None
+
+    # --- --profile times the phases of every iteration, the wrapped functions are timed as one phase ---#
+    profiler = utils_profiler.phase_profiler(opt)
+    preprocess_input_step = profiler.wrap('preprocess_input', preprocess_input_func)
+    pretrained_oasis_step = profiler.wrap('pseudo_image', pretrained_oasis_model)
+    accumulate_G = profiler.wrap('G', accumulate_G)
+    accumulate_D = profiler.wrap('D', accumulate_D)
+    visualize_batch = profiler.wrap('visualize', im_saver.visualize_batch)
+
     # --- the training loop ---#
     already_started = False
     start_epoch, start_iter = utils.get_start_iters(opt.loaded_latest_iter, len(dataloader))
+    if training_state is not None and training_state['cur_iter'] == opt.loaded_latest_iter:
+        # the saved sampler position, also when the number of batches per epoch has changed
+        start_epoch, start_iter = training_state['epoch'], training_state['iter_in_epoch'] + 1
+        if start_iter == len(dataloader):
+            start_epoch, start_iter = start_epoch + 1, 0
 
     s_epoch = time()
     for epoch in range(start_epoch, opt.num_epochs):
 
         np.random.seed()  # reset seed
+        if opt.distributed:
+            dataloader.sampler.set_epoch(epoch)
 
         s_time = time()
-        for i, data_i in enumerate(dataloader):
+        for i, data_i in enumerate(profiler.iterate(dataloader)):
             if not already_started and i < start_iter:
                 continue
             already_started = True
             cur_iter = epoch * len(dataloader) + i
+            data_i = profiler.to_device(data_i)
 
             # --- unpack data ---
             if opt.model in style_recon_model_list:
                 # fake_label, coord_image, real_image, real_label, z_vec = preprocess_input_func(opt, data_i)
-                data_dict = preprocess_input_func(opt, data_i)
+                data_dict = preprocess_input_step(opt, data_i)
                 fake_label = data_dict['fake_label']
                 coord_image = data_dict['coord_image']
                 real_image = data_dict['real_image']
@@ -146,7 +229,7 @@ def main(opt):
             elif 'style_interpolation' in opt.model:
                 # real_label: ade20k_label
                 # In Discriminator, we use only fake_label (blender_label)
-                fake_label, coord_image, _, real_label = preprocess_input_func(opt, data_i)
+                fake_label, coord_image, _, real_label = preprocess_input_step(opt, data_i)
 
                 if opt.use_fixed_z_vec:
                     z_vec = random.choices(z_list, k=fake_label.size(0))
@@ -158,14 +241,14 @@ def main(opt):
 
                 # Generate real_image from fake_label by using pre-trained OASIS
                 with torch.no_grad():
-                    real_image = pretrained_oasis_model(None, real_label, "generate", None, z_vec)
+                    real_image = pretrained_oasis_step(None, real_label, "generate", None, z_vec)
 
             #                # Un-normalize coordinate
             #                if opt.un_normalize_coord:
             #                    coord_image = coord_image * 4
             #                    print(coord_image.min(), coord_image.max())
             elif opt.model in oasis_3dcoord_model_list:
-                fake_label, coord_image, real_image, real_label, pseudo_label = preprocess_input_func(opt, data_i)
+                fake_label, coord_image, real_image, real_label, pseudo_label = preprocess_input_step(opt, data_i)
 
                 # Sampling z_vec
                 z_vec = torch.randn(fake_label.shape[0], opt.z_dim, dtype=torch.float32,
@@ -173,25 +256,36 @@ def main(opt):
 
                 # Generate real_image from fake_label by using pre-trained OASIS
                 with torch.no_grad():
-                    pseudo_image = pretrained_oasis_model(None, pseudo_label, "generate", None, z_vec)
+                    pseudo_image = pretrained_oasis_step(None, pseudo_label, "generate", None, z_vec)
 
             elif opt.model in surface_feat_model_list or opt.model in omni_model_list:
                 feat_map = None
                 if opt.use_3dfeat:
-                    fake_label, coord_image, real_image, real_label, pseudo_label, embed_idx_map, feat_map = preprocess_input_func(opt, data_i)
+                    fake_label, coord_image, real_image, real_label, pseudo_label, embed_idx_map, feat_map = preprocess_input_step(opt, data_i)
                 else:
-                    fake_label, coord_image, real_image, real_label, pseudo_label, embed_idx_map = preprocess_input_func(opt, data_i)
-
-                # Sampling z_vec
-                z_vec = torch.randn(fake_label.shape[0], opt.z_dim, dtype=torch.float32,
-                                    device=fake_label.device)
+                    fake_label, coord_image, real_image, real_label, pseudo_label, embed_idx_map = preprocess_input_step(opt, data_i)
+                # the generator reads the integer label map, fake_label stays one-hot for D and the losses
+                label_idx = data_i['label'] if opt.use_label_index_input else None
+
+                input_block = None
+                if input_cache is not None:
+                    input_block = input_cache(model.module.netG, data_i, fake_label, coord_image, feat_map)
+
+                if opt.use_pseudo_cache:
+                    # cached pseudo image and the z it was rendered with
+                    pseudo_image = data_i['pseudo_image'].to(fake_label.device, non_blocking=True)
+                    z_vec = data_i['pseudo_z'].to(fake_label.device, non_blocking=True)
+                else:
+                    # Sampling z_vec
+                    z_vec = torch.randn(fake_label.shape[0], opt.z_dim, dtype=torch.float32,
+                                        device=fake_label.device)
 
-                # Generate real_image from fake_label by using pre-trained OASIS
-                with torch.no_grad():
-                    pseudo_image = pretrained_oasis_model(None, pseudo_label, "generate", None, z_vec)
+                    # Generate real_image from fake_label by using pre-trained OASIS
+                    with torch.no_grad():
+                        pseudo_image = pretrained_oasis_step(None, pseudo_label, "generate", None, z_vec)
 
             elif opt.model in usis_model_list:
-                fake_label, coord_image, real_image, embed_idx_map = preprocess_input_func(opt, data_i)
+                fake_label, coord_image, real_image, embed_idx_map = preprocess_input_step(opt, data_i)
 
                 # Sampling z_vec
                 z_vec = torch.randn(fake_label.shape[0], opt.z_dim, dtype=torch.float32,
@@ -201,15 +295,15 @@ def main(opt):
             elif opt.model in class_specific_model_list:
                 feat_map = None
                 if opt.use_3dfeat:
-                    fake_label, coord_image, real_image, real_label, pseudo_label, embed_idx_map, feat_map, cs_real_image, cs_real_label = preprocess_input_func(opt, data_i)
+                    fake_label, coord_image, real_image, real_label, pseudo_label, embed_idx_map, feat_map, cs_real_image, cs_real_label = preprocess_input_step(opt, data_i)
                 else:
-                    fake_label, coord_image, real_image, real_label, pseudo_label, embed_idx_map, cs_real_image, cs_real_label = preprocess_input_func(opt, data_i)
+                    fake_label, coord_image, real_image, real_label, pseudo_label, embed_idx_map, cs_real_image, cs_real_label = preprocess_input_step(opt, data_i)
 
                 # Sampling z_vec
                 z_vec = torch.randn(fake_label.shape[0], opt.z_dim, dtype=torch.float32,
                                     device=fake_label.device)
             else:
-                fake_label, coord_image, real_image, real_label = preprocess_input_func(opt, data_i)
+                fake_label, coord_image, real_image, real_label = preprocess_input_step(opt, data_i)
 
             # Normalize z_vec
             if opt.normalize_z_vec:
@@ -220,6 +314,7 @@ def main(opt):
 
             # --- generator update ---#
             losses_G_dict = None
+            fake_for_D = None
             if i % opt.D_steps_per_G == 0:
                 if opt.model in 'class_specific':
                     for net in model.module.class_specific_netG_list:
@@ -230,43 +325,49 @@ def main(opt):
                     model.module.unet.zero_grad()
 
                 if opt.model in style_recon_model_list or 'style_interpolation' in opt.model:
-                    loss_G, losses_G_dict = model(fake_label, coord_image, real_image, real_label, z_vec, "losses_G",
-                                                  losses_computer)
+                    loss_G, losses_G_dict = accumulate_G(fake_label, coord_image, real_image, real_label, z_vec, "losses_G",
+                                                         losses_computer)
                 elif opt.model in oasis_3dcoord_model_list:
-                    loss_G, losses_G_dict = model(pseudo_image, fake_label, coord_image,
-                                                  real_image, real_label,
-                                                  "losses_G",
-                                                  losses_computer, z_vec)
+                    loss_G, losses_G_dict = accumulate_G(pseudo_image, fake_label, coord_image,
+                                                         real_image, real_label,
+                                                         "losses_G",
+                                                         losses_computer, z_vec)
                 elif opt.model in surface_feat_model_list:
-                    loss_G, losses_G_dict = model(pseudo_image, fake_label, coord_image,
-                                                  real_image, real_label, embed_idx_map,
-                                                  "losses_G",
-                                                  losses_computer, z_vec, feat_map)
+                    outputs_G = accumulate_G(pseudo_image, fake_label, coord_image,
+                                             real_image, real_label, embed_idx_map,
+                                             "losses_G",
+                                             losses_computer, z_vec, feat_map, input_block=input_block,
+                                             label_idx=label_idx)
+                    if opt.reuse_fake_for_D:
+                        loss_G, losses_G_dict, fake_for_D = outputs_G
+                    else:
+                        loss_G, losses_G_dict = outputs_G
                 elif opt.model in usis_model_list:
-                    loss_G, losses_G_dict = model(fake_label, coord_image,
-                                                  real_image, embed_idx_map,
-                                                  "losses_G",
-                                                  losses_computer, z_vec)
+                    loss_G, losses_G_dict = accumulate_G(fake_label, coord_image,
+                                                         real_image, embed_idx_map,
+                                                         "losses_G",
+                                                         losses_computer, z_vec)
                 elif opt.model in omni_model_list:
-                    loss_G, losses_G_dict = model(pseudo_image, fake_label, coord_image,
-                                                  real_image, real_label, embed_idx_map,
-                                                  "losses_G",
-                                                  losses_computer, z_vec, feat_map)
+                    loss_G, losses_G_dict = accumulate_G(pseudo_image, fake_label, coord_image,
+                                                         real_image, real_label, embed_idx_map,
+                                                         "losses_G",
+                                                         losses_computer, z_vec, feat_map)
                 elif opt.model in class_specific_model_list:
-                    loss_G, losses_G_dict = model(fake_label, coord_image,
-                                                  real_image, real_label, embed_idx_map,
-                                                  cs_real_image, cs_real_label,
-                                                  "losses_G",
-                                                  losses_computer, z_vec, feat_map)
+                    loss_G, losses_G_dict = accumulate_G(fake_label, coord_image,
+                                                         real_image, real_label, embed_idx_map,
+                                                         cs_real_image, cs_real_label,
+                                                         "losses_G",
+                                                         losses_computer, z_vec, feat_map)
                 else:
-                    loss_G, losses_G_dict = model(fake_label, coord_image, real_image, real_label, "losses_G",
-                                                  losses_computer)
-                loss_G, losses_G_dict = loss_G.mean(), {name: loss.mean() if loss is not None else None for name, loss
-                                                        in losses_G_dict.items()}
-                loss_G.backward()
-                optimizerG.step()
-                if opt.model in usis_model_list:
-                    optimizer_seg.step()
+                    loss_G, losses_G_dict = accumulate_G(fake_label, coord_image, real_image, real_label, "losses_G",
+                                                         losses_computer)
+                with utils_profiler.span('G_optimizer'):
+                    scaler_G.step(optimizerG)
+                    if optimizer_embedding is not None:
+                        scaler_G.step(optimizer_embedding)
+                    if opt.model in usis_model_list:
+                        scaler_G.step(optimizer_seg)
+                    scaler_G.update()
 
             # --- discriminator update ---#
             if opt.lr_d != 0.0:
@@ -280,141 +381,148 @@ def main(opt):
                         model.module.netD_output2.zero_grad()
 
                 if opt.model in style_recon_model_list or 'style_interpolation' in opt.model:
-                    loss_D, losses_D_dict = model(fake_label, coord_image,
-                                                  real_image, real_label, z_vec, "losses_D",
-                                                  losses_computer)
+                    loss_D, losses_D_dict = accumulate_D(fake_label, coord_image,
+                                                         real_image, real_label, z_vec, "losses_D",
+                                                         losses_computer)
 
                 elif opt.model in oasis_3dcoord_model_list:
-                    loss_D, losses_D_dict = model(pseudo_image, fake_label, coord_image,
-                                                  real_image, real_label,
-                                                  "losses_D",
-                                                  losses_computer, z_vec)
+                    loss_D, losses_D_dict = accumulate_D(pseudo_image, fake_label, coord_image,
+                                                         real_image, real_label,
+                                                         "losses_D",
+                                                         losses_computer, z_vec)
                 elif opt.model in surface_feat_model_list:
-                    loss_D, losses_D_dict = model(pseudo_image, fake_label, coord_image,
-                                                  real_image, real_label, embed_idx_map,
-                                                  "losses_D",
-                                                  losses_computer, z_vec, feat_map)
+                    loss_D, losses_D_dict = accumulate_D(pseudo_image, fake_label, coord_image,
+                                                         real_image, real_label, embed_idx_map,
+                                                         "losses_D",
+                                                         losses_computer, z_vec, feat_map, input_block=input_block,
+                                                         fake=fake_for_D, label_idx=label_idx)
                 elif opt.model in usis_model_list:
-                    loss_D, losses_D_dict = model(fake_label, coord_image,
-                                                  real_image, embed_idx_map,
-                                                  "losses_D",
-                                                  losses_computer, z_vec)
+                    loss_D, losses_D_dict = accumulate_D(fake_label, coord_image,
+                                                         real_image, embed_idx_map,
+                                                         "losses_D",
+                                                         losses_computer, z_vec)
                 elif opt.model in omni_model_list:
-                    loss_D, losses_D_dict = model(pseudo_image, fake_label, coord_image,
-                                                  real_image, real_label, embed_idx_map,
-                                                  "losses_D",
-                                                  losses_computer, z_vec, feat_map)
+                    loss_D, losses_D_dict = accumulate_D(pseudo_image, fake_label, coord_image,
+                                                         real_image, real_label, embed_idx_map,
+                                                         "losses_D",
+                                                         losses_computer, z_vec, feat_map)
                 elif opt.model in class_specific_model_list:
-                    loss_D, losses_D_dict = model(fake_label, coord_image,
-                                                  real_image, real_label, embed_idx_map,
-                                                  cs_real_image, cs_real_label,
-                                                  "losses_D",
-                                                  losses_computer, z_vec, feat_map)
+                    loss_D, losses_D_dict = accumulate_D(fake_label, coord_image,
+                                                         real_image, real_label, embed_idx_map,
+                                                         cs_real_image, cs_real_label,
+                                                         "losses_D",
+                                                         losses_computer, z_vec, feat_map)
                 else:
-                    loss_D, losses_D_dict = model(fake_label, coord_image, real_image, real_label, "losses_D",
-                                                  losses_computer)
-                loss_D, losses_D_dict = loss_D.mean(), {name: loss.mean() if loss is not None else None for name, loss
-                                                        in
-                                                        losses_D_dict.items()}
-                loss_D.backward()
-                if opt.add_ortho_regularize:
-                    ortho(model.module.netD_output1, 1e-4)
-
-                optimizerD.step()
+                    loss_D, losses_D_dict = accumulate_D(fake_label, coord_image, real_image, real_label, "losses_D",
+                                                         losses_computer)
+                with utils_profiler.span('D_optimizer'):
+                    if opt.add_ortho_regularize:
+                        scaler_D.unscale_(optimizerD)
+                        ortho(model.module.netD_output1, 1e-4)
+
+                    scaler_D.step(optimizerD)
+                    scaler_D.update()
             else:
                 losses_D_dict = {}
 
 
+            if pseudo_cache_refresher is not None:
+                with utils_profiler.span('pseudo_cache'):
+                    pseudo_cache_refresher(cur_iter)
+
             # --- stats update ---#
             if not opt.no_EMA:
-                utils.update_EMA(model, cur_iter, dataloader, opt)
+                with utils_profiler.span('EMA'):
+                    ema_updater(model, cur_iter, dataloader, preprocess_input_func)
             # log every opt.freq_print iterations
-            if cur_iter % opt.freq_print == 0:
+            if cur_iter % opt.freq_print == 0 and is_main:
                 if opt.use_D_dontcare_zero_mask:
                     mask = (real_label[:, 0] == 1)
                     real_mask = torch.stack([mask, mask, mask], dim=1)
                     real_image[real_mask] = 0
 
                 if opt.model in style_recon_model_list or 'style_interpolation' in opt.model:
-                    im_saver.visualize_batch(model, fake_label, coord_image, real_image, real_label, cur_iter, z_vec)
+                    visualize_batch(model, fake_label, coord_image, real_image, real_label, cur_iter, z_vec)
                 elif opt.model in oasis_3dcoord_model_list:
-                    im_saver.visualize_batch(model, fake_label, coord_image, real_image, real_label, pseudo_image,
-                                             cur_iter, z_vec)
+                    visualize_batch(model, fake_label, coord_image, real_image, real_label, pseudo_image,
+                                    cur_iter, z_vec)
                 elif opt.model in surface_feat_model_list:
-                    im_saver.visualize_batch(model, fake_label, coord_image, real_image, real_label, pseudo_image,
-                                             cur_iter, z_vec, embed_idx_map, feat_map)
+                    visualize_batch(model, fake_label, coord_image, real_image, real_label, pseudo_image,
+                                    cur_iter, z_vec, embed_idx_map, feat_map)
                 elif opt.model in usis_model_list:
-                    im_saver.visualize_batch(model, fake_label, coord_image, real_image, fake_label, real_image,
-                                             cur_iter, z_vec, embed_idx_map)
+                    visualize_batch(model, fake_label, coord_image, real_image, fake_label, real_image,
+                                    cur_iter, z_vec, embed_idx_map)
                 elif opt.model in omni_model_list:
-                    im_saver.visualize_batch(model, fake_label, coord_image, real_image, real_label, pseudo_image,
-                                             cur_iter, z_vec, embed_idx_map, feat_map)
+                    visualize_batch(model, fake_label, coord_image, real_image, real_label, pseudo_image,
+                                    cur_iter, z_vec, embed_idx_map, feat_map)
                 elif opt.model in class_specific_model_list:
-                    im_saver.visualize_batch(model, fake_label, coord_image, real_image, real_label, None,
-                                             cur_iter, z_vec, embed_idx_map, feat_map, cs_real_image, cs_real_label)
+                    visualize_batch(model, fake_label, coord_image, real_image, real_label, None,
+                                    cur_iter, z_vec, embed_idx_map, feat_map, cs_real_image, cs_real_label)
                 else:
-                    im_saver.visualize_batch(model, fake_label, coord_image, real_image, real_label, cur_iter)
+                    visualize_batch(model, fake_label, coord_image, real_image, real_label, cur_iter)
                 timer(epoch, cur_iter)
-            # save every opt.freq_save_ckpt iterations
+                if input_cache is not None:
+                    print(input_cache)
+            # save every opt.freq_save_ckpt and opt.freq_save_latest iterations
+            ckpt_prefixes = []
             if cur_iter % opt.freq_save_ckpt == 0:
-                utils.save_networks(opt, cur_iter, model)
-            # save every opt.freq_save_latest iterations
+                ckpt_prefixes.append(str(cur_iter))
             if cur_iter % opt.freq_save_latest == 0:
-                utils.save_networks(opt, cur_iter, model, latest=True)
+                ckpt_prefixes.append("latest")
+            if ckpt_prefixes and is_main:
+                with utils_profiler.span('checkpoint'):
+                    ckpt_writer.save(cur_iter, model, ckpt_prefixes, epoch, i)
             # compute fid every opt.freq_fid iterations
-            if cur_iter % opt.freq_fid == 0 and cur_iter > 0:
+            if cur_iter % opt.freq_fid == 0 and cur_iter > 0 and is_main:
                 if opt.model in class_specific_model_list: 
                     pass
+                elif fid_async is not None:
+                    with utils_profiler.span('FID'):
+                        fid_async.submit(cur_iter, model)
                 else:
-                    is_best = fid_computer.update(model, cur_iter, preprocess_input_func,
-                                                  pretrained_oasis_model=pretrained_oasis_model)
+                    with utils_profiler.span('FID'):
+                        is_best = fid_computer.update(model, cur_iter, preprocess_input_func,
+                                                      pretrained_oasis_model=pretrained_oasis_model)
                     if is_best:
-                        utils.save_networks(opt, cur_iter, model, best=True)
-
-            # plot and save every opt.freq_save_loss iterations
-            visualizer_losses(cur_iter, {**losses_G_dict, **losses_D_dict})
+                        with utils_profiler.span('checkpoint'):
+                            ckpt_writer.save(cur_iter, model, ["best"], epoch, i)
+            if fid_async is not None:
+                fid_async.poll()
 
-            losses_G_dict = {name: np.round(x.detach().cpu().item(), 3) for name, x in losses_G_dict.items() if
-                             x is not None}
-            losses_D_dict = {name: np.round(x.detach().cpu().item(), 3) for name, x in losses_D_dict.items() if
-                             x is not None}
+            # accumulate the losses on the device, written every opt.freq_smooth_loss iterations
+            if is_main:
+                with utils_profiler.span('metrics'):
+                    visualizer_losses(cur_iter, {**(losses_G_dict or {}), **losses_D_dict})
 
-            # log every 10 iterations
+            # log every 10 iterations, without waiting for the device
             e_time = time()
-            if cur_iter % 10 == 0:
-                print(f'iter [{i}/{epoch}/{cur_iter}] elp: {e_time - s_time:.3f}s '
-                      f'loss_G: {loss_G.detach().cpu().numpy():.3f}'
-                      # f'loss_G_adv: {losses_G_list[0]:.3f} \t'
-                      # f'loss_G_pseudo_recon_l1: {losses_G_list[2]:.3f} \t'
-                      # #f'loss_G_pseudo_recon_l2: {losses_G_list[3]:.3f} \t'
-                      # f'loss_G_output12_recon_l1: {losses_G_list[4]:.3f} \n'
-                      # f'loss_G_adv_output1: {losses_G_list[5]:.3f} \t'
-                      # f'loss_G_adv_binary: {losses_G_list[6]:.3f} \n'
-                      # f'loss_G_adv_binary_output1: {losses_G_list[7]:.3f} \n'
-                      # f'\n'
-                      # f'loss_D_fake: {losses_D_list[0]:.3f} \t'
-                      # f'loss_D_real: {losses_D_list[1]:.3f} \t'
-                      # f'loss_D_pseudo: {losses_D_list[2]:.3f} \n'
-                      # #f'loss_D_lm: {losses_D_list[3]:.3f} \n'
-                      # f'loss_D_fake_output1: {losses_D_list[4]:.3f} \t'
-                      # f'loss_D_pseudo_output1: {losses_D_list[5]:.3f} \t'
-                      # f'loss_D_binary: {losses_D_list[6]:.3f} \t'
-                      # f'loss_D_binary_output1: {losses_D_list[7]:.3f} \t'
-                      )
-                print({**losses_G_dict, **losses_D_dict})
+            if cur_iter % 10 == 0 and is_main:
+                print(f'iter [{i}/{epoch}/{cur_iter}] elp: {e_time - s_time:.3f}s')
             s_time = time()
+            profiler.step(cur_iter)
 
         # log every epoch
         e_epoch = time()
-        print(f'epoch [{epoch}] elapsed time: {e_epoch - s_epoch:.3f}s')
+        if is_main:
+            print(f'epoch [{epoch}] elapsed time: {e_epoch - s_epoch:.3f}s')
         s_epoch = time()
     ##--- after training ---#
-    # utils.update_EMA(model, cur_iter, dataloader, opt, force_run_stats=True)
+    # ema_updater(model, cur_iter, dataloader, preprocess_input_func, force_run_stats=True)
     # utils.save_networks(opt, cur_iter, model)
     # utils.save_networks(opt, cur_iter, model, latest=True)
     # is_best = fid_computer.update(model, cur_iter)
     # if is_best:
     #    utils.save_networks(opt, cur_iter, model, best=True)
+    profiler.close()
+    if is_main:
+        visualizer_losses.close(cur_iter)
+        im_saver.close()
+    if ckpt_writer is not None:
+        ckpt_writer.wait()
+        ckpt_writer.close()
+    if fid_async is not None:
+        fid_async.close()
+    utils_distributed.cleanup(opt)
     print("The training has successfully finished")
 
 
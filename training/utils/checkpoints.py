@@ -0,0 +1,204 @@
+import os
+import re
+import queue
+import atexit
+import shutil
+import threading
+
+import torch
+
+from train_etc_util import usis_model_list, class_specific_model_list
+
+
+def get_networks(opt, model):
+    """(file name, module) of every network of a checkpoint, named like utils.save_networks."""
+    model_ = model.module if isinstance(model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)) else model
+    networks = []
+    if opt.model in class_specific_model_list:
+        for idx in range(len(model_.class_specific_label_list)):
+            networks.append(("G_%03d" % idx, model_.class_specific_netG_list[idx]))
+            networks.append(("D_%03d" % idx, model_.class_specific_netD_list[idx]))
+    else:
+        networks.append(("G", model_.netG))
+        if opt.use_netD_output1:
+            networks.append(("D_output1", model_.netD_output1))
+        if opt.use_output2:
+            networks.append(("D_output2", model_.netD_output2))
+        if opt.model in usis_model_list:
+            networks.append(("unet", model_.unet))
+    if not opt.no_EMA:
+        networks.append(("EMA", model_.netEMA))
+    return networks
+
+
+def snapshot(obj, buffer, pos):
+    """Copies the tensors of a nested state dict into the pinned host tensors of buffer, reused between calls."""
+    if torch.is_tensor(obj):
+        if obj.is_sparse:
+            return obj.cpu()
+        i = pos[0]
+        pos[0] += 1
+        if i == len(buffer):
+            buffer.append(None)
+        if buffer[i] is None or buffer[i].shape != obj.shape or buffer[i].dtype != obj.dtype:
+            buffer[i] = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=obj.is_cuda)
+        return buffer[i].copy_(obj, non_blocking=True)
+    if isinstance(obj, dict):
+        out = type(obj)((k, snapshot(v, buffer, pos)) for k, v in obj.items())
+        if hasattr(obj, '_metadata'):
+            out._metadata = obj._metadata
+        return out
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v, buffer, pos) for v in obj)
+    return obj
+
+
+def atomic_save(obj, path):
+    # a crash while writing leaves the previous file in place
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def atomic_write_text(text, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class checkpoint_writer():
+    """Writes the checkpoints of utils.save_networks, plus the optimizer / scaler states and the
+    sampler position ({prefix}_optim.pth), from a background thread.
+
+    save() only copies the tensors into one of two pinned host snapshots and returns, it waits
+    when both snapshots are still being written. Every file is written to a temporary file and
+    renamed, and only the newest --keep_last_ckpt iteration checkpoints (and the best one) are kept.
+    """
+    def __init__(self, opt, optimizers, scalers=None):
+        self.opt = opt
+        self.optimizers = optimizers
+        self.scalers = scalers if scalers is not None else {}
+        self.path = os.path.join(opt.checkpoints_dir, opt.name, "models")
+        os.makedirs(self.path, exist_ok=True)
+        self.buffers = [[], []]
+        self.free_buffers = queue.Queue()
+        for slot in range(len(self.buffers)):
+            self.free_buffers.put(slot)
+        self.jobs = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def save(self, cur_iter, model, prefixes, epoch, iter_in_epoch):
+        """prefixes: "latest", "best" and / or str(cur_iter)."""
+        if self.error is not None:
+            raise self.error
+        slot = self.free_buffers.get()
+        files = {name: net.state_dict() for name, net in get_networks(self.opt, model)}
+        if 'optimizer_embedding' in self.optimizers:
+            files['embedding_optim'] = self.optimizers['optimizer_embedding'].state_dict()
+        training_state = {name: optimizer.state_dict() for name, optimizer in self.optimizers.items()
+                          if name != 'optimizer_embedding'}
+        training_state.update({name: scaler.state_dict() for name, scaler in self.scalers.items()})
+        training_state.update({'cur_iter': cur_iter, 'epoch': epoch, 'iter_in_epoch': iter_in_epoch})
+        files['optim'] = training_state
+
+        files = snapshot(files, self.buffers[slot], [0])
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        self.jobs.put((slot, cur_iter, prefixes, files))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            slot, cur_iter, prefixes, files = job
+            try:
+                self.write(cur_iter, prefixes, files)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.free_buffers.put(slot)
+                self.jobs.task_done()
+
+    def write(self, cur_iter, prefixes, files):
+        first_prefix = None
+        for prefix in prefixes:
+            for name, obj in files.items():
+                path = os.path.join(self.path, '%s_%s.pth' % (prefix, name))
+                if first_prefix is None:
+                    atomic_save(obj, path)
+                else:
+                    # the same snapshot again, copying the file is cheaper than pickling it again
+                    shutil.copyfile(os.path.join(self.path, '%s_%s.pth' % (first_prefix, name)), path + '.tmp')
+                    os.replace(path + '.tmp', path)
+            first_prefix = first_prefix or prefix
+            # the iteration files point to complete checkpoints only
+            if prefix in ('latest', 'best'):
+                atomic_write_text(str(cur_iter),
+                                  os.path.join(self.opt.checkpoints_dir, self.opt.name, "%s_iter.txt" % prefix))
+        if any(prefix.isdigit() for prefix in prefixes):
+            self.apply_retention()
+
+    def apply_retention(self):
+        keep_last = getattr(self.opt, 'keep_last_ckpt', 0)
+        if keep_last <= 0:
+            return
+        iters = sorted({int(m.group(1)) for m in (re.match(r'^(\d+)_', f) for f in os.listdir(self.path)) if m})
+        best_iter_path = os.path.join(self.opt.checkpoints_dir, self.opt.name, "best_iter.txt")
+        best_iter = None
+        if os.path.exists(best_iter_path):
+            with open(best_iter_path) as f:
+                best_iter = int(f.read())
+        for old_iter in iters[:-keep_last]:
+            if old_iter == best_iter:
+                continue
+            for f in os.listdir(self.path):
+                if f.startswith('%d_' % old_iter):
+                    os.remove(os.path.join(self.path, f))
+
+    def wait(self):
+        self.jobs.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.thread.is_alive():
+            self.jobs.put(None)
+            self.thread.join()
+
+
+def load_training_state(opt, optimizers, scalers=None):
+    """Loads the optimizer and scaler states of --which_iter, returns the saved sampler position or None."""
+    if not opt.continue_train:
+        return None
+    path = os.path.join(opt.checkpoints_dir, opt.name, "models", str(opt.which_iter) + "_optim.pth")
+    if not os.path.exists(path):
+        print('No optimizer state at %s, starting from zero moments' % path)
+        return None
+    state = torch.load(path, map_location='cpu')
+    for name, optimizer in optimizers.items():
+        if name in state:
+            optimizer.load_state_dict(state[name])
+    for name, scaler in (scalers or {}).items():
+        # a disabled GradScaler saves an empty state
+        if state.get(name):
+            scaler.load_state_dict(state[name])
+    if 'optimizer_embedding' in optimizers:
+        # written to its own file by checkpoint_writer
+        embedding_path = os.path.join(opt.checkpoints_dir, opt.name, "models",
+                                      str(opt.which_iter) + "_embedding_optim.pth")
+        if os.path.exists(embedding_path):
+            optimizers['optimizer_embedding'].load_state_dict(torch.load(embedding_path, map_location='cpu'))
+        else:
+            print('No embedding optimizer state at %s, starting from zero moments' % embedding_path)
+    return {'cur_iter': state['cur_iter'], 'epoch': state['epoch'], 'iter_in_epoch': state['iter_in_epoch']}
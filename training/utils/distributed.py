@@ -0,0 +1,60 @@
+import os
+
+import torch
+import torch.distributed as dist
+
+
+def get_rank():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank()
+    # set by torchrun before the process group exists
+    return int(os.environ.get('RANK', 0))
+
+
+def get_world_size():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_world_size()
+    return int(os.environ.get('WORLD_SIZE', 1))
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def init_distributed(opt):
+    """Joins the process group started by torchrun (one process per GPU, or per CPU slot with gloo).
+
+    Sets opt.rank, opt.local_rank and opt.world_size, they are 0, 0 and 1 without --distributed.
+    """
+    opt.rank, opt.local_rank, opt.world_size = 0, 0, 1
+    if not getattr(opt, 'distributed', False):
+        return
+    if getattr(opt, 'checkpoint_D_down', []) or getattr(opt, 'checkpoint_D_up', []) or getattr(opt, 'checkpoint_G_layers', 0) > 0:
+        # the reentrant checkpoint of torch 1.9 hides the block parameters from the forward graph, DDP with
+        # find_unused_parameters marks them unused and then fails on their gradients from the recomputation
+        raise ValueError('--distributed does not support --checkpoint_D_down / --checkpoint_D_up / --checkpoint_G_layers')
+    if 'RANK' not in os.environ or 'WORLD_SIZE' not in os.environ:
+        raise ValueError('--distributed has to be launched by torchrun (python -m torch.distributed.run)')
+    opt.rank = int(os.environ['RANK'])
+    opt.local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    opt.world_size = int(os.environ['WORLD_SIZE'])
+    if opt.gpu_ids != "-1":
+        gpus = list(map(int, opt.gpu_ids.split(",")))
+        torch.cuda.set_device(gpus[opt.local_rank % len(gpus)])
+    elif opt.dist_backend == 'nccl':
+        raise ValueError('--dist_backend nccl needs GPUs, use gloo with --gpu_ids -1')
+    if opt.dist_backend == 'nccl' and getattr(opt, 'sparse_point_embedding', False):
+        raise ValueError('nccl can not all-reduce the sparse point embedding gradients, use gloo')
+    if opt.batch_size % opt.world_size != 0:
+        raise ValueError('--batch_size %d is not divisible by the %d processes' % (opt.batch_size, opt.world_size))
+    dist.init_process_group(backend=opt.dist_backend, init_method='env://')
+
+
+def barrier(opt):
+    if getattr(opt, 'distributed', False):
+        dist.barrier()
+
+
+def cleanup(opt):
+    if getattr(opt, 'distributed', False):
+        dist.destroy_process_group()
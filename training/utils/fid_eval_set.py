@@ -0,0 +1,151 @@
+import os
+import json
+
+import numpy as np
+import torch
+
+from utils.pseudo_cache import get_cache_dataset, pseudo_image_cache, render_pseudo_images
+
+
+def get_fid_eval_set_dir(opt):
+    if opt.fid_eval_set_dir is not None:
+        return opt.fid_eval_set_dir
+    return os.path.join(opt.checkpoints_dir, opt.name, "fid_eval_set")
+
+
+def select_frames(num_dataset, num_frames):
+    """num_frames frame indices spread evenly over the dataset, all of them for 0."""
+    if num_frames <= 0 or num_frames >= num_dataset:
+        return np.arange(num_dataset)
+    return np.unique(np.linspace(0, num_dataset - 1, num_frames).round().astype(np.int64))
+
+
+class fid_eval_set():
+    """A frozen FID evaluation set: fixed frames without flip, each with one fixed z and its pseudo image.
+
+    The preprocessed inputs are .npy files in get_fid_eval_set_dir(opt), label maps and pseudo images
+    as uint8. They are read once, to pinned host memory or to the GPU (--fid_eval_set_device), and every
+    FID evaluation generates from the same inputs in the same order and batches.
+    """
+    frames_per_write = 16
+
+    def __init__(self, opt):
+        self.opt = opt
+        self.path = get_fid_eval_set_dir(opt)
+        self.device = 'cpu' if opt.gpu_ids == "-1" else 'cuda'
+        self.store_device = 'cpu' if opt.fid_eval_set_device == 'cpu' or opt.gpu_ids == "-1" else 'cuda'
+        self.batch_size = opt.fid_eval_batch_size if opt.fid_eval_batch_size > 0 else opt.batch_size
+        self.tensors = None
+
+    def keys(self):
+        keys = ['label', 'coord_image', 'pseudo_image', 'z']
+        if self.opt.use_point_embedding:
+            keys.append('embed_idx_map')
+        if self.opt.use_3dfeat:
+            keys.append('feat_map')
+        return keys
+
+    def meta(self, dataset):
+        # everything the stored tensors depend on, a mismatch rebuilds the set
+        frame_ids = select_frames(len(dataset), self.opt.fid_eval_frames)
+        return {'names': [os.path.basename(dataset.labels[i]) for i in frame_ids],
+                'seed': self.opt.fid_eval_seed, 'keys': self.keys(), 'z_dim': self.opt.z_dim,
+                'quantize': self.opt.surface_feat_model_quantize, 'load_size': dataset.opt.load_size,
+                'pseudo_cache': self.opt.use_pseudo_cache}
+
+    def is_current(self, dataset):
+        meta_path = os.path.join(self.path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, 'r') as f:
+            return json.load(f) == self.meta(dataset)
+
+    def build(self, dataset, pretrained_oasis_model=None):
+        """Writes the set. The pseudo images are rendered by pretrained_oasis_model from z drawn with
+        --fid_eval_seed, or, without the model, copied with their z from the pseudo image cache."""
+        if pretrained_oasis_model is None and not self.opt.use_pseudo_cache:
+            raise ValueError('the FID evaluation set needs the pretrained OASIS model or --use_pseudo_cache')
+        frame_ids = select_frames(len(dataset), self.opt.fid_eval_frames)
+        z = torch.randn(len(frame_ids), 1, self.opt.z_dim,
+                        generator=torch.Generator().manual_seed(self.opt.fid_eval_seed))
+        cache = None
+        if pretrained_oasis_model is None:
+            cache = pseudo_image_cache(self.opt)
+            cache.check(dataset.labels)
+            cache.open()
+
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = os.path.join(self.path, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        print(f'Writing the FID evaluation set of {len(frame_ids)} frames to {self.path}')
+        arrays = None
+        for start in range(0, len(frame_ids), self.frames_per_write):
+            chunk = frame_ids[start:start + self.frames_per_write]
+            samples = [dataset[idx] for idx in chunk]
+            if cache is None:
+                images, chunk_z = render_pseudo_images(self.opt, pretrained_oasis_model, dataset, chunk, 1,
+                                                       z[start:start + len(chunk)])
+                images = ((images[:, 0] + 1) * 127.5).round().clamp(0, 255).to(torch.uint8).cpu()
+                chunk_z = chunk_z[:, 0].cpu()
+            else:
+                images = torch.from_numpy(np.array(cache.images[chunk, 0]))
+                chunk_z = torch.from_numpy(np.array(cache.z[chunk, 0]))
+            values = {
+                'label': torch.stack([s['label'].long() for s in samples]).to(torch.uint8),
+                'coord_image': torch.stack([s['coord_image'] for s in samples]),
+                'pseudo_image': images,
+                'z': chunk_z,
+            }
+            if self.opt.use_point_embedding:
+                values['embed_idx_map'] = torch.stack([s['embed_idx_map'] for s in samples]).to(torch.int32)
+            if self.opt.use_3dfeat:
+                values['feat_map'] = torch.stack([s['feat_map'] for s in samples])
+            if arrays is None:
+                arrays = {key: np.lib.format.open_memmap(
+                    os.path.join(self.path, key + '.npy'), mode='w+',
+                    dtype=value.numpy().dtype, shape=(len(frame_ids),) + tuple(value.shape[1:]))
+                    for key, value in values.items()}
+            for key, value in values.items():
+                arrays[key][start:start + len(chunk)] = value.numpy()
+        for array in arrays.values():
+            array.flush()
+        # meta.json marks a complete set
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(self.meta(dataset), f)
+        os.replace(meta_path + '.tmp', meta_path)
+        self.tensors = None
+
+    def prepare(self, dataset, pretrained_oasis_model=None):
+        """Builds the set when it is missing or does not match the dataset and the options, then loads it."""
+        if self.tensors is not None:
+            return
+        if not self.is_current(dataset):
+            self.build(get_cache_dataset(self.opt), pretrained_oasis_model)
+        self.tensors = {}
+        for key in self.keys():
+            tensor = torch.from_numpy(np.array(np.load(os.path.join(self.path, key + '.npy'), mmap_mode='r')))
+            if self.store_device == 'cuda':
+                tensor = tensor.cuda()
+            elif self.device == 'cuda':
+                tensor = tensor.pin_memory()
+            self.tensors[key] = tensor
+
+    def __len__(self):
+        return len(self.tensors['z'])
+
+    def batches(self):
+        for start in range(0, len(self), self.batch_size):
+            yield {key: tensor[start:start + self.batch_size].to(self.device, non_blocking=True)
+                   for key, tensor in self.tensors.items()}
+
+    def inputs(self, batch):
+        """The generator inputs of a batch: fake_label, coord_image, pseudo_image, z_vec, embed_idx_map, feat_map."""
+        label_map = batch['label'].long()
+        bs, _, h, w = label_map.size()
+        fake_label = torch.zeros(bs, self.opt.semantic_nc, h, w, dtype=torch.float, device=label_map.device)
+        fake_label = fake_label.scatter_(1, label_map, 1.0)
+        pseudo_image = batch['pseudo_image'].float() / 127.5 - 1
+        embed_idx_map = batch['embed_idx_map'].long() if 'embed_idx_map' in batch else None
+        feat_map = batch.get('feat_map')
+        return fake_label, batch['coord_image'], pseudo_image, batch['z'], embed_idx_map, feat_map
@@ -0,0 +1,137 @@
+import os
+import copy
+import queue
+import atexit
+import traceback
+from collections import OrderedDict
+
+import torch
+import torch.multiprocessing as mp
+
+from utils.checkpoints import get_networks, atomic_save, atomic_write_text
+
+
+def evaluation_model(opt, model):
+    """A CPU copy of the training model with only the generator used by its "generate" mode
+    (netEMA, or netG with --no_EMA), which is registered as both netG and netEMA."""
+    model_ = model.module if isinstance(model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)) else model
+    net = copy.deepcopy(model_.netG if opt.no_EMA else model_.netEMA).cpu()
+    eval_model = copy.copy(model_)
+    eval_model._parameters, eval_model._buffers, eval_model._modules = OrderedDict(), OrderedDict(), OrderedDict()
+    eval_model.netG = net
+    eval_model.netEMA = None if opt.no_EMA else net
+    return eval_model.eval()
+
+
+def evaluator_options(opt):
+    eval_opt = copy.copy(opt)
+    eval_opt.distributed = False
+    if opt.fid_device == 'cpu':
+        eval_opt.gpu_ids = "-1"
+    elif opt.fid_device is not None:
+        eval_opt.gpu_ids = opt.fid_device
+    elif opt.gpu_ids != "-1":
+        # one GPU is enough for the evaluation: the first training GPU
+        eval_opt.gpu_ids = opt.gpu_ids.split(",")[0]
+    if eval_opt.gpu_ids != "-1":
+        torch.cuda.set_device(int(eval_opt.gpu_ids))
+    return eval_opt
+
+
+def write_best(opt, cur_iter, networks):
+    path = os.path.join(opt.checkpoints_dir, opt.name, "models")
+    for name, state_dict in networks.items():
+        atomic_save(state_dict, os.path.join(path, 'best_%s.pth' % name))
+    atomic_write_text(str(cur_iter), os.path.join(opt.checkpoints_dir, opt.name, "best_iter.txt"))
+
+
+def evaluator_loop(opt, eval_model, preprocess_input_func, use_pretrained_oasis_model, slots, jobs, results):
+    # imported in the evaluator process only
+    import dataloaders.dataloaders as dataloaders
+    import models.pretrained_oasis_models as pretrained_oasis_models
+    from utils.fid_scores import fid_pytorch
+
+    opt = evaluator_options(opt)
+    dataloader, dataloader_val = dataloaders.get_dataloaders(opt)
+    fid_computer = fid_pytorch(opt, dataloader_val, dataloader)
+    pretrained_oasis_model = None
+    if use_pretrained_oasis_model:
+        pretrained_oasis_model = pretrained_oasis_models.get_pretrained_oasis_model(opt)
+    if opt.gpu_ids != "-1":
+        eval_model.cuda()
+    name = "G" if opt.no_EMA else "EMA"
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        slot, cur_iter = job
+        try:
+            eval_model.netG.load_state_dict(slots[slot][name])
+            is_best = fid_computer.update(eval_model, cur_iter, preprocess_input_func,
+                                          pretrained_oasis_model=pretrained_oasis_model)
+            if is_best:
+                write_best(opt, cur_iter, slots[slot])
+            results.put((slot, cur_iter, is_best, None))
+        except Exception:
+            results.put((slot, cur_iter, False, traceback.format_exc()))
+
+
+class fid_evaluator():
+    """Computes the FID of fid_pytorch in a separate process, training does not wait for it.
+
+    submit() copies the weights of all networks into one of two snapshots in shared memory and
+    returns; the evaluator process loads the generator of the snapshot on --fid_device, computes
+    the FID and, for a new best one, writes best_*.pth from the same snapshot. When both snapshots
+    are still being evaluated the evaluation of that iteration is skipped.
+    """
+    def __init__(self, opt, model, preprocess_input_func, use_pretrained_oasis_model, num_slots=2):
+        self.opt = opt
+        ctx = mp.get_context('spawn')
+        self.slots = []
+        for _ in range(num_slots):
+            self.slots.append({name: {k: torch.empty_like(v, device='cpu').share_memory_()
+                                      for k, v in net.state_dict().items()}
+                               for name, net in get_networks(opt, model)})
+        self.free_slots = list(range(num_slots))
+        self.jobs = ctx.Queue()
+        self.results = ctx.Queue()
+        self.process = ctx.Process(target=evaluator_loop,
+                                   args=(opt, evaluation_model(opt, model), preprocess_input_func,
+                                         use_pretrained_oasis_model, self.slots, self.jobs, self.results))
+        self.process.start()
+        atexit.register(self.close)
+
+    def submit(self, cur_iter, model):
+        self.poll()
+        if not self.free_slots:
+            print("--- Iter %s: the FID evaluator is busy, skipping this evaluation ---" % cur_iter)
+            return
+        slot = self.free_slots.pop(0)
+        with torch.no_grad():
+            for name, net in get_networks(self.opt, model):
+                for k, v in net.state_dict().items():
+                    self.slots[slot][name][k].copy_(v)
+        self.jobs.put((slot, cur_iter))
+
+    def poll(self, block=False):
+        """Handles the finished evaluations, with block until all submitted ones are finished."""
+        while len(self.free_slots) < len(self.slots):
+            try:
+                slot, cur_iter, is_best, error = self.results.get(timeout=10) if block else self.results.get_nowait()
+            except queue.Empty:
+                if block and self.process.is_alive():
+                    continue
+                if block:
+                    raise RuntimeError('the FID evaluator exited with code %s' % self.process.exitcode)
+                return
+            self.free_slots.append(slot)
+            if error is not None:
+                raise RuntimeError('FID evaluation of iter %s failed:\n%s' % (cur_iter, error))
+            if is_best:
+                print("--- Iter %s: best FID so far, saved as best ---" % cur_iter)
+
+    def close(self):
+        if self.process.is_alive():
+            self.poll(block=True)
+            self.jobs.put(None)
+            self.process.join()
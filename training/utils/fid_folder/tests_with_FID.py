@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import os
 import pathlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
 import numpy as np
@@ -17,9 +19,10 @@ try:
     from tqdm import tqdm
 except ImportError:
     # If not tqdm is not available, provide a mock version of it
-    def tqdm(x): return x
+    def tqdm(x, **kwargs): return x
 
-from util.fid_checks.inception import InceptionV3
+from utils.fid_folder.inception import InceptionV3
+from utils.fid_stats import cached_statistics, activation_statistics, frechet_distance
 
 parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
 parser.add_argument('path', type=str, nargs=2,
@@ -33,80 +36,91 @@ parser.add_argument('--dims', type=int, default=2048,
                           'By default, uses pool3 features'))
 parser.add_argument('-c', '--gpu', default='', type=str,
                     help='GPU to use (leave blank for CPU only)')
+parser.add_argument('--num-workers', type=int, default=8,
+                    help='Threads decoding and resizing the images')
+parser.add_argument('--cache-dir', type=str, default=None,
+                    help=('Directory of cached statistics of the first path, '
+                          'shared with training (checkpoints/fid_stats)'))
+
+# identifies the preprocessing of get_activations in the statistics cache, all images are used
+PREPROCESSING = 'imread skimage.resize 256x256 all'
+
+def load_image(path):
+    """Reads an image file as a (3, 256, 256) float32 array in [0, 1]."""
+    image = resize(imread(str(path)).astype(np.float32), (256, 256, 3))
+    return (image.transpose((2, 0, 1)) / 255).astype(np.float32)
+
+
+def iterate_batches(files, batch_size=50, num_workers=8, prefetch=4):
+    """Yields (n, 3, 256, 256) float tensors of the images in files, in order
+    and with a final partial batch. A pool of num_workers threads decodes and
+    resizes up to prefetch batches ahead; num_workers 0 loads them serially."""
+    starts = range(0, len(files), batch_size)
+    if num_workers <= 0:
+        for start in starts:
+            yield torch.from_numpy(np.stack([load_image(f) for f in files[start:start + batch_size]]))
+        return
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pending = deque()
+        for start in starts:
+            pending.append([pool.submit(load_image, f) for f in files[start:start + batch_size]])
+            if len(pending) > prefetch:
+                yield torch.from_numpy(np.stack([job.result() for job in pending.popleft()]))
+        while pending:
+            yield torch.from_numpy(np.stack([job.result() for job in pending.popleft()]))
+
+
+def iterate_activations(files, model, batch_size=50, dims=2048,
+                        cuda=False, verbose=False, num_workers=8):
+    """Yields the (n, dims) pool_3 activations of the batches of iterate_batches."""
+    model.eval()
+    n_batches = (len(files) + batch_size - 1) // batch_size
+    batches = iterate_batches(files, batch_size, num_workers)
+    with torch.no_grad():
+        for i, batch in enumerate(tqdm(batches, total=n_batches)):
+            if verbose:
+                print('\rPropagating batch %d/%d' % (i + 1, n_batches),
+                      end='', flush=True)
+            if cuda:
+                batch = batch.pin_memory().cuda(non_blocking=True)
+
+            pred = model(batch)[0]
+
+            # If model output is not scalar, apply global spatial average pooling.
+            # This happens if you choose a dimensionality not equal 2048.
+            if pred.shape[2] != 1 or pred.shape[3] != 1:
+                pred = adaptive_avg_pool2d(pred, output_size=(1, 1))
+
+            yield pred.reshape(pred.shape[0], -1)
+    if verbose:
+        print(' done')
+
 
 def get_activations(files, model, batch_size=50, dims=2048,
-                    cuda=False, verbose=False):
+                    cuda=False, verbose=False, num_workers=8):
     """Calculates the activations of the pool_3 layer for all images.
 
     Params:
     -- files       : List of image files paths
     -- model       : Instance of inception model
     -- batch_size  : Batch size of images for the model to process at once.
-                     Make sure that the number of samples is a multiple of
-                     the batch size, otherwise some samples are ignored. This
-                     behavior is retained to match the original FID score
-                     implementation.
+                     The last batch holds the remaining images.
     -- dims        : Dimensionality of features returned by Inception
     -- cuda        : If set to True, use GPU
     -- verbose     : If set to True and parameter out_step is given, the number
                      of calculated batches is reported.
+    -- num_workers : Number of threads decoding and resizing the images
     Returns:
     -- A numpy array of dimension (num images, dims) that contains the
        activations of the given tensor when feeding inception with the
        query tensor.
     """
-    model.eval()
-
-    if len(files) % batch_size != 0:
-        print(('Warning: number of images is not a multiple of the '
-               'batch size. Some samples are going to be ignored.'))
-    if batch_size > len(files):
-        print(('Warning: batch size is bigger than the data size. '
-               'Setting batch size to data size'))
-        batch_size = len(files)
-    n_batches = len(files) // batch_size
-    n_used_imgs = n_batches * batch_size
-
-    pred_arr = np.empty((n_used_imgs, dims))
-
-    for i in tqdm(range(n_batches)):
-        if verbose:
-            print('\rPropagating batch %d/%d' % (i + 1, n_batches),
-                  end='', flush=True)
-        start = i * batch_size
-        end = start + batch_size
-        images = np.array([resize(imread(str(f)).astype(np.float32), (256, 256, 3))
-                          for f in files[start:end]])
-
-        # Reshape to (n_images, 3, height, width)
-        images = images.transpose((0, 3, 1, 2))
-        images /= 255
-
-        batch = torch.from_numpy(images).to(torch.float)
-
-        #import matplotlib.pyplot as plt
-        #import numpy
-
-        #plt.imshow(np.rollaxis(batch[0].detach().cpu().numpy(), 0, 3))
-        #plt.show()
-
-        if cuda:
-            batch = batch.cuda()
-
-        pred = model(batch)[0]
-
-        # If model output is not scalar, apply global spatial average pooling.
-        # This happens if you choose a dimensionality not equal 2048.
-        if pred.shape[2] != 1 or pred.shape[3] != 1:
-            pred = adaptive_avg_pool2d(pred, output_size=(1, 1))
-
-        pred_arr[start:end] = pred.cpu().data.numpy().reshape(batch_size, -1)
-
-    if verbose:
-        print(' done')
-
-    print(pred_arr.shape)
-
+    pred_arr = np.empty((len(files), dims), dtype=np.float32)
+    start = 0
+    for pred in iterate_activations(files, model, batch_size, dims, cuda,
+                                    verbose, num_workers):
+        pred_arr[start:start + len(pred)] = pred.cpu().numpy()
+        start += len(pred)
     return pred_arr
 
 
@@ -168,7 +182,8 @@ def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
 
 
 def calculate_activation_statistics(files, model, batch_size=50,
-                                    dims=2048, cuda=False, verbose=False):
+                                    dims=2048, cuda=False, verbose=False,
+                                    num_workers=8):
     """Calculation of the statistics used by the FID.
     Params:
     -- files       : List of image files paths
@@ -180,37 +195,43 @@ def calculate_activation_statistics(files, model, batch_size=50,
     -- cuda        : If set to True, use GPU
     -- verbose     : If set to True and parameter out_step is given, the
                      number of calculated batches is reported.
+    -- num_workers : Number of threads decoding and resizing the images
     Returns:
     -- mu    : The mean over samples of the activations of the pool_3 layer of
                the inception model.
     -- sigma : The covariance matrix of the activations of the pool_3 layer of
                the inception model.
     """
-    act = get_activations(files, model, batch_size, dims, cuda, verbose)
-    mu = np.mean(act, axis=0)
-    sigma = np.cov(act, rowvar=False)
-    #print(act.shape)
-    #rint(mu.shape)
-    #print(sigma.shape)
-    return mu, sigma
+    # streamed into float64 statistics on the device of the activations
+    stats = activation_statistics(dims, 'cuda' if cuda else 'cpu')
+    for pred in iterate_activations(files, model, batch_size, dims, cuda,
+                                    verbose, num_workers):
+        stats.update(pred)
+    return stats.mu().cpu().numpy(), stats.sigma().cpu().numpy()
 
 
-def _compute_statistics_of_path(path, model, batch_size, dims, cuda):
+def _compute_statistics_of_path(path, model, batch_size, dims, cuda,
+                                cache_dir=None, num_workers=8):
     if path.endswith('.npz'):
         f = np.load(path)
         m, s = f['mu'][:], f['sigma'][:]
         f.close()
     else:
         path = pathlib.Path(path)
-        files = list(path.glob('*.jpg')) + list(path.glob('*.png'))
-        m, s = calculate_activation_statistics(files, model, batch_size,
-                                               dims, cuda)
+        files = sorted(list(path.glob('*.jpg')) + list(path.glob('*.png')))
+        m, s = cached_statistics(
+            cache_dir, files, dims, PREPROCESSING,
+            lambda: calculate_activation_statistics(files, model, batch_size,
+                                                    dims, cuda,
+                                                    num_workers=num_workers))
 
     return m, s
 
 
-def calculate_fid_given_paths(paths, batch_size, cuda, dims):
-    """Calculates the FID of two paths"""
+def calculate_fid_given_paths(paths, batch_size, cuda, dims, cache_dir=None,
+                              num_workers=8):
+    """Calculates the FID of two paths. The statistics of paths[0], the
+    reference set, are kept in cache_dir when it is given."""
     for p in paths:
         if not os.path.exists(p):
             raise RuntimeError('Invalid path: %s' % p)
@@ -222,25 +243,26 @@ def calculate_fid_given_paths(paths, batch_size, cuda, dims):
         model.cuda()
 
     m1, s1 = _compute_statistics_of_path(paths[0], model, batch_size,
-                                         dims, cuda)
+                                         dims, cuda, cache_dir, num_workers)
     m2, s2 = _compute_statistics_of_path(paths[1], model, batch_size,
-                                         dims, cuda)
-    fid_value = calculate_frechet_distance(m1, s1, m2, s2)
+                                         dims, cuda, None, num_workers)
+    # float64 eigendecompositions instead of scipy's sqrtm, see fid_stats.frechet_distance
+    device = 'cuda' if cuda else 'cpu'
+    fid_value = frechet_distance(torch.from_numpy(m1).to(device),
+                                 torch.from_numpy(s1).to(device))(m2, s2)
 
     return fid_value
 
 
 if __name__ == '__main__':
-    #args = parser.parse_args()
-    #os.environ['CUDA_VISIBLE_DEVICES'] = args.gpu
-
-    path1 = "./validation_data/"
-    path2 = "./generated_data/"
-    batch_size = 50
-    dims = 2048
-
-    fid_value = calculate_fid_given_paths([path1, path2],
-                                          batch_size,
-                                          True,
-                                          dims)
+    # $ python -m utils.fid_folder.tests_with_FID REAL_DIR GENERATED_DIR -c 0 --cache-dir ./checkpoints/fid_stats
+    args = parser.parse_args()
+    os.environ['CUDA_VISIBLE_DEVICES'] = args.gpu
+
+    fid_value = calculate_fid_given_paths(args.path,
+                                          args.batch_size,
+                                          args.gpu != '',
+                                          args.dims,
+                                          args.cache_dir,
+                                          args.num_workers)
     print(fid_value)
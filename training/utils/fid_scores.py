@@ -7,6 +7,8 @@ from pathlib import Path
 from PIL import Image
 import models.models as models
 from utils.fid_folder.inception import InceptionV3
+from utils.fid_stats import get_fid_cache_dir, cached_statistics, activation_statistics, frechet_distance
+from utils.fid_eval_set import fid_eval_set
 import matplotlib.pyplot as plt
 
 from train_etc_util import (style_recon_model_list, oasis_3dcoord_model_list, 
@@ -19,24 +21,45 @@ class fid_pytorch():
         self.dims = 2048
         block_idx = InceptionV3.BLOCK_INDEX_BY_DIM[self.dims]
         self.model_inc = InceptionV3([block_idx])
+        self.device = 'cpu' if opt.gpu_ids == "-1" else 'cuda'
         if opt.gpu_ids != "-1":
             self.model_inc.cuda()
         self.val_dataloader = dataloader_val
         self.train_dataloader = dataloader_train
-        self.m1, self.s1 = self.compute_statistics_of_val_path(dataloader_val)
+        self.eval_set = None
+        if getattr(opt, 'use_fid_eval_set', False):
+            if opt.model not in surface_feat_model_list:
+                raise ValueError('--use_fid_eval_set supports the surface_feat models, not %s' % opt.model)
+            self.eval_set = fid_eval_set(opt)
+        self.m1, self.s1 = self.cached_statistics_of_val_path(dataloader_val)
+        # sqrt(sigma1) of the fixed real set is computed once
+        self.fid_engine = frechet_distance(self.m1, self.s1) if opt.fid_backend == 'eigh' else None
         self.best_fid = 99999999
         self.path_to_save = os.path.join(self.opt.checkpoints_dir, self.opt.name, "FID")
         Path(self.path_to_save).mkdir(parents=True, exist_ok=True)
 
+    def cached_statistics_of_val_path(self, dataloader_val):
+        # the real set, its preprocessing and the Inception weights key the statistics in the cache
+        dataset = dataloader_val.dataset
+        files = getattr(dataset, 'real_images', None)
+        preprocessing = '%s load_size=%s bicubic' % (type(dataset).__name__, self.opt.load_size)
+
+        def compute():
+            mu, sigma = self.compute_statistics_of_val_path(dataloader_val)
+            return mu.cpu().numpy(), sigma.cpu().numpy()
+
+        mu, sigma = cached_statistics(get_fid_cache_dir(self.opt), files, self.dims, preprocessing, compute)
+        return torch.from_numpy(mu).to(self.device), torch.from_numpy(sigma).to(self.device)
+
     def compute_statistics_of_val_path(self, dataloader_val):
         print("--- Now computing Inception activations for real set ---")
-        pool = self.accumulate_inception_activations()
-        mu, sigma = torch.mean(pool, 0), torch_cov(pool, rowvar=False)
+        stats = self.accumulate_inception_activations()
+        mu, sigma = stats.mu(), stats.sigma()
         print("--- Finished FID stats for real set ---")
         return mu, sigma
 
     def accumulate_inception_activations(self):
-        pool, logits, labels = [], [], []
+        stats = activation_statistics(self.dims, self.device)
         self.model_inc.eval()
         with torch.no_grad():
             for i, data_i in enumerate(self.val_dataloader):
@@ -45,21 +68,25 @@ class fid_pytorch():
                     image = image.cuda()
                 image = (image + 1) / 2
                 pool_val = self.model_inc(image.float())[0][:, :, 0, 0]
-                pool += [pool_val]
-        return torch.cat(pool, 0)
+                stats.update(pool_val)
+        return stats
 
     def compute_fid_with_valid_path(self, model, preprocess_input_func, pretrained_oasis_model=None):
-        model_ = model.module if isinstance(model, torch.nn.DataParallel) else model
+        model_ = model.module if isinstance(model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)) else model
 
-        pool, logits, labels = [], [], []
-        dynamic_real_pool = []
+        stats = activation_statistics(self.dims, self.device)
+        dynamic_real_stats = activation_statistics(self.dims, self.device)
 
         self.model_inc.eval()
         model_.netG.eval()
         if not self.opt.no_EMA:
             model_.netEMA.eval()
+        batches = self.train_dataloader
+        if self.eval_set is not None:
+            self.eval_set.prepare(self.train_dataloader.dataset, pretrained_oasis_model)
+            batches = self.eval_set.batches()
         with torch.no_grad():
-            for i, data_i in enumerate(self.train_dataloader): # TODO: Use train loader
+            for i, data_i in enumerate(batches): # TODO: Use train loader
                 if self.opt.model in style_recon_model_list:
                     #fake_label, coord_image, real_image, real_label, z_vec = preprocess_input_func(self.opt, data_i)
                     data_dict = preprocess_input_func(self.opt, data_i)
@@ -89,7 +116,7 @@ class fid_pytorch():
 
                     real_image_inc = (real_image + 1) / 2
                     dynamic_real_pool_val = self.model_inc(real_image_inc.float())[0][:,:,0,0]
-                    dynamic_real_pool += [dynamic_real_pool_val]
+                    dynamic_real_stats.update(dynamic_real_pool_val)
                 elif self.opt.model in oasis_3dcoord_model_list:
                     fake_label, coord_image, real_image, real_label, pseudo_label = preprocess_input_func(self.opt, data_i)
 
@@ -99,6 +126,13 @@ class fid_pytorch():
 
                     _, generated = model(None, fake_label, coord_image, None, None, "generate", None, z_vec)
 
+                elif self.opt.model in surface_feat_model_list and self.eval_set is not None:
+                    # frozen frames, z and pseudo images
+                    fake_label, coord_image, pseudo_image, z_vec, embed_idx_map, feat_map = self.eval_set.inputs(data_i)
+                    label_idx = data_i['label'].long() if self.opt.use_label_index_input else None
+                    _, generated = model(pseudo_image, fake_label, coord_image, None, None, embed_idx_map, "generate", None, z_vec, feat_map,
+                                         label_idx=label_idx)
+
                 elif self.opt.model in surface_feat_model_list:
                     feat_map = None
                     if self.opt.use_3dfeat:
@@ -106,15 +140,21 @@ class fid_pytorch():
                     else:
                         fake_label, coord_image, real_image, real_label, pseudo_label, embed_idx_map = preprocess_input_func(self.opt, data_i)
 
-                    # Sampling z_vec
-                    z_vec = torch.randn(fake_label.shape[0], self.opt.z_dim, dtype=torch.float32,
-                                        device=fake_label.device)
+                    if self.opt.use_pseudo_cache:
+                        pseudo_image = data_i['pseudo_image'].to(fake_label.device)
+                        z_vec = data_i['pseudo_z'].to(fake_label.device)
+                    else:
+                        # Sampling z_vec
+                        z_vec = torch.randn(fake_label.shape[0], self.opt.z_dim, dtype=torch.float32,
+                                            device=fake_label.device)
 
-                    # Generate real_image from fake_label by using pre-trained OASIS
-                    with torch.no_grad():
-                        pseudo_image = pretrained_oasis_model(None, pseudo_label, "generate", None, z_vec)
+                        # Generate real_image from fake_label by using pre-trained OASIS
+                        with torch.no_grad():
+                            pseudo_image = pretrained_oasis_model(None, pseudo_label, "generate", None, z_vec)
 
-                    _, generated = model(pseudo_image, fake_label, coord_image, None, None, embed_idx_map, "generate", None, z_vec, feat_map)
+                    label_idx = data_i['label'] if self.opt.use_label_index_input else None
+                    _, generated = model(pseudo_image, fake_label, coord_image, None, None, embed_idx_map, "generate", None, z_vec, feat_map,
+                                         label_idx=label_idx)
 
                 elif self.opt.model in usis_model_list:
                     fake_label, coord_image, real_image, embed_idx_map = preprocess_input_func(self.opt, data_i)
@@ -161,21 +201,23 @@ class fid_pytorch():
 
                 generated = (generated + 1) / 2
                 pool_val = self.model_inc(generated.float())[0][:, :, 0, 0]
-                pool += [pool_val]
-            
-            pool = torch.cat(pool, 0)
-            mu, sigma = torch.mean(pool, 0), torch_cov(pool, rowvar=False)
+                stats.update(pool_val)
+
+            mu, sigma = stats.mu(), stats.sigma()
 
             if 'style_interpolation' in self.opt.model:
-                dynamic_real_pool = torch.cat(dynamic_real_pool, 0)
-                real_mu = torch.mean(dynamic_real_pool, 0)
-                real_sigma = torch_cov(dynamic_real_pool, rowvar=False)
-                answer = self.numpy_calculate_frechet_distance(real_mu, real_sigma, mu, sigma)
+                real_mu, real_sigma = dynamic_real_stats.mu(), dynamic_real_stats.sigma()
+                if self.fid_engine is not None:
+                    answer = frechet_distance(real_mu, real_sigma)(mu, sigma)
+                else:
+                    answer = self.numpy_calculate_frechet_distance(real_mu, real_sigma, mu, sigma)
 #            elif self.opt.model in oasis_3dcoord_model_list:
 #                dynamic_real_pool = torch.cat(dynamic_real_pool, 0)
 #                real_mu = torch.mean(dynamic_real_pool, 0)
 #                real_sigma = torch_cov(dynamic_real_pool, rowvar=False)
 #                answer = self.numpy_calculate_frechet_distance(real_mu, real_sigma, mu, sigma)
+            elif self.fid_engine is not None:
+                answer = self.fid_engine(mu, sigma)
             else:
                 answer = self.numpy_calculate_frechet_distance(self.m1, self.s1, mu, sigma)
         model_.netG.train()
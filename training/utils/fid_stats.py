@@ -0,0 +1,167 @@
+import os
+import hashlib
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+from utils.fid_folder.inception import FID_WEIGHTS_URL
+
+
+class activation_statistics():
+    """Streaming mean and covariance of activation batches, without keeping the activations.
+
+    Every batch is reduced to its float64 count, mean and sum of centered outer products on
+    its device and combined with the running ones by the parallel Welford update (Chan et al.),
+    so neither the memory nor the rounding error grows with the number of images. merge()
+    combines accumulators of other loaders or processes the same way.
+    """
+    def __init__(self, dims=2048, device='cpu'):
+        self.dims = dims
+        self.n = 0
+        self.mean = torch.zeros(dims, dtype=torch.float64, device=device)
+        self.m2 = torch.zeros(dims, dims, dtype=torch.float64, device=device)
+
+    def update(self, batch):
+        """batch: (N, dims) activations"""
+        batch = batch.reshape(batch.shape[0], -1).to(self.mean.device, torch.float64)
+        n = batch.shape[0]
+        if n == 0:
+            return
+        mean = batch.mean(0)
+        centered = batch - mean
+        self.combine(n, mean, centered.t().matmul(centered))
+
+    def combine(self, n, mean, m2):
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * (n / total)
+        self.m2 += m2 + torch.outer(delta, delta) * (self.n * n / total)
+        self.n = total
+
+    def merge(self, other):
+        if other.n > 0:
+            self.combine(other.n, other.mean.to(self.mean.device), other.m2.to(self.mean.device))
+        return self
+
+    def all_reduce(self):
+        """Merges the accumulators of all processes of the process group, every process gets the result."""
+        if not (dist.is_available() and dist.is_initialized()) or dist.get_world_size() == 1:
+            return self
+        state = torch.cat([torch.tensor([float(self.n)], dtype=torch.float64, device=self.mean.device),
+                           self.mean, self.m2.flatten()])
+        states = [torch.empty_like(state) for _ in range(dist.get_world_size())]
+        dist.all_gather(states, state)
+        self.n, self.mean, self.m2 = 0, torch.zeros_like(self.mean), torch.zeros_like(self.m2)
+        for state in states:
+            n = int(state[0].item())
+            if n > 0:
+                self.combine(n, state[1:self.dims + 1], state[self.dims + 1:].view(self.dims, self.dims))
+        return self
+
+    def state_dict(self):
+        return {'n': self.n, 'mean': self.mean.cpu(), 'm2': self.m2.cpu()}
+
+    def load_state_dict(self, state):
+        self.n = state['n']
+        self.mean = state['mean'].to(self.mean.device, torch.float64)
+        self.m2 = state['m2'].to(self.m2.device, torch.float64)
+
+    def mu(self):
+        return self.mean.clone()
+
+    def sigma(self):
+        """The unbiased covariance like numpy.cov and torch_cov."""
+        if self.n < 2:
+            raise ValueError('the covariance needs at least 2 activations, got %d' % self.n)
+        return self.m2 / (self.n - 1)
+
+
+class frechet_distance():
+    """FID against fixed real statistics mu1, sigma1, in float64 torch on their device.
+
+    The symmetric square root of sigma1 is computed once. Every call then needs one symmetric
+    eigendecomposition, as sqrt(S1) S2 sqrt(S1) has the eigenvalues of S1 S2:
+        tr(sqrt(S1 S2)) = sum(sqrt(eigvalsh(sqrt(S1) S2 sqrt(S1))))
+    Negative eigenvalues of the symmetric product are rounding errors of a singular covariance
+    and are clamped to zero, so no diagonal offset is needed. The result agrees with the scipy
+    sqrtm path (fid_pytorch.numpy_calculate_frechet_distance) to SCIPY_TOLERANCE.
+    """
+    def __init__(self, mu1, sigma1):
+        self.mu1 = torch.as_tensor(mu1).to(torch.float64)
+        sigma1 = torch.as_tensor(sigma1).to(self.mu1.device, torch.float64)
+        self.trace_sigma1 = torch.trace(sigma1)
+        w, v = torch.linalg.eigh((sigma1 + sigma1.t()) / 2)
+        self.sqrt_sigma1 = (v * w.clamp(min=0).sqrt()).matmul(v.t())
+
+    def __call__(self, mu2, sigma2):
+        mu2 = torch.as_tensor(mu2).to(self.mu1.device, torch.float64)
+        sigma2 = torch.as_tensor(sigma2).to(self.mu1.device, torch.float64)
+        assert mu2.shape == self.mu1.shape, 'Training and test mean vectors have different lengths'
+        product = self.sqrt_sigma1.matmul(sigma2).matmul(self.sqrt_sigma1)
+        eigvals = torch.linalg.eigvalsh((product + product.t()) / 2)
+        tr_covmean = eigvals.clamp(min=0).sqrt().sum()
+        diff = self.mu1 - mu2
+        return (diff.dot(diff) + self.trace_sigma1 + torch.trace(sigma2) - 2 * tr_covmean).item()
+
+
+# largest difference to the scipy sqrtm FID, relative to the FID value; scipy's Schur-based square
+# root of the non-symmetric product S1 S2 dominates it for singular 2048-d covariances
+SCIPY_TOLERANCE = 1e-4
+
+
+def get_fid_cache_dir(opt):
+    if opt.no_fid_cache:
+        return None
+    if opt.fid_cache_dir is not None:
+        return opt.fid_cache_dir
+    return os.path.join(opt.checkpoints_dir, "fid_stats")
+
+
+def stats_key(files, dims, preprocessing):
+    """Fingerprint of the real set: the image list with the sizes and mtimes of the files,
+    the Inception weights, the feature dimension and a description of the preprocessing."""
+    h = hashlib.sha1()
+    h.update(('%s|%d|%s\n' % (os.path.basename(FID_WEIGHTS_URL), dims, preprocessing)).encode())
+    for path in sorted(str(f) for f in files):
+        st = os.stat(path)
+        h.update(('%s|%d|%d\n' % (os.path.abspath(path), st.st_size, st.st_mtime_ns)).encode())
+    return h.hexdigest()
+
+
+def load_cached_stats(cache_dir, key):
+    """mu, sigma of a cached entry as float64 numpy arrays, None when there is none."""
+    path = os.path.join(cache_dir, key + '.npz')
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as f:
+            return f['mu'], f['sigma']
+    except (OSError, ValueError, KeyError) as e:
+        print('Ignoring the broken FID statistics %s: %s' % (path, e))
+        return None
+
+
+def save_cached_stats(cache_dir, key, mu, sigma, num_images, preprocessing):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + '.npz')
+    tmp_path = '%s.%d.tmp.npz' % (path[:-len('.npz')], os.getpid())
+    np.savez(tmp_path, mu=np.asarray(mu, dtype=np.float64), sigma=np.asarray(sigma, dtype=np.float64),
+             num_images=num_images, preprocessing=preprocessing)
+    os.replace(tmp_path, path)
+
+
+def cached_statistics(cache_dir, files, dims, preprocessing, compute):
+    """mu, sigma of the real set, read from cache_dir when the set has not changed since
+    they were written, computed by compute() -> (mu, sigma) numpy arrays otherwise.
+    cache_dir None always computes them."""
+    if cache_dir is None or not files:
+        return compute()
+    key = stats_key(files, dims, preprocessing)
+    cached = load_cached_stats(cache_dir, key)
+    if cached is not None:
+        print("--- Loaded FID stats of the real set from %s ---" % os.path.join(cache_dir, key + '.npz'))
+        return cached
+    mu, sigma = compute()
+    save_cached_stats(cache_dir, key, mu, sigma, len(files), preprocessing)
+    return mu, sigma
@@ -0,0 +1,93 @@
+import os
+import queue
+import atexit
+import multiprocessing
+
+import numpy as np
+from PIL import Image
+
+
+def compose_grid(batch, cols, pad=2):
+    """(N, H, W, 3) uint8 images to one (rows * H, cols * W, 3) grid, separated by pad white pixels."""
+    n, h, w, c = batch.shape
+    cols = min(cols, n)
+    rows = (n + cols - 1) // cols
+    grid = np.full((rows * cols, h + pad, w + pad, c), 255, dtype=np.uint8)
+    grid[:n, :h, :w] = batch
+    grid = grid.reshape(rows, cols, h + pad, w + pad, c).transpose(0, 2, 1, 3, 4)
+    return grid.reshape(rows * (h + pad), cols * (w + pad), c)[:-pad, :-pad]
+
+
+def write_images(path, cmap, cols, cur_iter, images):
+    """images: name -> (N, H, W, 3) uint8 images or (N, H, W) label indices, colored with cmap."""
+    for name, batch in images.items():
+        if batch is None:
+            continue
+        if batch.ndim == 3:
+            batch = cmap[batch]
+        Image.fromarray(compose_grid(batch, cols)).save(os.path.join(path, '%s_%s.png' % (cur_iter, name)))
+
+
+def writer_loop(jobs, path, cmap, cols):
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        try:
+            write_images(path, cmap, cols, *job)
+        except Exception as e:
+            print('Writing the images of iteration %s failed: %s' % (job[0], e))
+
+
+class image_writer():
+    """Writes the image grids of image_saver from a separate process.
+
+    The training process only puts the host copies of the images into a queue of queue_size
+    iterations; when the queue is full the iteration is dropped. The process is started on the
+    first use, so ranks that never visualize do not start one.
+    """
+    def __init__(self, path, cmap, cols, queue_size=2, background=True):
+        self.path = path
+        self.cmap = cmap
+        self.cols = cols
+        self.queue_size = queue_size
+        self.background = background
+        self.jobs = None
+        self.process = None
+        self.dropped = 0
+
+    def start(self):
+        # spawn, a forked child would inherit the CUDA context of the trainer
+        context = multiprocessing.get_context('spawn')
+        self.jobs = context.Queue(maxsize=self.queue_size)
+        self.process = context.Process(target=writer_loop, args=(self.jobs, self.path, self.cmap, self.cols),
+                                       daemon=True)
+        self.process.start()
+        atexit.register(self.close)
+
+    def full(self):
+        if not self.background:
+            return False
+        if self.process is None:
+            self.start()
+        return self.jobs.full()
+
+    def put(self, cur_iter, images):
+        if not self.background:
+            write_images(self.path, self.cmap, self.cols, cur_iter, images)
+            return
+        if self.process is None:
+            self.start()
+        try:
+            self.jobs.put_nowait((cur_iter, images))
+        except queue.Full:
+            self.drop(cur_iter)
+
+    def drop(self, cur_iter):
+        self.dropped += 1
+        print('Image writer is behind, skipped the images of iteration %d (%d skipped)' % (cur_iter, self.dropped))
+
+    def close(self):
+        if self.process is not None and self.process.is_alive():
+            self.jobs.put(None)
+            self.process.join(timeout=60)
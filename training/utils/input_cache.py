@@ -0,0 +1,51 @@
+import torch
+
+
+class input_feature_cache():
+    """Keeps the encoded per-frame input block of MLPNet (MLPNet.encode_input).
+
+    The block only depends on the frame and its flip, as long as it has no
+    learned part (point/label embeddings, hash grid), so it is computed once and
+    stored in half precision, on the GPU or in pinned host memory, until the
+    memory budget is used up.
+    """
+    def __init__(self, opt):
+        if opt.use_point_embedding or opt.use_label_embedding or opt.pos_encoding_model == 'hashgrid':
+            raise ValueError('the input cache needs a fixed encoding, not a learned one')
+        self.opt = opt
+        self.budget = opt.input_cache_mb * 1024 ** 2
+        self.device = 'cpu' if opt.input_cache_device == 'cpu' or opt.gpu_ids == "-1" else 'cuda'
+        self.blocks = {}
+        self.used = 0
+        self.hits, self.misses = 0, 0
+
+    def keys(self, data):
+        return list(zip(data['idx'].tolist(), data['flip'].tolist()))
+
+    def __call__(self, netG, data, label, coord, feat_map=None):
+        keys = self.keys(data)
+        if all(key in self.blocks for key in keys):
+            self.hits += len(keys)
+            # each pinned block is copied to the device asynchronously and stacked there,
+            # a stack on the host would be pageable memory and a synchronous copy
+            return torch.stack([self.blocks[key].to(label.device, non_blocking=True) for key in keys], 0)
+
+        self.misses += len(keys)
+        label_idx = data['label'] if self.opt.use_label_index_input else None
+        with torch.no_grad():
+            block = netG.encode_input(label, coord, feat_map, label_idx=label_idx).half()
+        for i, key in enumerate(keys):
+            size = block[i].numel() * block[i].element_size()
+            if key in self.blocks or self.used + size > self.budget:
+                continue
+            if self.device == 'cpu':
+                # pinned only when the blocks are copied to a GPU
+                self.blocks[key] = block[i].cpu().pin_memory() if self.opt.gpu_ids != "-1" else block[i].cpu()
+            else:
+                self.blocks[key] = block[i].clone()
+            self.used += size
+        return block
+
+    def __repr__(self):
+        return 'input_feature_cache(%d frames, %.1f MB, hits %d, misses %d)' % (
+            len(self.blocks), self.used / 1024 ** 2, self.hits, self.misses)
@@ -0,0 +1,145 @@
+import os
+import csv
+import json
+import math
+
+import torch
+
+from utils.distributed import is_main_process
+
+
+class metrics_logger():
+    """Replaces losses_saver in the training loop without a device sync per loss and step.
+
+    The losses of every iteration are written into a preallocated (freq_smooth_loss, num_losses)
+    buffer on the training device. Every freq_smooth_loss iterations the window mean is copied
+    asynchronously into a pinned host tensor, and is appended to losses/losses.{jsonl,csv} once the
+    copy has finished. Plots are made on demand with plot_losses.py.
+    """
+    def __init__(self, opt, name_list):
+        self.opt = opt
+        self.names = list(name_list)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.window = opt.freq_smooth_loss
+        self.device = 'cpu' if opt.gpu_ids == "-1" else 'cuda'
+        self.buffer = torch.full((self.window, len(self.names)), float('nan'), device=self.device)
+        self.row = 0
+        self.index_tensors = {}
+        # two host copies, one can be in flight while the other is written
+        self.host = [torch.empty(len(self.names), pin_memory=self.device == 'cuda') for _ in range(2)]
+        self.slot = 0
+        self.pending = []
+
+        self.format = getattr(opt, 'metrics_format', 'jsonl')
+        path = os.path.join(opt.checkpoints_dir, opt.name, "losses")
+        os.makedirs(path, exist_ok=True)
+        self.file_name = os.path.join(path, "losses." + self.format)
+        # only rank 0 logs, the other processes never write to the file
+        if opt.continue_train and is_main_process():
+            self.truncate(opt.loaded_latest_iter)
+        new_file = not os.path.exists(self.file_name)
+        self.file = open(self.file_name, "a", newline='')
+        if self.format == 'csv':
+            self.csv_writer = csv.writer(self.file)
+            if new_file and is_main_process():
+                self.csv_writer.writerow(['iter'] + self.names)
+
+    def __call__(self, cur_iter, losses_dict):
+        self.write_ready()
+        row = self.buffer[self.row]
+        values = [(name, loss) for name, loss in losses_dict.items() if loss is not None and name in self.index]
+        if values:
+            key = tuple(name for name, _ in values)
+            if key not in self.index_tensors:
+                self.index_tensors[key] = torch.tensor([self.index[name] for name in key], device=self.device)
+            row.index_copy_(0, self.index_tensors[key], torch.stack([loss.detach().float().reshape(()) for _, loss in values]))
+        self.row += 1
+        if self.row == self.window:
+            self.flush(cur_iter)
+
+    def flush(self, cur_iter):
+        if self.row == 0:
+            return
+        rows = self.buffer[:self.row]
+        # mean over the iterations that had the loss, nan if none had it
+        mean = rows.nan_to_num(0.0).sum(0) / (~torch.isnan(rows)).sum(0)
+        self.wait_slot(self.slot)
+        self.host[self.slot].copy_(mean, non_blocking=True)
+        event = None
+        if self.device == 'cuda':
+            event = torch.cuda.Event()
+            event.record()
+        self.pending.append((event, self.slot, cur_iter))
+        self.slot = 1 - self.slot
+        self.buffer.fill_(float('nan'))
+        self.row = 0
+
+    def wait_slot(self, slot):
+        for event, pending_slot, _ in self.pending:
+            if pending_slot == slot and event is not None:
+                event.synchronize()
+        self.write_ready()
+
+    def write_ready(self):
+        while self.pending and (self.pending[0][0] is None or self.pending[0][0].query()):
+            _, slot, cur_iter = self.pending.pop(0)
+            self.write(cur_iter, self.host[slot].tolist())
+
+    def write(self, cur_iter, values):
+        values = [None if math.isnan(v) else v for v in values]
+        if self.format == 'csv':
+            self.csv_writer.writerow([cur_iter] + ['' if v is None else '%.6g' % v for v in values])
+        else:
+            self.file.write(json.dumps({'iter': cur_iter, **dict(zip(self.names, values))}) + '\n')
+        self.file.flush()
+        print('iter %d | ' % cur_iter + ' '.join('%s %.3f' % (name, v)
+                                                 for name, v in zip(self.names, values) if v is not None))
+
+    def truncate(self, last_iter):
+        # drop the lines written after the checkpoint training continues from
+        if not os.path.exists(self.file_name):
+            return
+        with open(self.file_name, newline='') as f:
+            lines = f.readlines()
+        if self.format == 'csv':
+            kept = lines[:1] + [line for line in lines[1:] if int(line.split(',')[0]) <= last_iter]
+        else:
+            kept = [line for line in lines if json.loads(line)['iter'] <= last_iter]
+        with open(self.file_name, 'w', newline='') as f:
+            f.writelines(kept)
+
+    def close(self, cur_iter=None):
+        if cur_iter is not None:
+            self.flush(cur_iter)
+        for event, _, _ in self.pending:
+            if event is not None:
+                event.synchronize()
+        self.write_ready()
+        self.file.close()
+
+
+def read_metrics(file_name):
+    """{'iter': [...], name: [...]} of a losses.jsonl / losses.csv file, None for missing values."""
+    columns = {'iter': []}
+    if file_name.endswith('.csv'):
+        with open(file_name, newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            for name in header[1:]:
+                columns[name] = []
+            for line in reader:
+                columns['iter'].append(int(line[0]))
+                for name, value in zip(header[1:], line[1:]):
+                    columns[name].append(float(value) if value != '' else None)
+    else:
+        with open(file_name) as f:
+            for line in f:
+                entry = json.loads(line)
+                for name in entry:
+                    if name not in columns:
+                        columns[name] = [None] * len(columns['iter'])
+                columns['iter'].append(entry['iter'])
+                for name in columns:
+                    if name != 'iter':
+                        columns[name].append(entry.get(name))
+    return columns
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import contextlib
+from collections import defaultdict, deque
+
+import torch
+
+# the profiler of the training run, None when --profile is not set
+_active = None
+_disabled = contextlib.nullcontext()
+
+
+def span(name):
+    """Times the enclosed code as name, nested spans are named parent/name. Does nothing without --profile."""
+    if _active is None:
+        return _disabled
+    return _active.span(name)
+
+
+class phase_profiler():
+    """Opt-in timing of the phases of a training iteration (--profile).
+
+    Every span synchronizes the device when it starts and ends, so the times are those of the phase
+    and not of the kernels queued before it. Every --profile_freq iterations a summary of the last
+    --profile_window iterations is printed and written to profile/summary.txt, and the spans of these
+    iterations to profile/trace.json (chrome://tracing or https://ui.perfetto.dev).
+    --profile_torch FIRST N additionally records iterations FIRST ... FIRST + N - 1 with torch.profiler.
+    """
+    def __init__(self, opt):
+        global _active
+        self.opt = opt
+        self.enabled = getattr(opt, 'profile', False)
+        self.torch_window = getattr(opt, 'profile_torch', None)
+        self.torch_profiler = None
+        if not self.enabled and self.torch_window is None:
+            return
+        self.cuda = opt.gpu_ids != "-1"
+        self.path = os.path.join(opt.checkpoints_dir, opt.name, "profile")
+        os.makedirs(self.path, exist_ok=True)
+        self.freq = opt.profile_freq
+        self.stack = []
+        self.step_spans = defaultdict(float)
+        self.step_events = []
+        # (span times, trace events) of the last --profile_window iterations
+        self.history = deque(maxlen=opt.profile_window)
+        self.t0 = time.perf_counter()
+        self.step_start = self.t0
+        if self.enabled:
+            _active = self
+
+    def sync(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        self.stack.append(name)
+        full_name = '/'.join(self.stack)
+        self.sync()
+        start = time.perf_counter()
+        try:
+            with torch.autograd.profiler.record_function(full_name):
+                yield
+                self.sync()
+        finally:
+            self.stack.pop()
+            self.record(full_name, start, time.perf_counter())
+
+    def record(self, name, start, end):
+        self.step_spans[name] += end - start
+        self.step_events.append({'name': name, 'ph': 'X', 'pid': getattr(self.opt, 'rank', 0), 'tid': len(name.split('/')),
+                                 'ts': (start - self.t0) * 1e6, 'dur': (end - start) * 1e6})
+
+    def iterate(self, iterable):
+        """Yields the items of iterable, the time waiting for each one is the 'data' span."""
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        # the time between the epochs is not part of an iteration
+        self.step_start = time.perf_counter()
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record('data', start, time.perf_counter())
+            yield item
+
+    def to_device(self, data):
+        """Copies the tensors of a batch to the GPU in a 'h2d' span, preprocess_input then finds them there."""
+        if not self.enabled or not self.cuda:
+            return data
+        with self.span('h2d'):
+            return {k: v.cuda(non_blocking=True) if torch.is_tensor(v) else v for k, v in data.items()}
+
+    def wrap(self, name, func):
+        """func timed as name, None stays None."""
+        if not self.enabled or func is None:
+            return func
+
+        def timed(*args, **kwargs):
+            with self.span(name):
+                return func(*args, **kwargs)
+        return timed
+
+    def step(self, cur_iter):
+        """Ends the iteration cur_iter."""
+        if self.torch_window is not None:
+            self.step_torch_profiler(cur_iter)
+        if not self.enabled:
+            return
+        self.sync()
+        now = time.perf_counter()
+        self.step_spans['step'] = now - self.step_start
+        self.step_events.append({'name': 'step %d' % cur_iter, 'ph': 'X', 'pid': getattr(self.opt, 'rank', 0), 'tid': 0,
+                                 'ts': (self.step_start - self.t0) * 1e6, 'dur': (now - self.step_start) * 1e6})
+        self.history.append((dict(self.step_spans), self.step_events))
+        self.step_spans = defaultdict(float)
+        self.step_events = []
+        self.step_start = now
+        if cur_iter % self.freq == 0:
+            self.write_summary(cur_iter)
+
+    def summary(self):
+        spans = [h for h, _ in self.history]
+        step_time = sum(h['step'] for h in spans)
+        names = sorted({name for h in spans for name in h}, key=lambda name: (name != 'step', name))
+        lines = ['%-32s %8s %10s %10s %7s' % ('phase', 'calls', 'mean ms', 'max ms', '% step')]
+        for name in names:
+            times = [h[name] for h in spans if name in h]
+            lines.append('%-32s %8d %10.2f %10.2f %6.1f%%' % (name, len(times), 1e3 * sum(times) / len(times),
+                                                             1e3 * max(times), 100 * sum(times) / step_time))
+        return '\n'.join(lines)
+
+    def write_summary(self, cur_iter):
+        table = 'iterations %d-%d\n' % (cur_iter - len(self.history) + 1, cur_iter) + self.summary()
+        print(table)
+        with open(os.path.join(self.path, "summary.txt"), "w") as f:
+            f.write(table + '\n')
+        with open(os.path.join(self.path, "trace.json"), "w") as f:
+            json.dump({'traceEvents': [e for _, events in self.history for e in events], 'displayTimeUnit': 'ms'}, f)
+
+    def step_torch_profiler(self, cur_iter):
+        first, num = self.torch_window
+        if cur_iter + 1 == first and self.torch_profiler is None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.torch_profiler = torch.profiler.profile(activities=activities, record_shapes=True)
+            self.torch_profiler.__enter__()
+        elif cur_iter + 1 == first + num and self.torch_profiler is not None:
+            self.close_torch_profiler()
+
+    def close_torch_profiler(self):
+        self.torch_profiler.__exit__(None, None, None)
+        self.torch_profiler.export_chrome_trace(os.path.join(self.path, "torch_trace.json"))
+        sort_by = 'cuda_time_total' if self.cuda else 'cpu_time_total'
+        print(self.torch_profiler.key_averages().table(sort_by=sort_by, row_limit=25))
+        self.torch_profiler = None
+
+    def close(self):
+        global _active
+        if self.torch_profiler is not None:
+            self.close_torch_profiler()
+        if _active is self:
+            _active = None
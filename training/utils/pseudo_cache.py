@@ -0,0 +1,113 @@
+import os
+import copy
+import random
+
+import numpy as np
+import torch
+
+
+def get_pseudo_cache_dir(opt):
+    if opt.pseudo_cache_dir is not None:
+        return opt.pseudo_cache_dir
+    return os.path.join(opt.checkpoints_dir, opt.name, "pseudo_cache")
+
+
+def get_cache_dataset(opt):
+    # frames in dataset order and without flip, the flip is applied when a cached image is read
+    import dataloaders.dataloaders as dataloaders
+    cache_opt = copy.copy(opt)
+    cache_opt.no_flip = True
+    cache_opt.use_pseudo_cache = False
+    return dataloaders.get_dataset(cache_opt)
+
+
+class pseudo_image_cache():
+    """K pseudo images per frame rendered by the frozen OASIS generator, together with their z.
+
+    images.npy (N, K, 3, H, W) uint8 and z.npy (N, K, z_dim) float32 are memory-mapped,
+    so dataloader workers only read the sampled entries and see refreshed ones.
+    """
+    def __init__(self, opt, mode='r'):
+        self.path = get_pseudo_cache_dir(opt)
+        self.mode = mode
+        self.images = None
+        self.z = None
+
+    def create(self, names, num_z, z_dim, height, width):
+        os.makedirs(self.path, exist_ok=True)
+        self.images = np.lib.format.open_memmap(os.path.join(self.path, 'images.npy'), mode='w+', dtype=np.uint8,
+                                                shape=(len(names), num_z, 3, height, width))
+        self.z = np.lib.format.open_memmap(os.path.join(self.path, 'z.npy'), mode='w+', dtype=np.float32,
+                                           shape=(len(names), num_z, z_dim))
+        with open(os.path.join(self.path, 'names.txt'), 'w') as f:
+            f.write('\n'.join(os.path.basename(name) for name in names))
+
+    def open(self):
+        if self.images is None:
+            self.images = np.load(os.path.join(self.path, 'images.npy'), mmap_mode=self.mode)
+            self.z = np.load(os.path.join(self.path, 'z.npy'), mmap_mode=self.mode)
+
+    def check(self, names):
+        with open(os.path.join(self.path, 'names.txt'), 'r') as f:
+            cached_names = f.read().split('\n')
+        assert cached_names == [os.path.basename(name) for name in names], \
+            'pseudo image cache %s does not match the dataset' % self.path
+
+    def sample(self, idx):
+        self.open()
+        k = random.randrange(self.images.shape[1])
+        image = torch.from_numpy(np.array(self.images[idx, k])).float() / 127.5 - 1
+        z = torch.from_numpy(np.array(self.z[idx, k]))
+        return image, z
+
+    def write(self, frame_ids, images, z):
+        self.open()
+        images = ((images + 1) * 127.5).round().clamp(0, 255).to(torch.uint8)
+        self.images[frame_ids] = images.cpu().numpy()
+        self.z[frame_ids] = z.cpu().numpy()
+        self.images.flush()
+        self.z.flush()
+
+
+def render_pseudo_images(opt, pretrained_oasis_model, dataset, frame_ids, num_z, z=None):
+    """Returns (len(frame_ids), num_z, 3, H, W) pseudo images in [-1, 1] and their z.
+    z (len(frame_ids), num_z, z_dim) is sampled when it is not given."""
+    device = 'cpu' if opt.gpu_ids == "-1" else 'cuda'
+    images, zs = [], []
+    with torch.no_grad():
+        for i, idx in enumerate(frame_ids):
+            pseudo_label_map = dataset[idx]['pseudo_label'].long().to(device)
+            pseudo_label_map = pseudo_label_map.unsqueeze(0).expand(num_z, -1, -1, -1)
+            if opt.use_label_index_input:
+                pseudo_label = pseudo_label_map
+            else:
+                _, _, h, w = pseudo_label_map.size()
+                pseudo_label = torch.zeros(num_z, 151, h, w, dtype=torch.float, device=device)
+                pseudo_label = pseudo_label.scatter_(1, pseudo_label_map, 1.0)
+            if z is None:
+                z_i = torch.randn(num_z, opt.z_dim, dtype=torch.float32, device=device)
+            else:
+                z_i = z[i].to(device)
+            images.append(pretrained_oasis_model(None, pseudo_label, "generate", None, z_i))
+            zs.append(z_i)
+    return torch.stack(images, 0), torch.stack(zs, 0)
+
+
+class pseudo_cache_refresher():
+    """Re-renders the pseudo images of pseudo_cache_refresh_frames random frames every pseudo_cache_refresh_freq iterations."""
+    def __init__(self, opt, pretrained_oasis_model):
+        self.opt = opt
+        self.pretrained_oasis_model = pretrained_oasis_model
+        self.dataset = get_cache_dataset(opt)
+        self.cache = pseudo_image_cache(opt, mode='r+')
+        self.cache.check(self.dataset.labels)
+
+    def __call__(self, cur_iter):
+        if cur_iter == 0 or cur_iter % self.opt.pseudo_cache_refresh_freq != 0:
+            return
+        self.cache.open()
+        num_frames = min(self.opt.pseudo_cache_refresh_frames, len(self.dataset))
+        frame_ids = np.sort(np.random.choice(len(self.dataset), size=num_frames, replace=False))
+        images, z = render_pseudo_images(self.opt, self.pretrained_oasis_model, self.dataset,
+                                         frame_ids, self.cache.images.shape[1])
+        self.cache.write(frame_ids, images, z)
@@ -0,0 +1,68 @@
+import torch
+
+
+class LazyAdam(torch.optim.Optimizer):
+    """Adam for sparse gradients (e.g. nn.Embedding(sparse=True)).
+
+    Only the rows present in the gradient are read and written, the bias
+    correction uses the global step as in torch.optim.SparseAdam. The state is
+    kept small: no first moment is stored when beta1 == 0, and with rowwise=True
+    the second moment is a single value per row (mean over the row) instead of
+    one per entry.
+    """
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, rowwise=False):
+        if not 0.0 <= betas[0] < 1.0 or not 0.0 <= betas[1] < 1.0:
+            raise ValueError('Invalid betas: {}'.format(betas))
+        defaults = dict(lr=lr, betas=betas, eps=eps, rowwise=rowwise)
+        super().__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                if not p.grad.is_sparse:
+                    raise ValueError('LazyAdam only supports sparse gradients')
+                grad = p.grad.coalesce()
+                rows = grad._indices()[0]
+                values = grad._values()
+                if rows.numel() == 0:
+                    continue
+
+                state = self.state[p]
+                if len(state) == 0:
+                    state['step'] = 0
+                    if beta1 > 0:
+                        state['exp_avg'] = torch.zeros_like(p)
+                    sq_shape = p.shape[:1] if group['rowwise'] else p.shape
+                    state['exp_avg_sq'] = torch.zeros(sq_shape, dtype=p.dtype, device=p.device)
+                state['step'] += 1
+                bias_correction1 = 1 - beta1 ** state['step']
+                bias_correction2 = 1 - beta2 ** state['step']
+
+                if beta1 > 0:
+                    exp_avg = state['exp_avg'][rows].mul_(beta1).add_(values, alpha=1 - beta1)
+                    state['exp_avg'][rows] = exp_avg
+                else:
+                    exp_avg = values
+
+                grad_sq = values.pow(2)
+                if group['rowwise']:
+                    grad_sq = grad_sq.mean(1)
+                exp_avg_sq = state['exp_avg_sq'][rows].mul_(beta2).add_(grad_sq, alpha=1 - beta2)
+                state['exp_avg_sq'][rows] = exp_avg_sq
+
+                denom = (exp_avg_sq / bias_correction2).sqrt_().add_(group['eps'])
+                if group['rowwise']:
+                    denom = denom.unsqueeze(1)
+                update = exp_avg / denom * (-group['lr'] / bias_correction1)
+                p.index_add_(0, rows, update)
+
+        return loss
@@ -3,7 +3,11 @@ import numpy as np
 import random
 import time
 import os
+import contextlib
 import models.models as models
+from models.util import get_autocast
+from utils.image_writer import image_writer
+import utils.profiler as utils_profiler
 import matplotlib.pyplot as plt
 from PIL import Image
 
@@ -19,6 +23,60 @@ def fix_seed(seed):
     np.random.seed(seed)
 
 
+def accumulate_gradients(opt, model, scaler, *args, **kwargs):
+    """Runs model(*args, **kwargs) on opt.accum_steps micro-batches and backpropagates each of them.
+
+    Tensors (and tuples of tensors) with the batch size as first dimension are split, everything else
+    is passed on. The micro-batch losses are weighted by their share of the batch, so the accumulated
+    gradients and the returned (loss, losses_dict, ...) are those of the whole batch; extra outputs,
+    like the fake of --reuse_fake_for_D, are concatenated again.
+    """
+    reference = next(x for x in list(args) + list(kwargs.values()) if torch.is_tensor(x) and x.dim() > 0)
+    batch_size = reference.size(0)
+    num_chunks = min(getattr(opt, 'accum_steps', 1), batch_size)
+    weights = [x.size(0) / batch_size for x in reference.tensor_split(num_chunks, dim=0)]
+
+    def split(x):
+        if torch.is_tensor(x) and x.dim() > 0 and x.size(0) == batch_size:
+            return x.tensor_split(num_chunks, dim=0)
+        if isinstance(x, tuple) and len(x) > 0 and all(torch.is_tensor(t) for t in x):
+            return list(zip(*[t.tensor_split(num_chunks, dim=0) for t in x]))
+        return [x] * num_chunks
+
+    args_chunks = [split(x) for x in args]
+    kwargs_chunks = {name: split(x) for name, x in kwargs.items()}
+    loss, losses_dict, extras = 0, None, None
+    for i in range(num_chunks):
+        args_i = [x[i] for x in args_chunks]
+        kwargs_i = {name: x[i] for name, x in kwargs_chunks.items()}
+        # DDP all-reduces the gradients once, in the backward of the last micro-batch
+        no_sync = (isinstance(model, torch.nn.parallel.DistributedDataParallel) and i < num_chunks - 1)
+        with model.no_sync() if no_sync else contextlib.nullcontext():
+            with utils_profiler.span('forward'), get_autocast(opt):
+                outputs = model(*args_i, **kwargs_i)
+            loss_i = outputs[0].float().mean()
+            with utils_profiler.span('backward'):
+                scaler.scale(loss_i * weights[i]).backward()
+
+        loss = loss + loss_i.detach() * weights[i]
+        if losses_dict is None:
+            losses_dict = {name: None for name in outputs[1]}
+        for name, value in outputs[1].items():
+            if value is not None:
+                value = value.detach().float().mean() * weights[i]
+                losses_dict[name] = value if losses_dict[name] is None else losses_dict[name] + value
+        if len(outputs) > 2:
+            extras = [[] for _ in outputs[2:]] if extras is None else extras
+            for extra, output in zip(extras, outputs[2:]):
+                extra.append(output)
+
+    if extras is None:
+        return loss, losses_dict
+    extras = [tuple(torch.cat(ts, dim=0) for ts in zip(*extra)) if isinstance(extra[0], tuple)
+              else torch.cat(extra, dim=0) for extra in extras]
+    return (loss, losses_dict, *extras)
+
+
 def get_start_iters(start_iter, dataset_size):
     if start_iter == 0:
         return 0, 0
@@ -156,31 +214,60 @@ class losses_saver():
         plt.close(fig)
 
 
-def update_EMA(model, cur_iter, dataloader, opt, force_run_stats=False):
-    model_ = model.module if isinstance(model, torch.nn.DataParallel) else model
-
-    # update weights based on new generator weights
-    with torch.no_grad():
-        for key in model_.netEMA.state_dict():
-            model_.netEMA.state_dict()[key].data.copy_(
-                model_.netEMA.state_dict()[key].data * opt.EMA_decay +
-                model_.netG.state_dict()[key].data * (1 - opt.EMA_decay)
-            )
-    # collect running stats for batchnorm before FID computation, image or network saving
-    condition_run_stats = (force_run_stats or
-                           cur_iter % opt.freq_print == 0 or
-                           cur_iter % opt.freq_fid == 0 or
-                           cur_iter % opt.freq_save_ckpt == 0 or
-                           cur_iter % opt.freq_save_latest == 0
-                           )
-    if condition_run_stats:
+class ema_updater():
+    def __init__(self, opt, model):
+        self.opt = opt
+        model_ = model.module if isinstance(model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)) else model
+
+        # flat lists of the netEMA / netG tensors, float ones are averaged and the rest is copied
+        ema_tensors = dict(model_.netEMA.named_parameters())
+        ema_tensors.update(model_.netEMA.named_buffers())
+        self.ema_avg, self.avg, self.ema_copy, self.copy = [], [], [], []
+        for name, tensor in list(model_.netG.named_parameters()) + list(model_.netG.named_buffers()):
+            if tensor.is_floating_point():
+                self.ema_avg.append(ema_tensors[name].data)
+                self.avg.append(tensor.data)
+            else:
+                self.ema_copy.append(ema_tensors[name].data)
+                self.copy.append(tensor.data)
+        self.has_batchnorm = any(isinstance(m, torch.nn.modules.batchnorm._BatchNorm)
+                                 for m in model_.netEMA.modules())
+
+    def __call__(self, model, cur_iter, dataloader, preprocess_input_func, force_run_stats=False):
+        # every freq_EMA iterations, with the decay of freq_EMA single steps
+        if cur_iter % self.opt.freq_EMA == 0:
+            decay = self.opt.EMA_decay ** self.opt.freq_EMA
+            with torch.no_grad():
+                torch._foreach_mul_(self.ema_avg, decay)
+                torch._foreach_add_(self.ema_avg, self.avg, alpha=1 - decay)
+                for ema_tensor, tensor in zip(self.ema_copy, self.copy):
+                    ema_tensor.copy_(tensor)
+
+        # collect running stats for batchnorm before FID computation, image or network saving
+        condition_run_stats = (force_run_stats or
+                               cur_iter % self.opt.freq_print == 0 or
+                               cur_iter % self.opt.freq_fid == 0 or
+                               cur_iter % self.opt.freq_save_ckpt == 0 or
+                               cur_iter % self.opt.freq_save_latest == 0
+                               )
+        if condition_run_stats and self.has_batchnorm:
+            self.run_stats(model, dataloader, preprocess_input_func)
+
+    def run_stats(self, model, dataloader, preprocess_input_func, num_upd=50):
+        model_ = model.module if isinstance(model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)) else model
         with torch.no_grad():
-            num_upd = 0
             for i, data_i in enumerate(dataloader):
-                fake_label, coord_image, real_image, real_label = models.preprocess_input(opt, data_i)
-                fake = model_.netEMA(fake_label, coord_image)
-                num_upd += 1
-                if num_upd > 50:
+                inputs = preprocess_input_func(self.opt, data_i)
+                if self.opt.model in surface_feat_model_list:
+                    label, coord_image, embed_idx_map = inputs[0], inputs[1], inputs[5]
+                    feat_map = inputs[6] if self.opt.use_3dfeat else None
+                    if self.opt.use_point_embedding:
+                        model_.netEMA(label, embed_idx_map, feat=feat_map)
+                    else:
+                        model_.netEMA(label, coord_image, feat=feat_map)
+                else:
+                    model_.netEMA(inputs[0], inputs[1])
+                if i >= num_upd:
                     break
 
 
@@ -188,7 +275,7 @@ def save_networks(opt, cur_iter, model, latest=False, best=False):
     path = os.path.join(opt.checkpoints_dir, opt.name, "models")
     os.makedirs(path, exist_ok=True)
 
-    model_ = model.module if isinstance(model, torch.nn.DataParallel) else model
+    model_ = model.module if isinstance(model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)) else model
 
     if opt.model in class_specific_model_list:
         if latest:
@@ -257,6 +344,11 @@ def save_networks(opt, cur_iter, model, latest=False, best=False):
 
 
 class image_saver():
+    """Image grids of a training batch every --freq_print iterations.
+
+    The generate forwards run here, the first rows * cols samples are then copied to the host as uint8
+    images / label indices and written by an image_writer process (in this process with --no_vis_worker).
+    """
     def __init__(self, opt):
         self.cols = 4
         self.rows = 3
@@ -265,11 +357,18 @@ class image_saver():
         self.opt = opt
         self.num_cl = opt.label_nc + 2
         os.makedirs(self.path, exist_ok=True)
+        self.writer = image_writer(self.path, labelcolormap(self.num_cl)[:self.num_cl], self.cols,
+                                   queue_size=opt.vis_queue_size, background=not opt.no_vis_worker)
 
     def visualize_batch(self, model, fake_label, coord_image, real_image, real_label, pseudo_image, cur_iter,
                         z_vec=None, embed_idx_map=None, feat_map=None, cs_real_image=None, cs_real_label=None):
-        self.save_images(fake_label, "fake_label", cur_iter, is_label=True)
-        self.save_images(real_label, "real_label", cur_iter, is_label=True)
+        if self.writer.full():
+            # the writer has not finished the previous iterations, skip the forwards as well
+            self.writer.drop(cur_iter)
+            return
+        images = {}
+        images["fake_label"] = self.to_host(fake_label, is_label=True)
+        images["real_label"] = self.to_host(real_label, is_label=True)
         with torch.no_grad():
             model.eval()
             if self.opt.model in style_recon_model_list or 'style_interpolation' in self.opt.model:
@@ -289,45 +388,45 @@ class image_saver():
                 fake = model(fake_label, coord_image, None, None, "generate", None)
 
             if self.opt.model in oasis_3dcoord_model_list or self.opt.model in surface_feat_model_list:
-                self.save_images(fake1, "fake1", cur_iter)
-                self.save_images(fake2, "fake2", cur_iter)
+                images["fake1"] = self.to_host(fake1)
+                images["fake2"] = self.to_host(fake2)
             elif self.opt.model in class_specific_model_list:
-                self.save_images(fake, "fake", cur_iter)
-                self.save_images(cs_fake_cr, "cs_fake", cur_iter)
-                self.save_images(cs_real_image_cr, "cs_real_image", cur_iter)
-                self.save_images(cs_real_label_cr, "cs_real_label", cur_iter, is_label=True)
+                images["fake"] = self.to_host(fake)
+                images["cs_fake"] = self.to_host(cs_fake_cr)
+                images["cs_real_image"] = self.to_host(cs_real_image_cr)
+                images["cs_real_label"] = self.to_host(cs_real_label_cr, is_label=True)
             else:
-                self.save_images(fake, "fake", cur_iter)
+                images["fake"] = self.to_host(fake)
             model.train()
             if not self.opt.no_EMA:
                 model.eval()
-                model_ = model.module if isinstance(model, torch.nn.DataParallel) else model
+                model_ = model.module if isinstance(model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)) else model
                 fake = model_.netEMA(fake_label, coord_image)
-                self.save_images(fake, "fake_ema", cur_iter)
+                images["fake_ema"] = self.to_host(fake)
                 model.train()
 
         if self.opt.use_D_dontcare_fake_mask:
             mask = (real_label[:, 0] == 1)
             real_mask = torch.stack([mask, mask, mask], dim=1)
             real_image[real_mask] = fake[real_mask]
-        self.save_images(real_image, "real_image", cur_iter)
+        images["real_image"] = self.to_host(real_image)
         if not self.opt.model in class_specific_model_list:
-            self.save_images(pseudo_image, "pseudo_image", cur_iter)
+            images["pseudo_image"] = self.to_host(pseudo_image)
+        self.writer.put(cur_iter, images)
+
+    def to_host(self, batch, is_label=False):
+        """uint8 (N, H, W, 3) images in [0, 255] or (N, H, W) label indices of the first rows * cols samples."""
+        if batch is None:
+            return None
+        batch = batch[:self.rows * self.cols].detach()
+        if is_label:
+            batch = batch.argmax(1).to(torch.uint8 if self.num_cl <= 256 else torch.int16)
+        else:
+            batch = ((batch.float() + 1) / 2).clamp(0, 1).mul(255).round().to(torch.uint8).permute(0, 2, 3, 1)
+        return batch.cpu().numpy()
 
-    def save_images(self, batch, name, cur_iter, is_label=False):
-        fig = plt.figure()
-        for i in range(min(self.rows * self.cols, len(batch))):
-            if is_label:
-                im = tens_to_lab(batch[i], self.num_cl)
-            else:
-                im = tens_to_im(batch[i])
-            plt.axis("off")
-            fig.add_subplot(self.rows, self.cols, i + 1)
-            plt.axis("off")
-            plt.imshow(im)
-        fig.tight_layout()
-        plt.savefig(self.path + str(cur_iter) + "_" + name)
-        plt.close()
+    def close(self):
+        self.writer.close()
 
 
 def tens_to_im(tens):